@@ -15,7 +15,15 @@ CODER_MODEL = os.getenv("CODER_MODEL", "qwen-code-model")
 
 MAX_LENGTH_TS = 1024
 
-# Ports
+# Ports: previews lease ports from PREVIEW_PORT_BASE .. +COUNT-1 (docker-compose exposes 8010-8110).
+# At most PREVIEW_MAX_LIVE apps run at once; ones idle for PREVIEW_IDLE_SECONDS are stopped.
 PREVIEW_PORT_BASE = 8010 
+PREVIEW_PORT_COUNT = int(os.getenv("PREVIEW_PORT_COUNT", "101"))
+PREVIEW_MAX_LIVE = int(os.getenv("PREVIEW_MAX_LIVE", "20"))
+PREVIEW_IDLE_SECONDS = float(os.getenv("PREVIEW_IDLE_SECONDS", "1800"))
+PREVIEW_REAP_INTERVAL = float(os.getenv("PREVIEW_REAP_INTERVAL", "60"))
+# Port leases live in the DB so API processes never share a port; the reaper renews
+# them, and a lease not renewed for this long (process gone) can be taken over.
+PREVIEW_LEASE_SECONDS = float(os.getenv("PREVIEW_LEASE_SECONDS", "300"))
 
 os.makedirs(STORAGE_DIR, exist_ok=True)
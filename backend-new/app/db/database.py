@@ -36,6 +36,12 @@ def init_db():
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (run_id) REFERENCES runs (id)
         );
+        CREATE TABLE IF NOT EXISTS preview_leases (
+            port INTEGER PRIMARY KEY,
+            run_id INTEGER NOT NULL UNIQUE,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
     ''')
     # Safe migration: add user_id column to existing DBs
     try:
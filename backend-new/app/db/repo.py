@@ -1,3 +1,5 @@
+import sqlite3
+import time
 from app.db.database import get_db
 
 def create_project(name: str, user_id: str = None):
@@ -71,3 +73,73 @@ def get_latest_run(project_id: int):
     row = c.fetchone()
     conn.close()
     return row["id"] if row else None
+
+# Preview port leases: one row per port, shared by every API process on this DB.
+# expires_at is a unix timestamp; the owning process keeps renewing it.
+
+def get_port_lease(run_id: int):
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("SELECT * FROM preview_leases WHERE run_id = ?", (run_id,))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def list_port_leases():
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("SELECT * FROM preview_leases WHERE expires_at >= ? ORDER BY port", (time.time(),))
+    rows = c.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def try_lease_port(port: int, run_id: int, owner: str, lease_seconds: float) -> bool:
+    """Lease port to run_id unless a live lease holds it; the primary key settles races."""
+    now = time.time()
+    conn = get_db()
+    c = conn.cursor()
+    try:
+        # A lease its owner stopped renewing (crashed process) is up for grabs
+        c.execute("DELETE FROM preview_leases WHERE port = ? AND expires_at < ?", (port, now))
+        c.execute(
+            "INSERT INTO preview_leases (port, run_id, owner, expires_at) VALUES (?, ?, ?, ?)",
+            (port, run_id, owner, now + lease_seconds),
+        )
+        conn.commit()
+        return True
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def renew_port_lease(run_id: int, owner: str, lease_seconds: float) -> bool:
+    """Extend the run's lease, taking it over from the process that held it before."""
+    conn = get_db()
+    c = conn.cursor()
+    c.execute(
+        "UPDATE preview_leases SET owner = ?, expires_at = ? WHERE run_id = ?",
+        (owner, time.time() + lease_seconds, run_id),
+    )
+    conn.commit()
+    conn.close()
+    return c.rowcount == 1
+
+def renew_port_leases(owner: str, lease_seconds: float) -> int:
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("UPDATE preview_leases SET expires_at = ? WHERE owner = ?", (time.time() + lease_seconds, owner))
+    conn.commit()
+    conn.close()
+    return c.rowcount
+
+def release_port(run_id: int):
+    lease = get_port_lease(run_id)
+    if lease is None:
+        return None
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("DELETE FROM preview_leases WHERE run_id = ?", (run_id,))
+    conn.commit()
+    conn.close()
+    return lease["port"]
@@ -8,9 +8,12 @@ import asyncio
 from typing import Optional, List, Dict
 from pathlib import Path
 
-from app.db.repo import list_projects, create_project, create_run, get_run, list_logs, get_latest_run
-from app.core.config import STORAGE_DIR
-from app.pipeline.manager import run_pipeline, run_modification_pipeline
+from app.db.repo import list_projects, create_project, create_run, get_run, list_logs, get_latest_run, update_run_status
+from app.core.config import STORAGE_DIR, PREVIEW_REAP_INTERVAL, PREVIEW_IDLE_SECONDS
+from app.pipeline.manager import (
+    run_pipeline, run_modification_pipeline, load_checkpoint, run_tracked, cancel_run,
+    reap_forever, release_preview, previews, PROCESS_REGISTRY,
+)
 
 app = FastAPI(title="Prompt2Product Modular Backend")
 
@@ -22,6 +25,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+_preview_reaper = None
+
+@app.on_event("startup")
+async def start_preview_reaper():
+    global _preview_reaper
+    _preview_reaper = asyncio.create_task(reap_forever(PREVIEW_REAP_INTERVAL, PREVIEW_IDLE_SECONDS))
+
+@app.on_event("shutdown")
+async def stop_previews():
+    if _preview_reaper is not None:
+        _preview_reaper.cancel()
+    # Port leases live in this process; don't leave their apps running without one
+    for run_id in list(PROCESS_REGISTRY):
+        await asyncio.to_thread(release_preview, run_id)
+
 class CreateProjectRequest(BaseModel):
     name: str
     user_id: Optional[str] = None
@@ -48,11 +66,13 @@ def fetch_latest_run(project_id: int):
         raise HTTPException(status_code=404, detail="No runs found for this project")
     return {"run_id": run_id}
 
-def run_background_pipeline(run_id: int, project_id: int, prompt: str):
-    asyncio.run(run_pipeline(run_id, project_id, prompt))
+# Async background tasks run on the server loop instead of a fresh loop per run in a
+# threadpool thread; the pipeline offloads its blocking steps to worker threads.
+async def run_background_pipeline(run_id: int, project_id: int, prompt: str, resume: bool = False):
+    await run_tracked(run_id, run_pipeline(run_id, project_id, prompt, resume=resume))
 
-def run_background_modification(run_id: int, project_id: int, prompt: str):
-    asyncio.run(run_modification_pipeline(run_id, project_id, prompt))
+async def run_background_modification(run_id: int, project_id: int, prompt: str):
+    await run_tracked(run_id, run_modification_pipeline(run_id, project_id, prompt))
 
 @app.post("/projects/{project_id}/runs")
 def start_generation_run(project_id: int, payload: CreateRunRequest, background_tasks: BackgroundTasks):
@@ -67,12 +87,42 @@ def fetch_run(run_id: int):
         raise HTTPException(status_code=404, detail="Run not found")
     return run
 
+@app.post("/runs/{run_id}/resume")
+def resume_run(run_id: int, background_tasks: BackgroundTasks):
+    run = get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run["status"] == "running":
+        raise HTTPException(status_code=409, detail="Run is already in progress")
+    output_dir = os.path.join(STORAGE_DIR, f"project_{run['project_id']}", f"run_{run_id}")
+    prompt = load_checkpoint(output_dir).get("user_prompt")
+    if not prompt:
+        raise HTTPException(status_code=409, detail="Run has no checkpoint to resume from")
+    update_run_status(run_id, 'pending')
+    background_tasks.add_task(run_background_pipeline, run_id, run["project_id"], prompt, True)
+    return {"run_id": run_id, "status": "resuming"}
+
+@app.post("/runs/{run_id}/cancel")
+async def cancel_generation_run(run_id: int):
+    run = get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run["status"] not in ("pending", "queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Run is not in progress (status: {run['status']})")
+    await cancel_run(run_id)
+    return {"run_id": run_id, "status": "cancelled"}
+
+@app.get("/previews")
+def list_previews():
+    return previews()
+
 @app.get("/runs/{run_id}/logs")
 def fetch_logs(run_id: int):
     return list_logs(run_id)
 
 @app.post("/projects/{project_id}/runs/{run_id}/modify")
 def modify_run(project_id: int, run_id: int, payload: ModifyRunRequest, background_tasks: BackgroundTasks):
+    update_run_status(run_id, 'pending')
     background_tasks.add_task(run_background_modification, run_id, project_id, payload.prompt)
     return {"message": "Modification started in background."}
 
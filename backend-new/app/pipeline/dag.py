@@ -0,0 +1,112 @@
+# The same module is backend/app/services/dag.py and backend-new/app/pipeline/dag.py:
+# the two apps are built from separate Docker contexts and each has its own `app`
+# package, so neither can import the other's. Keep the copies identical
+# (backend/tests/test_dag.py checks).
+from __future__ import annotations
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+NodeFn = Callable[..., Awaitable[Any]]
+NodeHook = Callable[["NodeTiming"], Awaitable[None]]
+
+
+@dataclass
+class NodeTiming:
+    name: str
+    status: str = "pending"  # pending | running | ok | failed | cancelled
+    started: float | None = None  # time.time()
+    duration_s: float | None = None
+    waited_s: float | None = None  # time between DAG start and node start (dependencies)
+
+
+@dataclass
+class _Node:
+    name: str
+    fn: NodeFn
+    deps: tuple[str, ...] = ()
+    timing: NodeTiming = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.timing = NodeTiming(self.name)
+
+
+class DAG:
+    """
+    Minimal async stage graph. Each node is an async callable that receives its
+    dependencies' results as keyword arguments (named after the dependency) and starts
+    as soon as they are done, so independent nodes run concurrently. The first failure
+    cancels everything still running and is re-raised from run().
+    """
+    def __init__(self, on_node_done: NodeHook | None = None):
+        self.nodes: dict[str, _Node] = {}
+        self.on_node_done = on_node_done
+
+    def add(self, name: str, fn: NodeFn, deps: tuple[str, ...] | list[str] = ()) -> None:
+        if name in self.nodes:
+            raise ValueError(f"Duplicate DAG node: {name}")
+        self.nodes[name] = _Node(name, fn, tuple(deps))
+
+    def _order(self) -> list[str]:
+        order: list[str] = []
+        state: dict[str, int] = {}  # 1 = visiting, 2 = done
+
+        def visit(name: str, path: tuple[str, ...]) -> None:
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"Cycle in DAG: {' -> '.join(path + (name,))}")
+            if name not in self.nodes:
+                raise ValueError(f"Unknown DAG dependency: {name} (needed by {path[-1] if path else '?'})")
+            state[name] = 1
+            for dep in self.nodes[name].deps:
+                visit(dep, path + (name,))
+            state[name] = 2
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name, ())
+        return order
+
+    async def run(self) -> dict[str, Any]:
+        order = self._order()
+        t0 = time.monotonic()
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run_node(node: _Node) -> Any:
+            inputs = {dep: await tasks[dep] for dep in node.deps}
+            timing = node.timing
+            timing.status = "running"
+            timing.started = time.time()
+            timing.waited_s = time.monotonic() - t0
+            start = time.monotonic()
+            try:
+                result = await node.fn(**inputs)
+            except asyncio.CancelledError:
+                timing.status = "cancelled"
+                raise
+            except BaseException:
+                timing.status = "failed"
+                raise
+            else:
+                timing.status = "ok"
+                return result
+            finally:
+                timing.duration_s = time.monotonic() - start
+                if self.on_node_done is not None and timing.status in ("ok", "failed"):
+                    await self.on_node_done(timing)
+
+        for name in order:
+            tasks[name] = asyncio.ensure_future(run_node(self.nodes[name]))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {name: task.result() for name, task in tasks.items()}
+
+    def timings(self) -> list[NodeTiming]:
+        return [node.timing for node in self.nodes.values()]
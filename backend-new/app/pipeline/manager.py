@@ -1,7 +1,9 @@
 import os
+import asyncio
 import json
+import time
 from datetime import datetime
-from app.core.config import STORAGE_DIR, PREVIEW_PORT_BASE
+from app.core.config import STORAGE_DIR, PREVIEW_PORT_BASE, PREVIEW_PORT_COUNT, PREVIEW_MAX_LIVE, PREVIEW_LEASE_SECONDS
 from app.db.repo import get_run, update_run_status, log_message
 from app.pipeline.stage0_enhance import enhance_prompt_async
 from app.pipeline.stage1_taskspec import generate_taskspec
@@ -10,7 +12,9 @@ from app.pipeline.stage3_extract import (
     safe_parse, normalize_result, extract_files, 
     run_sanity_tests, run_correctness_tests, repair_with_error
 )
-from app.pipeline.stage4_sandbox import run_sandbox_async
+from app.pipeline.stage4_sandbox import run_sandbox_async, prepare_venv, PREVIEW_LOG
+from app.pipeline.ports import PortPool
+from app.pipeline.dag import DAG
 from app.pipeline.stage5_modify import apply_modification_async
 import shutil
 
@@ -30,87 +34,301 @@ def stop_run(run_id: int):
         return True
     return False
 
-async def run_pipeline(run_id: int, project_id: int, prompt: str):
+# Preview ports leased per run, and each live preview's log (for idle detection)
+PORTS = PortPool(PREVIEW_PORT_BASE, PREVIEW_PORT_COUNT, PREVIEW_LEASE_SECONDS)
+PREVIEW_LOGS = {}
+
+def _last_activity(run_id: int) -> float:
+    try:
+        return os.path.getmtime(PREVIEW_LOGS[run_id])
+    except (KeyError, OSError):
+        return 0.0
+
+def release_preview(run_id: int):
+    """Stop the run's app and give its port back to the pool."""
+    stopped = stop_run(run_id)
+    PREVIEW_LOGS.pop(run_id, None)
+    PORTS.release(run_id)
+    return stopped
+
+def _preview_stopped(run_id: int, reason: str):
+    """Stop a live preview; a successful run is marked 'stopped' since nothing serves it any more."""
+    release_preview(run_id)
+    log_message(run_id, 'preview', f"Preview stopped ({reason}); its port was released. Resume or modify the run to start it again.", 'WARNING')
+    run = get_run(run_id)
+    if run and run["status"] == "success":
+        update_run_status(run_id, 'stopped')
+
+def _evict_lru(exclude: int, reason: str):
+    live = [(_last_activity(rid), rid) for rid in PROCESS_REGISTRY if rid != exclude]
+    if not live:
+        return None
+    run_id = min(live)[1]
+    _preview_stopped(run_id, reason)
+    return run_id
+
+def lease_port(run_id: int):
+    """The run's preview port; stops the least recently used preview if the pool is exhausted."""
+    port = PORTS.lease(run_id)
+    if port is None and _evict_lru(run_id, "port pool exhausted") is not None:
+        port = PORTS.lease(run_id)
+    return port
+
+def make_room(run_id: int):
+    """Keep live previews under PREVIEW_MAX_LIVE before starting another one."""
+    while sum(1 for rid in PROCESS_REGISTRY if rid != run_id) >= max(1, PREVIEW_MAX_LIVE):
+        if _evict_lru(run_id, "too many live previews") is None:
+            break
+
+def reap_idle(idle_seconds: float) -> list:
+    """Stop previews that exited or whose log hasn't been written to (no requests) for idle_seconds."""
+    reaped = []
+    now = time.time()
+    for run_id, proc in list(PROCESS_REGISTRY.items()):
+        if proc.poll() is not None:
+            reason = f"app exited with code {proc.returncode}"
+        elif now - _last_activity(run_id) > idle_seconds:
+            reason = f"idle for {int(now - _last_activity(run_id))}s"
+        else:
+            continue
+        _preview_stopped(run_id, reason)
+        reaped.append(run_id)
+    return reaped
+
+async def reap_forever(interval: float, idle_seconds: float):
+    """Reap idle previews and renew this process's port leases every interval."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(PORTS.renew)
+            await asyncio.to_thread(reap_idle, idle_seconds)
+        except Exception as e:
+            print(f"[PREVIEW] reaper error: {e}")
+
+def previews() -> list:
+    now = time.time()
+    return [
+        {
+            "run_id": run_id,
+            "port": port,
+            "live": run_id in PROCESS_REGISTRY,
+            "idle_s": round(now - _last_activity(run_id), 1) if run_id in PROCESS_REGISTRY else None,
+        }
+        for run_id, port in sorted(PORTS.leases().items())
+    ]
+
+# Pipeline / modification tasks by run id, so cancel_run() can stop them
+TASK_REGISTRY = {}
+_CANCEL_REQUESTED = set()
+
+async def run_tracked(run_id: int, coro):
+    """Run a pipeline coroutine as its own task, registered for cancel_run()."""
+    run = get_run(run_id)
+    if run and run["status"] == 'cancelled':
+        # Cancelled before the background task got to start
+        coro.close()
+        return
+    task = asyncio.ensure_future(coro)
+    TASK_REGISTRY[run_id] = task
+    try:
+        await task
+    except asyncio.CancelledError:
+        if run_id not in _CANCEL_REQUESTED:
+            raise
+    finally:
+        _CANCEL_REQUESTED.discard(run_id)
+        if TASK_REGISTRY.get(run_id) is task:
+            del TASK_REGISTRY[run_id]
+
+async def cancel_run(run_id: int) -> bool:
+    """
+    Cancel a run's pipeline task (closing its model streams and killing pip), stop its
+    app so the preview port is free again, and mark it cancelled. Steps running in
+    worker threads (TaskSpec model, correctness tests) finish on their own.
+    """
+    task = TASK_REGISTRY.get(run_id)
+    if task is not None:
+        _CANCEL_REQUESTED.add(run_id)
+        task.cancel()
+        await asyncio.wait([task], timeout=30)
+    stopped = await asyncio.to_thread(release_preview, run_id)
+    update_run_status(run_id, 'cancelled')
+    log_message(run_id, 'cancel', "Run cancelled; stopped its processes and released the preview port", 'WARNING')
+    return task is not None or stopped
+
+CHECKPOINT_FILE = "pipeline_output.json"
+
+def load_checkpoint(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, CHECKPOINT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_checkpoint(output_dir: str, stage: str, **fields) -> dict:
+    """
+    Merge fields into pipeline_output.json and mark stage complete. Written after every
+    stage (atomically) so a resumed run can skip whatever already finished.
+    """
+    data = load_checkpoint(output_dir)
+    data.update(fields)
+    stages = data.setdefault("completed_stages", [])
+    if stage not in stages:
+        stages.append(stage)
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+    return data
+
+# Survive a workspace reset: the checkpoint, and the venv (it doesn't depend on the code)
+KEEP_ON_RESET = {CHECKPOINT_FILE, "venv"}
+
+def reset_workspace(output_dir: str):
+    """Clear generated files but keep the checkpoint and venv."""
+    if os.path.isdir(output_dir):
+        for name in os.listdir(output_dir):
+            if name in KEEP_ON_RESET:
+                continue
+            path = os.path.join(output_dir, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    os.makedirs(output_dir, exist_ok=True)
+
+async def run_pipeline(run_id: int, project_id: int, prompt: str, resume: bool = False):
     def log(stage: str, msg: str, level: str = 'INFO'):
         print(f"[{stage.upper()}] {msg}")
         log_message(run_id, stage, msg, level)
 
     update_run_status(run_id, 'running')
-    port = PREVIEW_PORT_BASE + run_id
+    port = await asyncio.to_thread(lease_port, run_id)
+    if port is None:
+        log('fatal', "No free preview port (all in use by running builds).", 'ERROR')
+        update_run_status(run_id, 'failed')
+        return
     output_dir = os.path.join(STORAGE_DIR, f"project_{project_id}", f"run_{run_id}")
     os.makedirs(output_dir, exist_ok=True)
     
-    try:
-        # Stage 0
+    ckpt = await asyncio.to_thread(load_checkpoint, output_dir) if resume else {}
+    if ckpt.get("user_prompt") != prompt:
+        ckpt = {}
+    elif ckpt.get("completed_stages"):
+        log('resume', f"Resuming after stages: {', '.join(ckpt['completed_stages'])}")
+
+    # Stages run as a DAG: the venv (plus baseline packages) is prepared while the
+    # models work, and the static sanity checks run alongside file extraction.
+    async def enhance():
+        if "enhanced_prompt" in ckpt:
+            log('enhance', "Enhanced prompt restored from checkpoint.")
+            return ckpt["enhanced_prompt"]
+        # A fresh run starts a fresh checkpoint
+        await asyncio.to_thread(reset_workspace, output_dir)
+        if os.path.exists(os.path.join(output_dir, CHECKPOINT_FILE)):
+            os.remove(os.path.join(output_dir, CHECKPOINT_FILE))
         log('enhance', f"Analyzing prompt: {prompt}")
         enhanced_prompt = await enhance_prompt_async(prompt)
         if enhanced_prompt != prompt:
             log('enhance', f"Successfully enhanced prompt: {enhanced_prompt}")
         else:
             log('enhance', "Prompt detail is sufficient, enhancement skipped.")
+        await asyncio.to_thread(save_checkpoint, output_dir, "enhance", user_prompt=prompt, enhanced_prompt=enhanced_prompt)
+        return enhanced_prompt
 
-        # Stage 1
+    async def spec(enhance):
+        if "taskspec" in ckpt:
+            log('spec', "TaskSpec restored from checkpoint.")
+            return ckpt["taskspec"]
         log('spec', "Loading TaskSpec unsloth model and generating specifications...")
-        _, taskspec = generate_taskspec(enhanced_prompt)
+        _, taskspec = await asyncio.to_thread(generate_taskspec, enhance)
         log('spec', f"Generated TaskSpec. Features: {len(taskspec.get('frontend',{}).get('features',[]))}")
+        await asyncio.to_thread(save_checkpoint, output_dir, "spec", taskspec=taskspec)
+        return taskspec
+
+    async def codegen(spec):
+        result = ckpt.get("result")
+        if result is not None:
+            log('codegen', "Generated code restored from checkpoint.")
+        else:
+            raw_path = os.path.join(output_dir, "raw_model_output.txt")
+            if "codegen" in ckpt.get("completed_stages", []) and os.path.exists(raw_path):
+                with open(raw_path, encoding="utf-8") as f:
+                    raw_code = f.read()
+                log('codegen', "Re-using raw model output from the previous attempt.")
+            else:
+                log('codegen', "Initiating deep synthesis with GIKI-Coder...")
+                log('plan', "Formulating application architecture and dependencies...")
+
+                # Start from a clean workspace; the checkpoint and venv are kept
+                await asyncio.to_thread(reset_workspace, output_dir)
+                raw_code = await generate_code_async(spec)
+                log('codegen', "Full application logic received from model.")
+
+                # Debug: Save raw output immediately
+                with open(raw_path, "w", encoding="utf-8") as f:
+                    f.write(raw_code)
+                await asyncio.to_thread(save_checkpoint, output_dir, "codegen")
+
+            # Parse and Normalize
+            result = safe_parse(raw_code)
+            if result is None:
+                raise ValueError("Could not parse JSON output from model")
+            result = normalize_result(result)
+            await asyncio.to_thread(save_checkpoint, output_dir, "parse", result=result)
 
-        # Stage 2
-        log('codegen', "Initiating deep synthesis with GIKI-Coder...")
-        log('plan', "Formulating application architecture and dependencies...")
-        raw_code = await generate_code_async(taskspec)
-        log('codegen', "Full application logic received from model.")
-
-        # Debug: Save raw output immediately
-        with open(os.path.join(output_dir, "raw_model_output.txt"), "w", encoding="utf-8") as f:
-            f.write(raw_code)
-
-        # Parse and Normalize
-        result = safe_parse(raw_code)
-        if result is None:
-            raise ValueError("Could not parse JSON output from model")
-        result = normalize_result(result)
-        
         # Phase Reporting
         log('plan', f"Strategic Plan: {result.get('plan', 'Standard implementation flow')}")
         log('manifest', f"Project Manifest: {', '.join(result.get('manifest', []))}")
+        return result
 
-        # Stage 3: Sanity Tests
+    # Stage 3: Sanity Tests
+    async def sanity(codegen):
         log('sanity', "Performing static analysis and syntax checks...")
-        sanity_passed, sanity_issues = run_sanity_tests(output_dir, result)
-        
+        sanity_passed, sanity_issues = await asyncio.to_thread(run_sanity_tests, output_dir, codegen)
+
         if not sanity_passed:
             log('repair', f"Sanity issues found: {', '.join(sanity_issues[:3])}. Attempting rule-based repair...")
             # Note: normalize_result/fixers are already called inside extract_files or similar
             # For simplicity, we proceed to extract and then check correctness
         else:
             log('sanity', "Static analysis passed. Basic code structure is valid.")
+        return sanity_passed
 
-        # Stage 4: Extract Files
+    # Stage 4: Extract Files
+    async def extract(codegen):
         log('extract', "Writing code modules to project workspace...")
-        shutil.rmtree(output_dir, ignore_errors=True)
-        created_files, manifest = extract_files(result, output_dir, log_fn=log)
+        created_files, manifest = await asyncio.to_thread(extract_files, codegen, output_dir, log_fn=log)
         log('extract', f"Successfully materialized {len(created_files)} files.")
+        return created_files
 
-        # Stage 5: Correctness Tests (Dynamic)
+    # Stage 5: Correctness Tests (Dynamic)
+    async def correctness(codegen, extract, sanity):
+        result = codegen
         log('correctness', "Evaluating runtime integrity (launching app and hitting routes)...")
         run_cmd = f"uvicorn main:app --host 0.0.0.0 --port {port}" # Base run command for tests
-        correctness_passed, correctness_issues = run_correctness_tests(output_dir, run_cmd, port=8099)
+        correctness_passed, correctness_issues = await asyncio.to_thread(run_correctness_tests, output_dir, run_cmd, port=8099)
 
         if not correctness_passed:
             log('repair', f"Runtime issues detected. Initiating intelligent mini-repair loop...")
             error_log = "\n".join(correctness_issues)
             
             # Mini-repair LLM call
-            result = repair_with_error(result, error_log)
+            result = await asyncio.to_thread(repair_with_error, result, error_log)
             result = normalize_result(result)
             
             # Re-extract and re-test
             log('extract', "Applying repaired code to workspace...")
-            shutil.rmtree(output_dir, ignore_errors=True)
-            created_files, manifest = extract_files(result, output_dir, log_fn=log)
+            await asyncio.to_thread(save_checkpoint, output_dir, "repair", result=result)
+            await asyncio.to_thread(reset_workspace, output_dir)
+            created_files, manifest = await asyncio.to_thread(extract_files, result, output_dir, log_fn=log)
             
             log('correctness', "Final verification of repaired application...")
-            correctness_passed, correctness_issues = run_correctness_tests(output_dir, run_cmd, port=8099)
+            correctness_passed, correctness_issues = await asyncio.to_thread(run_correctness_tests, output_dir, run_cmd, port=8099)
             
             if not correctness_passed:
                 log('warn', "Some runtime issues persist. App might have partial functionality.", 'WARNING')
@@ -119,33 +337,49 @@ async def run_pipeline(run_id: int, project_id: int, prompt: str):
         else:
             log('correctness', "Runtime integrity verified. No 500 errors detected.")
 
-        # Save pipeline log for later viewing
-        os.makedirs(output_dir, exist_ok=True)
-        with open(os.path.join(output_dir, "pipeline_output.json"), "w", encoding="utf-8") as f:
-            json.dump({
-                "user_prompt": prompt,
-                "enhanced_prompt": enhanced_prompt,
-                "taskspec": taskspec,
-                "result": result
-            }, f, indent=2, ensure_ascii=False)
-            
+        # Save pipeline log for later viewing (kept up to date after every stage)
+        await asyncio.to_thread(save_checkpoint, output_dir, "correctness")
         log('extract', f"Full pipeline history saved to project storage.")
 
-        # Stage 6: Sandbox Production
+    async def venv():
+        return await prepare_venv(output_dir, log)
+
+    # Stage 6: Sandbox Production
+    async def sandbox(correctness, venv):
         log('sandbox', "Initializing production environment...")
+        await asyncio.to_thread(make_room, run_id)
         proc_handle = await run_sandbox_async(output_dir, port, log)
 
         if proc_handle:
             PROCESS_REGISTRY[run_id] = proc_handle
+            PREVIEW_LOGS[run_id] = os.path.join(output_dir, PREVIEW_LOG)
             update_run_status(run_id, 'success')
             log('done', f"Forge process complete! Access your app on port {port}")
         else:
             update_run_status(run_id, 'failed')
             log('fatal', "Failed to ignite the application sandbox.", 'ERROR')
 
+    async def log_timing(t):
+        log('timing', f"{t.name}: {t.status} in {t.duration_s:.2f}s (started at +{t.waited_s:.2f}s)")
+
+    dag = DAG(on_node_done=log_timing)
+    dag.add("enhance", enhance)
+    dag.add("spec", spec, deps=("enhance",))
+    dag.add("codegen", codegen, deps=("spec",))
+    dag.add("sanity", sanity, deps=("codegen",))
+    dag.add("extract", extract, deps=("codegen",))
+    dag.add("correctness", correctness, deps=("codegen", "extract", "sanity"))
+    dag.add("venv", venv)
+    dag.add("sandbox", sandbox, deps=("correctness", "venv"))
+
+    try:
+        await dag.run()
     except Exception as e:
         log('fatal', f"Critical failure in pipeline: {str(e)}", 'ERROR')
         update_run_status(run_id, 'failed')
+    run = get_run(run_id)
+    if not run or run["status"] != 'success':
+        await asyncio.to_thread(release_preview, run_id)
 
 async def run_modification_pipeline(run_id: int, project_id: int, user_request: str):
     def log(stage: str, msg: str, level: str = 'INFO'):
@@ -154,10 +388,13 @@ async def run_modification_pipeline(run_id: int, project_id: int, user_request:
 
     log('modify', f"Applying modification: {user_request}")
     update_run_status(run_id, 'running')
-    port = PREVIEW_PORT_BASE + run_id
     output_dir = os.path.join(STORAGE_DIR, f"project_{project_id}", f"run_{run_id}")
 
     try:
+        port = await asyncio.to_thread(lease_port, run_id)
+        if port is None:
+            raise RuntimeError("No free preview port (all in use by running builds)")
+
         # 1. Stop existing process
         stop_run(run_id)
         
@@ -167,9 +404,11 @@ async def run_modification_pipeline(run_id: int, project_id: int, user_request:
         if success:
             log('modify', "Modifications applied. Restarting sandbox...")
             # 3. Restart process
+            await asyncio.to_thread(make_room, run_id)
             proc_handle = await run_sandbox_async(output_dir, port, log)
             if proc_handle:
                 PROCESS_REGISTRY[run_id] = proc_handle
+                PREVIEW_LOGS[run_id] = os.path.join(output_dir, PREVIEW_LOG)
                 update_run_status(run_id, 'success')
                 log('done', f"Modification successful! Live on http://localhost:{port}")
             else:
@@ -182,3 +421,6 @@ async def run_modification_pipeline(run_id: int, project_id: int, user_request:
     except Exception as e:
         log('fatal', f"Critical failure in modification: {str(e)}", 'ERROR')
         update_run_status(run_id, 'failed')
+    run = get_run(run_id)
+    if not run or run["status"] != 'success':
+        await asyncio.to_thread(release_preview, run_id)
@@ -43,26 +43,24 @@ async def generate_code_async(taskspec: dict) -> str:
     except Exception:
         coder_name = CODER_MODEL
 
+    payload = {
+        "model": coder_name,
+        "options": {
+            "temperature": 0.1,
+            "repeat_penalty": 1.1,
+            "top_p": 0.9,
+        },
+        "messages": [
+            {"role": "system", "content": CODER_SYSTEM},
+            {"role": "user", "content": 
+                "Generate a complete production-ready web app from this TaskSpec:\n"
+                + json.dumps(lean, indent=2)
+            }
+        ],
+        "stream": False,
+    }
+
     async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            OLLAMA_URL,
-            json={
-                "model": coder_name,
-                "options": {
-                    "temperature": 0.1,
-                    "repeat_penalty": 1.1,
-                    "top_p": 0.9,
-                },
-                "messages": [
-                    {"role": "system", "content": CODER_SYSTEM},
-                    {"role": "user", "content": 
-                        "Generate a complete production-ready web app from this TaskSpec:\n"
-                        + json.dumps(lean, indent=2)
-                    }
-                ],
-                "stream": False,
-            },
-            timeout=360,
-        )
+        resp = await client.post(OLLAMA_URL, json=payload, timeout=360)
         resp.raise_for_status()
         return resp.json()["message"]["content"]
@@ -18,44 +18,50 @@ JUNK_FILES = {
 
 REPAIR_MODEL = CODER_MODEL # Default to using the same coder model for repairs
 
-def extract_files(result: dict, output_dir: str, log_fn=None):
-    """Writes files from the result dictionary to the specified directory."""
-    files = result.get("files", [])
-    manifest = result.get("manifest", [])
-    created = []
+def extract_file(file_entry: dict, output_dir: str, log_fn=None):
+    """Writes a single {"path", "content"} entry (after rule-based fixes). Returns its path or None."""
+    if not isinstance(file_entry, dict):
+        return None
 
-    for file_entry in files:
-        if not isinstance(file_entry, dict):
-            continue
+    path = file_entry.get("path", "").strip()
+    content = file_entry.get("content", "")
 
-        path = file_entry.get("path", "").strip()
-        content = file_entry.get("content", "")
+    if not path or os.path.basename(path) in JUNK_FILES:
+        return None
+        
+    if log_fn:
+        log_fn('extract', f"Materializing {path}...")
 
-        if not path or os.path.basename(path) in JUNK_FILES:
-            continue
-            
-        if log_fn:
-            log_fn('extract', f"Materializing {path}...")
+    if content.strip() in ["<placeholder-image-data>", "<binary data>", "<binary>", ""]:
+        return None
 
-        if content.strip() in ["<placeholder-image-data>", "<binary data>", "<binary>", ""]:
-            continue
+    # Normalization of extensions
+    path = path.replace(".html.jinja2", ".html").replace(".jinja2", ".html")
+
+    # Apply rule-based fixers
+    if path.endswith(".py"):
+        content = fix_template_response(content)
+        content = fix_python_imports(path, content)
 
-        # Normalization of extensions
-        path = path.replace(".html.jinja2", ".html").replace(".jinja2", ".html")
+    if path.endswith(".html"):
+        content = fix_child_template(path, content)
 
-        # Apply rule-based fixers
-        if path.endswith(".py"):
-            content = fix_template_response(content)
-            content = fix_python_imports(path, content)
+    full_path = os.path.join(output_dir, path)
+    os.makedirs(os.path.dirname(full_path) or output_dir, exist_ok=True)
+    with open(full_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
 
-        if path.endswith(".html"):
-            content = fix_child_template(path, content)
+def extract_files(result: dict, output_dir: str, log_fn=None):
+    """Writes files from the result dictionary to the specified directory."""
+    files = result.get("files", [])
+    manifest = result.get("manifest", [])
+    created = []
 
-        full_path = os.path.join(output_dir, path)
-        os.makedirs(os.path.dirname(full_path) or output_dir, exist_ok=True)
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(content)
-        created.append(path)
+    for file_entry in files:
+        path = extract_file(file_entry, output_dir, log_fn=log_fn)
+        if path:
+            created.append(path)
 
     # Ensure requirements.txt exists and is valid
     req_path = os.path.join(output_dir, "requirements.txt")
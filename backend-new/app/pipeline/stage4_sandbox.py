@@ -4,6 +4,9 @@ import subprocess
 import asyncio
 from pathlib import Path
 
+# The app's output (uvicorn's access log included); its mtime is the preview's last activity
+PREVIEW_LOG = "preview.log"
+
 # Well-known venv that already has fastapi, jinja2, uvicorn etc installed
 FYP_VENV = Path("/home/noor/FYP/venv")
 FYP_PIP = FYP_VENV / "bin" / "pip"
@@ -32,10 +35,50 @@ async def _run(cmd: list[str], cwd: str) -> int:
         stderr=subprocess.PIPE,
         cwd=cwd
     )
-    stdout, stderr = await proc.communicate()
+    try:
+        stdout, stderr = await proc.communicate()
+    except asyncio.CancelledError:
+        # Cancelled along with the rest of the pipeline: don't leave pip running
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
     return proc.returncode, stdout.decode(errors="ignore"), stderr.decode(errors="ignore")
 
 
+# What the coder model is told to put in requirements.txt; installed ahead of time
+BASELINE_PACKAGES = ["fastapi", "uvicorn", "jinja2", "python-multipart", "aiofiles", "bcrypt"]
+
+
+async def create_venv(output_dir: str, logger) -> bool:
+    """Creates <output_dir>/venv unless it already exists. Returns False if venv creation failed."""
+    venv_path = Path(output_dir) / "venv"
+    if (venv_path / "bin" / "python").exists():
+        return True
+    logger("sandbox", "Creating virtual environment...")
+    code, _, err = await _run(["python3", "-m", "venv", str(venv_path)], output_dir)
+    if code != 0:
+        logger("warn", f"venv creation failed: {err.strip()[:200]}. Will use system Python.", "WARNING")
+        return False
+    return True
+
+
+async def prepare_venv(output_dir: str, logger) -> bool:
+    """
+    Creates the venv and installs the baseline packages while the models are still
+    working, so the sandbox stage's install is mostly "already satisfied".
+    """
+    if not await create_venv(output_dir, logger):
+        return False
+    pip_exe = Path(output_dir) / "venv" / "bin" / "pip"
+    code, _, err = await _run([str(pip_exe), "install", *BASELINE_PACKAGES], output_dir)
+    if code != 0:
+        logger("warn", f"Baseline install failed (will retry from requirements.txt): {err.strip()[:200]}", "WARNING")
+    else:
+        logger("deps", "Baseline packages pre-installed.")
+    return True
+
+
 async def run_sandbox_async(output_dir: str, port: int, logger) -> object:
     """
     Creates a venv, installs deps (with fallback), and starts uvicorn.
@@ -49,13 +92,7 @@ async def run_sandbox_async(output_dir: str, port: int, logger) -> object:
     req_txt = output_path / "requirements.txt"
 
     # ── Step 1: Create virtual environment ──────────────────────────────────
-    logger("sandbox", "Creating virtual environment...")
-    code, _, err = await _run(["python3", "-m", "venv", str(venv_path)], output_dir)
-    if code != 0:
-        logger("warn", f"venv creation failed: {err.strip()[:200]}. Will use system Python.", "WARNING")
-        venv_created = False
-    else:
-        venv_created = True
+    venv_created = await create_venv(output_dir, logger)
 
     # ── Step 2: Install dependencies ─────────────────────────────────────────
     if req_txt.exists():
@@ -134,13 +171,14 @@ async def run_sandbox_async(output_dir: str, port: int, logger) -> object:
     for uvicorn_cmd in uvicorn_candidates:
         try:
             cmd_parts = uvicorn_cmd.split() + [app_module] + run_args
-            proc = subprocess.Popen(
-                cmd_parts,
-                cwd=output_dir,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                start_new_session=True
-            )
+            with open(output_path / PREVIEW_LOG, "ab") as preview_log:
+                proc = subprocess.Popen(
+                    cmd_parts,
+                    cwd=output_dir,
+                    stdout=preview_log,
+                    stderr=subprocess.STDOUT,
+                    start_new_session=True
+                )
             logger("done", f"Application is live on http://localhost:{port}")
             logger("done", f"Forge process complete! Access your app on port {port}")
             return proc
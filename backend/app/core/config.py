@@ -11,6 +11,18 @@ except Exception:
     pass
 
 
+def _parse_model_map(raw: str) -> dict[str, str]:
+    """Parse "model=value,model2=value2" env values into a dict."""
+    out: dict[str, str] = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        key, value = item.rsplit("=", 1)
+        if key.strip() and value.strip():
+            out[key.strip()] = value.strip()
+    return out
+
+
 class Settings(BaseModel):
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./app.db")
     WORKSPACE_ROOT: Path = Path(__file__).resolve().parents[3] / "storage" / "workspaces"
@@ -20,19 +32,99 @@ class Settings(BaseModel):
 
     # Ollama
     OLLAMA_BASE_URL: str = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").strip()
+    # Extra Ollama boxes; requests go to the least-loaded healthy endpoint that serves the model.
+    # OLLAMA_MODEL_ENDPOINTS pins models to endpoints: "model=http://a:11434|http://b:11434,..."
+    OLLAMA_ENDPOINTS: list[str] = [
+        u.strip() for u in (os.getenv("OLLAMA_ENDPOINTS") or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")).split(",") if u.strip()
+    ]
+    OLLAMA_MODEL_ENDPOINTS: dict[str, list[str]] = {
+        k: [u.strip() for u in v.split("|") if u.strip()]
+        for k, v in _parse_model_map(os.getenv("OLLAMA_MODEL_ENDPOINTS", "")).items()
+    }
+    OLLAMA_HEALTH_INTERVAL: float = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+
+    # Model residency: warm the pipeline's models on startup, keep them loaded with a
+    # keep_alive derived from traffic, and reload recently used models Ollama evicted.
+    LLM_WARMUP_ENABLED: bool = os.getenv("LLM_WARMUP_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+    LLM_KEEP_ALIVE_MIN: int = int(os.getenv("LLM_KEEP_ALIVE_MIN", "600"))
+    LLM_KEEP_ALIVE_MAX: int = int(os.getenv("LLM_KEEP_ALIVE_MAX", str(4 * 3600)))
+    LLM_RESIDENCY_INTERVAL: float = float(os.getenv("LLM_RESIDENCY_INTERVAL", "30"))
 
     # OpenAI-compatible API
     API_BASE_URL: str = os.getenv("API_BASE_URL", "").strip()
     API_KEY: str = os.getenv("API_KEY", "").strip()
 
+    # Shared HTTP connection pool for LLM providers (one long-lived client per provider)
+    LLM_POOL_MAX_CONNECTIONS: int = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "32"))
+    LLM_POOL_MAX_KEEPALIVE: int = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "16"))
+    LLM_POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "120"))
+    LLM_CONNECT_TIMEOUT: float = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+
+    # Share one upstream call between concurrent identical LLM requests
+    LLM_COALESCE_ENABLED: bool = os.getenv("LLM_COALESCE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+
+    # On-disk LLM response cache (content-addressed, LRU + TTL)
+    LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+    LLM_CACHE_DIR: Path = Path(os.getenv("LLM_CACHE_DIR") or Path(__file__).resolve().parents[3] / "storage" / "llm_cache")
+    LLM_CACHE_MAX_MB: int = int(os.getenv("LLM_CACHE_MAX_MB", "512"))
+    LLM_CACHE_TTL_SECONDS: int = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+    # Concurrent calls allowed per model across all endpoints (match the total parallel slots, e.g. OLLAMA_NUM_PARALLEL x boxes)
+    LLM_MAX_PARALLEL: int = int(os.getenv("LLM_MAX_PARALLEL", "1"))
+    LLM_MODEL_PARALLEL: dict[str, int] = {
+        k: int(v) for k, v in _parse_model_map(os.getenv("LLM_MODEL_PARALLEL", "")).items()
+    }
+
     # Model names (use API_MODEL_* if present, else MODEL_*)
     MODEL_SPEC: str = (os.getenv("API_MODEL_SPEC") or os.getenv("MODEL_SPEC") or "").strip()
     MODEL_CODE: str = (os.getenv("API_MODEL_CODE") or os.getenv("MODEL_CODE") or "").strip()
     MODEL_REPAIR: str = (os.getenv("API_MODEL_REPAIR") or os.getenv("MODEL_REPAIR") or "").strip()
     MODEL_ENHANCE: str = (os.getenv("API_MODEL_ENHANCE") or os.getenv("MODEL_ENHANCE") or "qwen2.5:7b-instruct").strip()
 
+    # Parallel codegen: N samples race and the first clean one wins (1 = one streamed sample,
+    # sequential JSON retries). Only useful with N free slots for MODEL_CODE (LLM_MODEL_PARALLEL).
+    CODEGEN_SAMPLES: int = int(os.getenv("CODEGEN_SAMPLES", "1"))
+    CODEGEN_SAMPLE_TEMPERATURES: list[float] = [
+        float(t) for t in os.getenv("CODEGEN_SAMPLE_TEMPERATURES", "0.2,0.5,0.8").split(",") if t.strip()
+    ]
+
+    # Near-duplicate prompt reuse (MinHash/LSH over past successful runs): at or above
+    # REUSE the stored TaskSpec replaces the enhance + spec stages; at or above WARM it is
+    # handed to the spec model as a starting point.
+    PROMPT_REUSE_ENABLED: bool = os.getenv("PROMPT_REUSE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+    PROMPT_REUSE_THRESHOLD: float = float(os.getenv("PROMPT_REUSE_THRESHOLD", "0.85"))
+    PROMPT_WARM_THRESHOLD: float = float(os.getenv("PROMPT_WARM_THRESHOLD", "0.6"))
+
+    # Shared, versioned template venv (baseline packages preinstalled) that run venvs layer
+    # onto with a .pth file instead of installing the baseline themselves
+    VENV_TEMPLATE_ENABLED: bool = os.getenv("VENV_TEMPLATE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+    VENV_TEMPLATE_ROOT: Path = Path(os.getenv("VENV_TEMPLATE_ROOT") or Path(__file__).resolve().parents[3] / "storage" / "venv_templates")
+
+    # Dependency sets installed once per normalized requirements hash and shared through
+    # .pth files; wheels come from a local wheelhouse (DEP_CACHE_OFFLINE: never hit the index)
+    DEP_CACHE_ENABLED: bool = os.getenv("DEP_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+    DEP_CACHE_ROOT: Path = Path(os.getenv("DEP_CACHE_ROOT") or Path(__file__).resolve().parents[3] / "storage" / "dep_cache")
+    DEP_CACHE_OFFLINE: bool = os.getenv("DEP_CACHE_OFFLINE", "0").strip().lower() in ("1", "true", "yes")
+
     MAX_REPAIR_ATTEMPTS: int = int(os.getenv("MAX_REPAIR_ATTEMPTS", "2"))
+    # Token budgets for the code context packed into repair / modify prompts
+    REPAIR_CONTEXT_TOKENS: int = int(os.getenv("REPAIR_CONTEXT_TOKENS", "3000"))
+    MODIFY_CONTEXT_TOKENS: int = int(os.getenv("MODIFY_CONTEXT_TOKENS", "6000"))
     PREVIEW_PORT_BASE: int = int(os.getenv("PREVIEW_PORT_BASE", "8010"))
+    # Preview ports are leased from PREVIEW_PORT_BASE .. +COUNT-1 (docker-compose exposes 8010-8110).
+    # At most PREVIEW_MAX_LIVE apps run at once; ones without requests for PREVIEW_IDLE_SECONDS are stopped.
+    PREVIEW_PORT_COUNT: int = int(os.getenv("PREVIEW_PORT_COUNT", "101"))
+    PREVIEW_MAX_LIVE: int = int(os.getenv("PREVIEW_MAX_LIVE", "20"))
+    PREVIEW_IDLE_SECONDS: float = float(os.getenv("PREVIEW_IDLE_SECONDS", "1800"))
+    PREVIEW_REAP_INTERVAL: float = float(os.getenv("PREVIEW_REAP_INTERVAL", "60"))
+    # Port leases are shared by all API processes through the DB and renewed by each
+    # process's reaper; a lease not renewed for this long (process gone) can be taken over.
+    PREVIEW_LEASE_SECONDS: float = float(os.getenv("PREVIEW_LEASE_SECONDS", "300"))
+
+    # Run job queue: concurrent runs per API process, lease length and retry limit
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
 
 
 settings = Settings()
@@ -56,6 +56,102 @@ def extract_balanced_json_object(text: str, required_substrings: tuple[str, ...]
     return max(candidates, key=len)
 
 
+class IncrementalFilesParser:
+    """
+    Streaming counterpart of extract_json for codegen output.
+
+    Feed it text chunks as they arrive; it locates the "files": [ ... ] array of the
+    top-level object and returns each {"path", "content"} object as soon as its closing
+    brace arrives, without waiting for the rest of the response. String/escape state is
+    tracked throughout, so a "files" key inside a nested object or a string value (say,
+    a plan that quotes the JSON format) is not mistaken for the array, and braces inside
+    file contents are ignored. Only the list form of "files" is handled; anything else
+    is left to the normal whole-response parse.
+    """
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.in_array = False
+        self.closed = False
+        self.depth = 0  # {/[ nesting before the array; object nesting inside it
+        self.in_str = False
+        self.esc = False
+        self.str_start = -1
+        self.key_state = 0  # 1: just read a top-level "files" string, 2: and its colon
+        self.obj_start = -1
+
+    def feed(self, text: str) -> list[dict]:
+        self.buf += text
+        found: list[dict] = []
+        if self.closed:
+            return found
+
+        buf = self.buf
+        i = self.pos
+        while i < len(buf):
+            c = buf[i]
+            if self.esc:
+                self.esc = False
+            elif self.in_str:
+                if c == "\\":
+                    self.esc = True
+                elif c == '"':
+                    self.in_str = False
+                    if not self.in_array:
+                        self.key_state = 1 if self.depth == 1 and buf[self.str_start + 1 : i] == "files" else 0
+            elif c == '"':
+                # Quotes in prose before the JSON starts are not strings
+                if self.in_array or self.depth > 0:
+                    self.in_str = True
+                    self.str_start = i
+            elif not self.in_array:
+                if c in " \t\r\n":
+                    pass
+                elif c == ":" and self.key_state == 1:
+                    self.key_state = 2
+                elif c == "[" and self.key_state == 2:
+                    self.in_array = True
+                    self.depth = 0
+                    self.key_state = 0
+                else:
+                    self.key_state = 0
+                    if c in "{[":
+                        self.depth += 1
+                    elif c in "}]" and self.depth > 0:
+                        self.depth -= 1
+            elif c == "{":
+                if self.depth == 0:
+                    self.obj_start = i
+                self.depth += 1
+            elif c == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0 and self.obj_start != -1:
+                    obj = self._load(buf[self.obj_start : i + 1])
+                    if obj is not None:
+                        found.append(obj)
+                    self.obj_start = -1
+            elif c == "]" and self.depth == 0:
+                self.closed = True
+                i += 1
+                break
+            i += 1
+        self.pos = i
+        return found
+
+    @staticmethod
+    def _load(frag: str) -> dict | None:
+        for blob in (frag, repair_json(frag)):
+            try:
+                # strict=False tolerates raw newlines/tabs inside strings (common in LLM output)
+                obj = json.loads(blob, strict=False)
+            except (json.JSONDecodeError, TypeError):
+                continue
+            if isinstance(obj, dict) and (obj.get("path") or obj.get("name")) and isinstance(obj.get("content"), str):
+                return obj
+            return None
+        return None
+
+
 def extract_json(text: str) -> str:
     """
     Robustly extract JSON object from LLM output.
@@ -10,7 +10,7 @@ class Project(SQLModel, table=True):
 class Run(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     project_id: int = Field(index=True)
-    status: str = Field(default="queued")  # queued | running | success | failed
+    status: str = Field(default="queued")  # queued | running | success | stopped (preview reaped) | failed | cancelled
     entrypoint: str = Field(default="main.py")
     attempts: int = Field(default=0)
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -22,3 +22,76 @@ class LogEvent(SQLModel, table=True):
     level: str = Field(default="INFO")  # INFO | ERROR
     message: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class LLMCall(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    run_id: Optional[int] = Field(default=None, index=True)
+    stage: Optional[str] = None
+    model: str
+    endpoint: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # Server-reported timings (Ollama); wall_ms is measured client-side for every call
+    prompt_eval_ms: Optional[float] = None
+    eval_ms: Optional[float] = None
+    load_ms: Optional[float] = None
+    total_ms: Optional[float] = None
+    wall_ms: float = 0.0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class StageTiming(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    run_id: int = Field(index=True)
+    name: str  # enhance | spec | codegen | ... | venv_create | pip_install | uvicorn_ready | repair_attempt
+    kind: str = Field(default="step")  # stage (a pipeline DAG node) | step (a sub-step within one)
+    status: str = Field(default="ok")  # ok | failed | cancelled
+    detail: Optional[str] = None
+    started_at: datetime
+    duration_ms: float
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class FixRecord(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    signature: str = Field(index=True)  # hash of error type + message template + file role
+    source: str  # builtin | learned
+    error_type: str
+    template: str
+    role: str
+    ops: str = Field(default="{}")  # JSON FixOps
+    description: str = ""
+    uses: int = Field(default=0)
+    successes: int = Field(default=0)
+    failures: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_used_at: Optional[datetime] = None
+
+class PromptIndexEntry(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    run_id: int = Field(index=True)
+    prompt: str
+    enhanced_prompt: str
+    spec: str  # JSON TaskSpec of a run that succeeded
+    prompt_minhash: str  # JSON list of MinHash values
+    enhanced_minhash: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Job(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(index=True)  # generate | modify
+    run_id: int = Field(index=True)
+    payload: str = Field(default="{}")  # JSON
+    status: str = Field(default="queued", index=True)  # queued | leased | done | failed | cancelled
+    attempts: int = Field(default=0)
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    error: Optional[str] = None
+    enqueued_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class PreviewLease(SQLModel, table=True):
+    port: int = Field(primary_key=True)  # one run per preview port, across API processes
+    run_id: int = Field(index=True, unique=True)
+    owner: str  # process holding the lease; renews it while the process is alive
+    expires_at: datetime
+    created_at: datetime = Field(default_factory=datetime.utcnow)
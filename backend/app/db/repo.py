@@ -1,5 +1,9 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, exists, func, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from sqlmodel import Session, select
-from app.db.models import Project, Run, LogEvent
+from app.db.models import Project, Run, LogEvent, LLMCall, StageTiming, FixRecord, PromptIndexEntry, Job, PreviewLease
 
 def create_project(session: Session, name: str) -> Project:
     p = Project(name=name)
@@ -40,6 +44,230 @@ def add_log(session: Session, run_id: int, stage: str, level: str, message: str)
     session.refresh(e)
     return e
 
+def add_logs(session: Session, events: list[dict]) -> None:
+    """Insert many log events in one transaction (no refresh; callers don't need ids)."""
+    session.add_all([LogEvent(**e) for e in events])
+    session.commit()
+
 def list_logs(session: Session, run_id: int) -> list[LogEvent]:
     stmt = select(LogEvent).where(LogEvent.run_id == run_id).order_by(LogEvent.id)
     return list(session.exec(stmt).all())
+
+def add_llm_call(session: Session, **fields) -> LLMCall:
+    c = LLMCall(**fields)
+    session.add(c)
+    session.commit()
+    session.refresh(c)
+    return c
+
+def list_llm_calls(session: Session, run_id: int) -> list[LLMCall]:
+    stmt = select(LLMCall).where(LLMCall.run_id == run_id).order_by(LLMCall.id)
+    return list(session.exec(stmt).all())
+
+def add_stage_timing(session: Session, **fields) -> StageTiming:
+    t = StageTiming(**fields)
+    session.add(t)
+    session.commit()
+    return t
+
+def list_stage_timings(session: Session, run_id: int) -> list[StageTiming]:
+    stmt = select(StageTiming).where(StageTiming.run_id == run_id).order_by(StageTiming.started_at, StageTiming.id)
+    return list(session.exec(stmt).all())
+
+def find_fixes(session: Session, signature: str) -> list[FixRecord]:
+    stmt = select(FixRecord).where(FixRecord.signature == signature).order_by(FixRecord.successes.desc(), FixRecord.id)
+    return list(session.exec(stmt).all())
+
+def upsert_fix(session: Session, signature: str, source: str, ops: str, **fields) -> FixRecord:
+    stmt = select(FixRecord).where(FixRecord.signature == signature, FixRecord.source == source, FixRecord.ops == ops)
+    rec = session.exec(stmt).first()
+    if rec is None:
+        rec = FixRecord(signature=signature, source=source, ops=ops, **fields)
+        session.add(rec)
+        session.commit()
+        session.refresh(rec)
+    return rec
+
+def record_fix_use(session: Session, fix_id: int) -> None:
+    session.execute(
+        update(FixRecord).where(FixRecord.id == fix_id).values(uses=FixRecord.uses + 1, last_used_at=datetime.utcnow())
+    )
+    session.commit()
+
+def record_fix_outcome(session: Session, fix_id: int, success: bool) -> None:
+    column = FixRecord.successes if success else FixRecord.failures
+    session.execute(update(FixRecord).where(FixRecord.id == fix_id).values({column: column + 1}))
+    session.commit()
+
+def list_fixes(session: Session, limit: int = 200) -> list[FixRecord]:
+    stmt = select(FixRecord).order_by(FixRecord.uses.desc(), FixRecord.id).limit(limit)
+    return list(session.exec(stmt).all())
+
+def add_prompt_entry(session: Session, **fields) -> PromptIndexEntry:
+    e = PromptIndexEntry(**fields)
+    session.add(e)
+    session.commit()
+    session.refresh(e)
+    return e
+
+def list_prompt_entries(session: Session, after_id: int = 0) -> list[PromptIndexEntry]:
+    stmt = select(PromptIndexEntry).where(PromptIndexEntry.id > after_id).order_by(PromptIndexEntry.id)
+    return list(session.exec(stmt).all())
+
+def get_prompt_entry(session: Session, entry_id: int) -> PromptIndexEntry | None:
+    return session.get(PromptIndexEntry, entry_id)
+
+def enqueue_job(session: Session, kind: str, run_id: int, payload: str) -> Job:
+    j = Job(kind=kind, run_id=run_id, payload=payload)
+    session.add(j)
+    session.commit()
+    session.refresh(j)
+    return j
+
+def claim_job(session: Session, owner: str, lease_seconds: float) -> Job | None:
+    """
+    Lease the oldest runnable job: queued, or leased by a worker whose lease ran out.
+    A job is skipped while another job of the same run holds a live lease, so a run's
+    generate and modify jobs never execute at the same time.
+    The conditional UPDATE makes the claim atomic across workers and processes.
+    """
+    now = datetime.utcnow()
+    runnable = or_(Job.status == "queued", and_(Job.status == "leased", Job.lease_expires_at < now))
+    other = aliased(Job)
+
+    def run_busy(run_id, job_id):
+        return exists().where(
+            other.run_id == run_id, other.id != job_id, other.status == "leased", other.lease_expires_at >= now
+        )
+
+    candidates = select(Job).where(runnable, ~run_busy(Job.run_id, Job.id)).order_by(Job.id).limit(8)
+    for job in session.exec(candidates).all():
+        res = session.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.status == job.status, Job.attempts == job.attempts, ~run_busy(job.run_id, job.id))
+            .values(
+                status="leased",
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=job.attempts + 1,
+                started_at=now,
+            )
+        )
+        session.commit()
+        if res.rowcount == 1:
+            claimed = session.get(Job, job.id)
+            session.refresh(claimed)
+            return claimed
+    return None
+
+def extend_job_lease(session: Session, job_id: int, owner: str, lease_seconds: float) -> bool:
+    res = session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.lease_owner == owner, Job.status == "leased")
+        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+    )
+    session.commit()
+    return res.rowcount == 1
+
+def finish_job(session: Session, job_id: int, owner: str, status: str, error: str | None = None) -> None:
+    session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.lease_owner == owner)
+        .values(status=status, error=error, finished_at=datetime.utcnow(), lease_expires_at=None)
+    )
+    session.commit()
+
+def cancel_jobs(session: Session, run_id: int) -> int:
+    """Mark a run's queued and leased jobs cancelled; a leased job's worker notices at its next heartbeat."""
+    res = session.execute(
+        update(Job)
+        .where(Job.run_id == run_id, Job.status.in_(("queued", "leased")))
+        .values(status="cancelled", finished_at=datetime.utcnow(), error="cancelled")
+    )
+    session.commit()
+    return res.rowcount
+
+def pending_job_count(session: Session, run_id: int) -> int:
+    """Queued or leased jobs of the run."""
+    return session.exec(
+        select(func.count()).select_from(Job).where(Job.run_id == run_id, Job.status.in_(("queued", "leased")))
+    ).one()
+
+def get_job(session: Session, job_id: int) -> Job | None:
+    return session.get(Job, job_id)
+
+def release_jobs(session: Session, owner: str) -> int:
+    """Hand every job leased by owner back to the queue (graceful shutdown)."""
+    res = session.execute(
+        update(Job)
+        .where(Job.lease_owner == owner, Job.status == "leased")
+        # Interrupted by shutdown, not by the job itself: don't count the attempt
+        .values(status="queued", lease_owner=None, lease_expires_at=None, attempts=Job.attempts - 1)
+    )
+    session.commit()
+    return res.rowcount
+
+def list_jobs(session: Session, status: str | None = None, limit: int = 200) -> list[Job]:
+    stmt = select(Job).order_by(Job.id.desc()).limit(limit)
+    if status is not None:
+        stmt = stmt.where(Job.status == status)
+    return list(session.exec(stmt).all())
+
+def job_counts(session: Session) -> dict[str, int]:
+    rows = session.execute(select(Job.status, func.count()).group_by(Job.status)).all()
+    return {status: count for status, count in rows}
+
+def oldest_queued_job(session: Session) -> Job | None:
+    return session.exec(select(Job).where(Job.status == "queued").order_by(Job.id).limit(1)).first()
+
+def get_port_lease(session: Session, run_id: int) -> PreviewLease | None:
+    return session.exec(select(PreviewLease).where(PreviewLease.run_id == run_id)).first()
+
+def list_port_leases(session: Session, live_only: bool = True) -> list[PreviewLease]:
+    stmt = select(PreviewLease).order_by(PreviewLease.port)
+    if live_only:
+        stmt = stmt.where(PreviewLease.expires_at >= datetime.utcnow())
+    return list(session.exec(stmt).all())
+
+def try_lease_port(session: Session, port: int, run_id: int, owner: str, lease_seconds: float) -> bool:
+    """
+    Lease port to run_id unless another live lease holds it. The primary key on port
+    makes two processes racing for the same port safe: the second insert fails.
+    """
+    now = datetime.utcnow()
+    # A lease its owner stopped renewing (crashed process) is up for grabs
+    session.execute(delete(PreviewLease).where(PreviewLease.port == port, PreviewLease.expires_at < now))
+    session.add(PreviewLease(port=port, run_id=run_id, owner=owner, expires_at=now + timedelta(seconds=lease_seconds)))
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return False
+    return True
+
+def renew_port_lease(session: Session, run_id: int, owner: str, lease_seconds: float) -> bool:
+    """Extend the run's lease, taking it over from the process that held it before."""
+    res = session.execute(
+        update(PreviewLease)
+        .where(PreviewLease.run_id == run_id)
+        .values(owner=owner, expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+    )
+    session.commit()
+    return res.rowcount == 1
+
+def renew_port_leases(session: Session, owner: str, lease_seconds: float) -> int:
+    res = session.execute(
+        update(PreviewLease)
+        .where(PreviewLease.owner == owner)
+        .values(expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+    )
+    session.commit()
+    return res.rowcount
+
+def release_port(session: Session, run_id: int) -> int | None:
+    lease = get_port_lease(session, run_id)
+    if lease is None:
+        return None
+    session.delete(lease)
+    session.commit()
+    return lease.port
@@ -1,15 +1,25 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+import asyncio
+from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from sqlmodel import Session
 import shutil
 import os
 from pathlib import Path
 
+from app.core.config import settings
 from app.db.database import init_db, get_session, engine
 from app.db import repo
 from app.core.schemas import CreateProjectRequest, CreateRunRequest, RunStatusResponse, ModifyRunRequest
 from app.services.orchestrator import Orchestrator
+from app.services.llm.accounting import summarize_calls, usage_totals
+from app.services.llm.factory import open_llm_client, close_llm_client
+from app.services.job_queue import JobQueue
+from app.services.logging_service import close_logs
+from app.services.timing import render_metrics
+from app.services.sandbox import syntax_check
+from app.services import persist
+from app.services.checkpoints import RunCheckpoints
 from app.services.workspace import project_workspace
 
 app = FastAPI(title="Prompt2Product Backend (MVP)")
@@ -24,24 +34,51 @@ app.add_middleware(
 )
 
 orch = Orchestrator()
+_preview_reaper: asyncio.Task | None = None
 from dotenv import load_dotenv
 load_dotenv()
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     init_db()
+    # Pooled LLM client lives on this loop, which also drives every run
+    await open_llm_client()
+    await jobs.start()
+    global _preview_reaper
+    _preview_reaper = asyncio.create_task(
+        orch.runner.reap_forever(settings.PREVIEW_REAP_INTERVAL, settings.PREVIEW_IDLE_SECONDS)
+    )
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Stop workers first: interrupted runs go back to the queue for the next start
+    await jobs.stop()
+    if _preview_reaper is not None:
+        _preview_reaper.cancel()
+    # Previews don't outlive the process that leased their ports
+    await orch.runner.stop_all()
+    await close_logs()
+    await close_llm_client()
+    # Timing and LLM usage rows queued by the above
+    await persist.flush()
+    syntax_check.shutdown()
 
-def run_project_generation(run_id: int, prompt: str):
+def _load_run(run_id: int):
+    with Session(engine) as session:
+        return repo.get_run(session, run_id)
+
+def _has_pending_jobs(run_id: int) -> bool:
+    with Session(engine) as session:
+        return repo.pending_job_count(session, run_id) > 0
+
+async def run_project_generation(run_id: int, prompt: str):
     """
-    Background task wrapper to handle DB session independently.
+    Background task: runs on the event loop. The orchestrator opens its own short-lived
+    sessions for DB writes, so the run is loaded fresh and detached here.
     """
-    with Session(engine) as session:
-        # Re-fetch run to ensure it's attached to this session if needed, 
-        # but execute_run takes the run object. 
-        # Better to fetch it freshly.
-        run = repo.get_run(session, run_id)
-        if run:
-            orch.execute_run(session, run, prompt)
+    run = await asyncio.to_thread(_load_run, run_id)
+    if run:
+        await orch.execute_run(run, prompt)
 
 @app.post("/projects")
 def create_project(payload: CreateProjectRequest, session: Session = Depends(get_session)):
@@ -56,7 +93,6 @@ def list_projects(session: Session = Depends(get_session)):
 def start_run(
     project_id: int, 
     payload: CreateRunRequest, 
-    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session)
 ):
     p = repo.get_project(session, project_id)
@@ -65,8 +101,8 @@ def start_run(
 
     run = repo.create_run(session, project_id, entrypoint=payload.entrypoint)
 
-    # Run in background
-    background_tasks.add_task(run_project_generation, run.id, payload.prompt)
+    # Queued durably; a job worker picks it up when one is free
+    jobs.enqueue(session, "generate", run.id, {"prompt": payload.prompt})
 
     return RunStatusResponse(run_id=run.id, status=run.status, attempts=run.attempts)
 
@@ -77,10 +113,90 @@ def get_run(run_id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Run not found")
     return r
 
+@app.post("/runs/{run_id}/resume", response_model=RunStatusResponse)
+def resume_run(run_id: int, session: Session = Depends(get_session)):
+    """Re-queue a finished/failed run; it continues after its last checkpointed stage."""
+    run = repo.get_run(session, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if run.status in ("queued", "running"):
+        raise HTTPException(status_code=409, detail="Run is already in progress")
+    saved = RunCheckpoints(project_workspace(run.project_id, run.id)).load("prompt")
+    if not saved:
+        raise HTTPException(status_code=409, detail="Run has no checkpoints to resume from")
+    run = repo.update_run_status(session, run, "queued")
+    jobs.enqueue(session, "generate", run.id, {"prompt": saved["prompt"]})
+    return RunStatusResponse(run_id=run.id, status=run.status, attempts=run.attempts)
+
+@app.post("/runs/{run_id}/cancel", response_model=RunStatusResponse)
+async def cancel_run(run_id: int):
+    """
+    Stop a queued or running run: in-flight LLM streams are closed, pip/uvicorn are
+    killed, the preview port is released and the run is marked cancelled.
+    """
+    run = await asyncio.to_thread(_load_run, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    in_progress = run.status in ("queued", "running")
+    # e.g. a modify job queued on a finished run: the run itself isn't in progress
+    if not in_progress and not await asyncio.to_thread(_has_pending_jobs, run_id):
+        raise HTTPException(status_code=409, detail=f"Run is not in progress (status: {run.status})")
+    if not await jobs.cancel(run_id) and in_progress:
+        # Still queued here, or running in another API process (its worker stops it)
+        await asyncio.to_thread(_mark_status, run_id, "cancelled")
+    run = await asyncio.to_thread(_load_run, run_id)
+    return RunStatusResponse(run_id=run.id, status=run.status, attempts=run.attempts)
+
 @app.get("/runs/{run_id}/logs")
 def get_logs(run_id: int, session: Session = Depends(get_session)):
     return repo.list_logs(session, run_id)
 
+@app.get("/runs/{run_id}/timings")
+def get_timings(run_id: int, session: Session = Depends(get_session)):
+    """Stage/sub-step durations for a run, plus its LLM calls (wall time per call)."""
+    if not repo.get_run(session, run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+    timings = repo.list_stage_timings(session, run_id)
+    stage_totals: dict[str, float] = {}
+    for t in timings:
+        if t.kind == "stage":
+            stage_totals[t.name] = stage_totals.get(t.name, 0.0) + t.duration_ms
+    llm_calls = [
+        {"stage": c.stage, "model": c.model, "started_at": c.created_at, "wall_ms": c.wall_ms, "load_ms": c.load_ms}
+        for c in repo.list_llm_calls(session, run_id)
+    ]
+    return {"stages_ms": stage_totals, "timings": timings, "llm_calls": llm_calls}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition: stage durations, queue waits, LLM call times."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/runs/{run_id}/llm-usage")
+def get_llm_usage(run_id: int, session: Session = Depends(get_session)):
+    if not repo.get_run(session, run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+    calls = repo.list_llm_calls(session, run_id)
+    return {**summarize_calls(calls), "calls": calls}
+
+@app.get("/queue")
+def queue_stats():
+    return jobs.stats()
+
+@app.get("/previews")
+def get_previews():
+    """Leased preview ports, whether the app is live and how long since it served a request."""
+    return orch.runner.previews()
+
+@app.get("/fix-cache")
+def get_fix_cache(session: Session = Depends(get_session)):
+    """Known error signatures with their cached fixes and how often they worked."""
+    return repo.list_fixes(session)
+
+@app.get("/llm/stats")
+def llm_stats():
+    return {**orch.llm.stats(), "usage": usage_totals()}
+
 @app.get("/projects/{project_id}/runs/{run_id}/download")
 def download_project(project_id: int, run_id: int, session: Session = Depends(get_session)):
     ws = project_workspace(project_id, run_id)
@@ -154,28 +270,52 @@ def get_file_content(project_id: int, run_id: int, file_path: str, session: Sess
         return {"content": content}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
-def run_modification(run_id: int, prompt: str):
+async def run_modification(run_id: int, prompt: str):
     """
     Background task for applying manual changes.
     """
+    run = await asyncio.to_thread(_load_run, run_id)
+    if run:
+        await orch.execute_modification(run, prompt)
+
+def _mark_status(run_id: int, status: str) -> None:
     with Session(engine) as session:
         run = repo.get_run(session, run_id)
         if run:
-            orch.execute_modification(session, run, prompt)
+            repo.update_run_status(session, run, status)
+
+async def _give_up(run_id: int) -> None:
+    await asyncio.to_thread(_mark_status, run_id, "failed")
+
+async def _cancelled(run_id: int) -> None:
+    run = await asyncio.to_thread(_load_run, run_id)
+    if run:
+        await orch.cancel_cleanup(run)
+
+jobs = JobQueue(
+    {
+        "generate": lambda run_id, payload: run_project_generation(run_id, payload["prompt"]),
+        "modify": lambda run_id, payload: run_modification(run_id, payload["prompt"]),
+    },
+    workers=settings.JOB_WORKERS,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    on_give_up=_give_up,
+    on_cancel=_cancelled,
+)
 
 @app.post("/projects/{project_id}/runs/{run_id}/modify")
 def modify_run(
     project_id: int,
     run_id: int,
     payload: ModifyRunRequest,
-    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session)
 ):
     run = repo.get_run(session, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
     
-    # Trigger background modification
-    background_tasks.add_task(run_modification, run.id, payload.prompt)
+    # Queue the modification
+    jobs.enqueue(session, "modify", run.id, {"prompt": payload.prompt})
     
     return {"message": "Modification started"}
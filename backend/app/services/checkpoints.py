@@ -0,0 +1,66 @@
+from __future__ import annotations
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+# Pipeline stages in order; a checkpoint for a stage means its output is reusable.
+STAGES = ("prompt", "enhance", "spec", "codegen_raw", "gen_output")
+
+
+class RunCheckpoints:
+    """
+    Per-run stage outputs under <workspace>/.checkpoints, written atomically as each
+    stage finishes. Resuming a run reads them back instead of calling the models again.
+    Repair/modify patches are kept alongside; once one is saved, generated_app/ is newer
+    than the gen_output checkpoint and a resume must not rewrite it from there.
+    """
+    def __init__(self, workspace: Path):
+        self.root = workspace / ".checkpoints"
+
+    def _path(self, stage: str) -> Path:
+        return self.root / f"{stage}.json"
+
+    def save(self, stage: str, data: Any) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(stage)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def load(self, stage: str) -> Any | None:
+        try:
+            return json.loads(self._path(stage).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def has(self, stage: str) -> bool:
+        return self._path(stage).is_file()
+
+    def completed(self) -> list[str]:
+        return [stage for stage in STAGES if self.has(stage)]
+
+    def last_completed(self) -> str | None:
+        done = self.completed()
+        return done[-1] if done else None
+
+    def invalidate_from(self, stage: str) -> None:
+        """Drop the checkpoint for stage and every later stage (their inputs changed)."""
+        for later in STAGES[STAGES.index(stage):]:
+            self._path(later).unlink(missing_ok=True)
+
+    def save_patch(self, kind: str, text: str) -> Path:
+        patches = self.root / "patches"
+        patches.mkdir(parents=True, exist_ok=True)
+        n = len(list(patches.glob("*.patch"))) + 1
+        path = patches / f"{n:03d}-{kind}.patch"
+        path.write_text(text, encoding="utf-8")
+        return path
+
+    def patched_since(self, stage: str) -> bool:
+        """True if a repair/modify patch was saved after the stage's checkpoint."""
+        try:
+            saved = self._path(stage).stat().st_mtime
+        except OSError:
+            return False
+        return any(p.stat().st_mtime >= saved for p in (self.root / "patches").glob("*.patch"))
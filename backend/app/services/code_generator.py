@@ -1,12 +1,14 @@
 from __future__ import annotations
+import asyncio
 import os
 import re
 from pathlib import Path
-from typing import List, Dict, Any
+import inspect
+from typing import List, Dict, Any, Awaitable, Callable, Optional, Sequence
 from pydantic import BaseModel, Field, model_validator
 from app.services.llm.base import LLMClient
 from app.services.prompt_to_spec import TaskSpec
-from app.core.utils import extract_json, extract_balanced_json_object, repair_json
+from app.core.utils import extract_json, extract_balanced_json_object, repair_json, IncrementalFilesParser
 import json as json_lib
 
 class GenFile(BaseModel):
@@ -86,13 +88,158 @@ class GenOutput(BaseModel):
         
         return data
 
-async def generate_code(llm: LLMClient, model: str, task_spec: TaskSpec) -> GenOutput:
+FileCallback = Callable[[GenFile], Optional[Awaitable[None]]]
+
+async def _stream_response(llm: LLMClient, on_file: FileCallback, **chat_kwargs: Any) -> str:
     """
-    Generates application code from TaskSpec using the finetuned coder model.
+    Streams the codegen response and hands every completed files[] entry to on_file
+    while the model is still generating the rest. Returns the full response text.
     """
+    parser = IncrementalFilesParser()
+    parts: list[str] = []
+    async for chunk in llm.stream_chat(**chat_kwargs):
+        parts.append(chunk)
+        for item in parser.feed(chunk):
+            try:
+                gen_file = GenFile(**item)
+            except Exception:
+                continue
+            res = on_file(gen_file)
+            if inspect.isawaitable(res):
+                await res
+    return "".join(parts).strip()
+
+def parse_gen_output(response: str) -> GenOutput:
+    """Parses a raw codegen response into GenOutput; raises ValueError if no JSON payload parses."""
+    candidates: list[str] = []
+    extracted = extract_json(response)
+    if extracted:
+        candidates.append(extracted)
     
+    balanced = extract_balanced_json_object(response, required_substrings=('"files"',))
+    if balanced and balanced not in candidates:
+        candidates.append(balanced)
+    stripped = response.strip()
+    if stripped and stripped not in candidates:
+        candidates.append(stripped)
+
+    parsed_data = None
+    last_err: BaseException | None = None
+    for raw in candidates:
+        for use_repair in (False, True):
+            try:
+                blob = repair_json(raw) if use_repair else raw
+                parsed_data = json_lib.loads(blob)
+                break
+            except (json_lib.JSONDecodeError, TypeError) as e:
+                last_err = e
+        if parsed_data is not None:
+            break
+
+    if parsed_data is None:
+        raise ValueError(f"Could not parse JSON output: {last_err}")
+
+    return GenOutput(**parsed_data)
+
+def _codegen_prompts(task_spec: TaskSpec) -> tuple[str, str]:
     prompt = f"Generate a complete production-ready web app for {task_spec.app_name}. Here is the architecture specification:\n{task_spec.model_dump_json()}"
     system_prompt = "You are a senior full-stack developer. Generate complete, working code for the requested application based on the TaskSpec."
+    return prompt, system_prompt
+
+TextCallback = Callable[[str], Optional[Awaitable[None]]]
+
+async def _emit(callback: TextCallback | None, text: str) -> None:
+    if callback is not None:
+        res = callback(text)
+        if inspect.isawaitable(res):
+            await res
+
+async def _generate_sampled(
+    llm: LLMClient,
+    model: str,
+    task_spec: TaskSpec,
+    samples: int,
+    check: Callable[[GenOutput], List[str]],
+    temperatures: Sequence[float],
+    on_raw: TextCallback | None,
+    on_log: TextCallback | None,
+) -> GenOutput:
+    prompt, system_prompt = _codegen_prompts(task_spec)
+
+    async def sample(i: int) -> tuple[int, str, GenOutput, List[str]]:
+        response = await llm.chat(
+            model=model,
+            system=system_prompt,
+            user=prompt,
+            max_tokens=8192,
+            temperature=temperatures[i % len(temperatures)],
+            seed=i + 1,
+            cache=False,
+        )
+        gen = parse_gen_output(response)
+        # The check may be slow (it parses every file); keep it off the event loop
+        return i, response, gen, await asyncio.to_thread(check, gen)
+
+    pending = {asyncio.ensure_future(sample(i)) for i in range(samples)}
+    best: tuple[int, str, GenOutput, List[str]] | None = None
+    errors: List[str] = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    candidate = task.result()
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                i, _, _, problems = candidate
+                await _emit(on_log, f"Codegen sample {i + 1}/{samples} finished with {len(problems)} problems")
+                if best is None or len(problems) < len(best[3]):
+                    best = candidate
+            if best is not None and not best[3]:
+                break
+    finally:
+        # Losing samples are cancelled, which closes their upstream requests
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if best is None:
+        raise ValueError(f"LLM failed to generate valid code output in {samples} samples: {'; '.join(errors)}")
+    i, response, gen, problems = best
+    await _emit(on_log, f"Using codegen sample {i + 1}/{samples} ({len(problems)} problems, {len(pending)} cancelled)")
+    await _emit(on_raw, response)
+    return gen
+
+async def generate_code(
+    llm: LLMClient,
+    model: str,
+    task_spec: TaskSpec,
+    on_file: FileCallback | None = None,
+    on_raw: TextCallback | None = None,
+    samples: int = 1,
+    check: Callable[[GenOutput], List[str]] | None = None,
+    temperatures: Sequence[float] = (0.2, 0.5, 0.8),
+    on_log: TextCallback | None = None,
+) -> GenOutput:
+    """
+    Generates application code from TaskSpec using the finetuned coder model.
+
+    If on_file is given the response is streamed and each file is passed to it as soon
+    as it is complete; the returned GenOutput is still parsed from the whole response.
+    on_raw receives every raw response before it is parsed (for checkpointing).
+
+    With samples > 1 (and a check function returning a list of problems), that many
+    requests run concurrently with different seeds/temperatures instead of retrying one
+    after another. The first sample that parses with no problems wins and the rest are
+    cancelled; otherwise the sample with the fewest problems is used. Sampled mode
+    doesn't stream (on_file is ignored), and on_raw only sees the chosen response.
+    on_log receives progress messages for the run log.
+    """
+    if samples > 1 and check is not None:
+        return await _generate_sampled(llm, model, task_spec, samples, check, temperatures, on_raw, on_log)
+
+    prompt, system_prompt = _codegen_prompts(task_spec)
     
     attempts = 0
     max_attempts = 3
@@ -100,43 +247,22 @@ async def generate_code(llm: LLMClient, model: str, task_spec: TaskSpec) -> GenO
     while attempts < max_attempts:
         attempts += 1
         try:
-            response = await llm.chat(
-                model=model, 
-                system=system_prompt, 
+            chat_kwargs = dict(
+                model=model,
+                system=system_prompt,
                 user=prompt,
-                max_tokens=8192  # Increased for full app JSON generation
+                max_tokens=8192,  # Increased for full app JSON generation
+                # Never cached: a retry after a bad generation must not replay it
+                cache=False,
             )
+            if on_file is not None:
+                response = await _stream_response(llm, on_file, **chat_kwargs)
+            else:
+                response = await llm.chat(**chat_kwargs)
+
+            await _emit(on_raw, response)
             
-            # Extract JSON payload
-            candidates: list[str] = []
-            extracted = extract_json(response)
-            if extracted:
-                candidates.append(extracted)
-            
-            balanced = extract_balanced_json_object(response, required_substrings=('"files"',))
-            if balanced and balanced not in candidates:
-                candidates.append(balanced)
-            stripped = response.strip()
-            if stripped and stripped not in candidates:
-                candidates.append(stripped)
-
-            parsed_data = None
-            last_err: BaseException | None = None
-            for raw in candidates:
-                for use_repair in (False, True):
-                    try:
-                        blob = repair_json(raw) if use_repair else raw
-                        parsed_data = json_lib.loads(blob)
-                        break
-                    except (json_lib.JSONDecodeError, TypeError) as e:
-                        last_err = e
-                if parsed_data is not None:
-                    break
-
-            if parsed_data is None:
-                raise ValueError(f"Could not parse JSON output: {last_err}")
-
-            return GenOutput(**parsed_data)
+            return parse_gen_output(response)
             
         except Exception as e:
             if attempts >= max_attempts:
@@ -0,0 +1,220 @@
+from __future__ import annotations
+import ast
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Rough chars-per-token for code with an English BPE vocabulary; good enough for budgeting.
+CHARS_PER_TOKEN = 4
+# Lines of context kept around a traceback line outside any function.
+WINDOW = 12
+# Don't bother adding a file excerpt smaller than this.
+MIN_EXCERPT_TOKENS = 120
+
+_FRAME_RE = re.compile(r'File "(.*?)", line (\d+)')
+_ASSET_RE = re.compile(r"""["']([\w./-]+\.(?:html|css|js))["']""")
+_NAME_RE = re.compile(r"[A-Za-z_][\w-]{2,}")
+_SOURCE_SUFFIXES = (".py", ".txt", ".html", ".css", ".js")
+_SKIP_DIRS = {"venv", ".venv", "__pycache__", "node_modules", ".git"}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+@dataclass
+class _Candidate:
+    rel: str
+    text: str
+    score: float = 0.0
+    lines: set[int] = field(default_factory=set)  # 1-based lines the error points at
+
+
+def _workspace_files(workspace: Path) -> dict[str, str]:
+    root = workspace / "generated_app"
+    files: dict[str, str] = {}
+    if not root.is_dir():
+        return files
+    for p in sorted(root.rglob("*")):
+        if not p.is_file() or p.suffix not in _SOURCE_SUFFIXES:
+            continue
+        if _SKIP_DIRS.intersection(p.relative_to(root).parts):
+            continue
+        try:
+            files[p.relative_to(workspace).as_posix()] = p.read_text(encoding="utf-8")
+        except (OSError, UnicodeDecodeError):
+            continue
+    return files
+
+
+def _trace_frames(error_text: str) -> list[tuple[str, int]]:
+    """Every (workspace-relative path, line) frame inside generated_app, outermost first."""
+    frames = []
+    for fname, line in _FRAME_RE.findall(error_text):
+        idx = fname.replace("\\", "/").find("generated_app/")
+        if idx != -1:
+            frames.append((fname.replace("\\", "/")[idx:], int(line)))
+    return frames
+
+
+def _python_regions(source: str, lines: set[int]) -> list[tuple[int, int]]:
+    """
+    Line ranges worth showing for errors at `lines`: the import block plus the innermost
+    function/class around each line (or a window when the line is at module level).
+    """
+    n = source.count("\n") + 1
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        tree = None
+
+    regions: list[tuple[int, int]] = []
+    if tree is not None:
+        imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+        if imports:
+            regions.append((1, max(node.end_lineno or node.lineno for node in imports)))
+
+    for line in sorted(lines):
+        best: tuple[int, int] | None = None
+        if tree is not None:
+            for node in ast.walk(tree):
+                if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    continue
+                start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                end = node.end_lineno or node.lineno
+                if start <= line <= end and (best is None or end - start < best[1] - best[0]):
+                    best = (start, end)
+        regions.append(best or (max(1, line - WINDOW), min(n, line + WINDOW)))
+    return regions
+
+
+def _merge(regions: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(regions):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _render_whole(rel: str, text: str) -> str:
+    return f"\n--- FILE: {rel} (Use this exact path for patching) ---\n{text}\n"
+
+
+def _render_excerpt(rel: str, text: str, regions: list[tuple[int, int]]) -> str:
+    src = text.splitlines()
+    body = []
+    for start, end in regions:
+        body.append(f"[lines {start}-{end}]")
+        body.extend(src[start - 1:end])
+    return (
+        f"\n--- EXCERPT: {rel} ({len(src)} lines, only parts shown; "
+        f"patch it with a unified diff, never REPLACE ENTIRE FILE) ---\n" + "\n".join(body) + "\n"
+    )
+
+
+def _fit_regions(text: str, regions: list[tuple[int, int]], budget: int) -> list[tuple[int, int]]:
+    """Keep regions in priority order (as given) while they fit the token budget."""
+    src = text.splitlines()
+    kept: list[tuple[int, int]] = []
+    used = 0
+    for start, end in regions:
+        cost = estimate_tokens("\n".join(src[start - 1:end])) + 4
+        if used + cost > budget:
+            continue
+        kept.append((start, end))
+        used += cost
+    return _merge(kept)
+
+
+def _score(files: dict[str, str], error_text: str, request_text: str) -> list[_Candidate]:
+    cands = {rel: _Candidate(rel, text) for rel, text in files.items()}
+
+    # Defaults: the backend entrypoint and its requirements are almost always relevant.
+    for rel, c in cands.items():
+        if rel.endswith("backend/main.py"):
+            c.score += 20
+        elif rel.endswith("requirements.txt"):
+            c.score += 25 if re.search(r"ModuleNotFoundError|ImportError|No module named", error_text) else 5
+        else:
+            c.score += 1
+
+    # Traceback frames: the innermost frame is where the fix usually goes.
+    frames = _trace_frames(error_text)
+    for depth, (rel, line) in enumerate(frames):
+        c = cands.get(rel)
+        if c is None:
+            continue
+        c.score += 60 + 40 * (depth + 1) / len(frames)
+        c.lines.add(line)
+
+    # Templates/assets: named in the error, or referenced from the code around a frame.
+    referenced: set[str] = set(_ASSET_RE.findall(error_text))
+    for c in cands.values():
+        if not c.lines or not c.rel.endswith(".py"):
+            continue
+        src = c.text.splitlines()
+        for start, end in _python_regions(c.text, c.lines):
+            referenced.update(_ASSET_RE.findall("\n".join(src[start - 1:end])))
+    for rel, c in cands.items():
+        if any(rel.endswith("/" + name.lstrip("./")) for name in referenced):
+            c.score += 40
+
+    # Modification requests: file names / contents that share words with the request.
+    words = {w.lower() for w in _NAME_RE.findall(request_text)}
+    if words:
+        for rel, c in cands.items():
+            stem = Path(rel).stem.lower()
+            if stem in words:
+                c.score += 50
+            hits = sum(1 for w in words if w in c.text.lower())
+            c.score += min(hits, 10)
+
+    return sorted(cands.values(), key=lambda c: (-c.score, c.rel))
+
+
+def pack_context(workspace: Path, budget_tokens: int, error_text: str = "", request_text: str = "") -> str:
+    """
+    Build the CONTEXT section for repair/modify prompts within a token budget.
+
+    Files are ranked by relevance (traceback frames, code around them, templates they
+    reference, words from the user's request). In rank order, each file goes in whole if
+    it still fits; otherwise Python files are cut down to their imports plus the
+    functions the traceback points at, and other files to their first lines. Partial
+    files are labelled EXCERPT so the model patches them with a diff rather than
+    rewriting them from an incomplete copy.
+    """
+    parts: list[str] = []
+    remaining = budget_tokens
+    for c in _score(_workspace_files(workspace), error_text, request_text):
+        whole = _render_whole(c.rel, c.text)
+        cost = estimate_tokens(whole)
+        if cost <= remaining:
+            parts.append(whole)
+            remaining -= cost
+            continue
+        if remaining < MIN_EXCERPT_TOKENS or c.score <= 1:
+            continue
+        n = c.text.count("\n") + 1
+        if c.rel.endswith(".py") and c.lines:
+            regions = _python_regions(c.text, c.lines)
+        else:
+            regions = [(1, n)]
+        header_cost = estimate_tokens(_render_excerpt(c.rel, "", []))
+        regions = _fit_regions(c.text, regions, remaining - header_cost)
+        if not regions:
+            # Nothing fits whole: fall back to as many leading lines as the budget allows
+            lines = c.text.splitlines()
+            chars = (remaining - header_cost) * CHARS_PER_TOKEN
+            end = 0
+            while end < len(lines) and chars - len(lines[end]) - 1 > 0:
+                chars -= len(lines[end]) + 1
+                end += 1
+            if end == 0:
+                continue
+            regions = [(1, end)]
+        excerpt = _render_excerpt(c.rel, c.text, regions)
+        parts.append(excerpt)
+        remaining -= estimate_tokens(excerpt)
+    return "\n".join(parts)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+from pathlib import Path
+
+HASH_FILE = ".p2p_hashes.json"
+SKIP_DIRS = {"__pycache__", ".pytest_cache", "node_modules"}
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class FileHashes:
+    """
+    Content hashes of the generated app's files, kept in <workspace>/.p2p_hashes.json.
+
+    `files` is the last committed state of generated_app/; diffing a fresh scan against
+    it tells the repair loop which files a patch actually changed. Paths are
+    workspace-relative, with forward slashes. (Syntax results are cached by content in
+    sandbox.syntax_check, not here.)
+    """
+    def __init__(self, workspace: Path):
+        self.workspace = workspace
+        self.root = workspace / "generated_app"
+        self.path = workspace / HASH_FILE
+        self.files: dict[str, str] = self._load().get("files", {})
+
+    def _load(self) -> dict:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def save(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"files": self.files}, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def scan(self) -> dict[str, str]:
+        current: dict[str, str] = {}
+        if not self.root.is_dir():
+            return current
+        for path in self.root.rglob("*"):
+            if not path.is_file() or SKIP_DIRS.intersection(path.relative_to(self.root).parts):
+                continue
+            try:
+                current[path.relative_to(self.workspace).as_posix()] = digest(path.read_bytes())
+            except OSError:
+                continue
+        return current
+
+    def changed(self, current: dict[str, str] | None = None) -> set[str]:
+        """Files added, modified or deleted since the last commit()."""
+        current = self.scan() if current is None else current
+        return {p for p in current.keys() | self.files.keys() if current.get(p) != self.files.get(p)}
+
+    def commit(self, current: dict[str, str] | None = None) -> None:
+        self.files = self.scan() if current is None else current
+        self.save()
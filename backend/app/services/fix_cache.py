@@ -0,0 +1,363 @@
+from __future__ import annotations
+import difflib
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+from sqlmodel import Session
+from app.db.database import engine
+from app.db import repo
+
+_EXC_RE = re.compile(r"^\s*([A-Za-z_][\w.]*(?:Error|Exception|Exit|Warning)):\s?(.*)$", re.M)
+_PIP_RE = re.compile(
+    r"(?:No matching distribution found for|Could not find a version that satisfies the requirement)\s+([^\s(]+)"
+)
+_FRAME_RE = re.compile(r'File "(.*?)", line (\d+)')
+_QUOTED_RE = re.compile(r"""(['"])(.*?)\1""")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)*\b")
+_IDENT_RE = re.compile(r"^[\w.\-\[\]=<>!~]{1,60}$")
+_REQ_NAME_RE = re.compile(r"^\s*([A-Za-z0-9][A-Za-z0-9._\-\[\]]*)")
+
+ENTRYPOINT = "generated_app/backend/main.py"
+REQUIREMENTS = "generated_app/backend/requirements.txt"
+# Most line ops a learned fix may carry; bigger patches are rewrites, not reusable fixes.
+MAX_LEARNED_OPS = 8
+
+# Names the generated apps forget to import, and where they come from.
+KNOWN_IMPORTS = {
+    "HTMLResponse": "from fastapi.responses import HTMLResponse",
+    "FileResponse": "from fastapi.responses import FileResponse",
+    "JSONResponse": "from fastapi.responses import JSONResponse",
+    "RedirectResponse": "from fastapi.responses import RedirectResponse",
+    "StaticFiles": "from fastapi.staticfiles import StaticFiles",
+    "Jinja2Templates": "from fastapi.templating import Jinja2Templates",
+    "Request": "from fastapi import Request",
+    "HTTPException": "from fastapi import HTTPException",
+    "Form": "from fastapi import Form",
+    "Depends": "from fastapi import Depends",
+    "BaseModel": "from pydantic import BaseModel",
+    "Optional": "from typing import Optional",
+    "List": "from typing import List",
+    "Dict": "from typing import Dict",
+    "os": "import os",
+    "json": "import json",
+    "datetime": "from datetime import datetime",
+    "uuid": "import uuid",
+}
+# Import name -> PyPI package, where they differ (or a missing module is a known package).
+MODULE_PACKAGES = {
+    "multipart": "python-multipart",
+    "dotenv": "python-dotenv",
+    "yaml": "pyyaml",
+    "PIL": "pillow",
+    "jinja2": "jinja2",
+    "aiofiles": "aiofiles",
+    "uvicorn": "uvicorn",
+    "fastapi": "fastapi",
+    "pydantic": "pydantic",
+    "requests": "requests",
+    "httpx": "httpx",
+    "bcrypt": "bcrypt",
+}
+
+
+@dataclass(frozen=True)
+class ErrorSignature:
+    error_type: str
+    template: str
+    role: str
+    file: str | None = None  # workspace-relative file the error points at (not part of the key)
+    message: str = ""  # the unmasked message, for fixes that need its values (not part of the key)
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha1(f"{self.error_type}|{self.template}|{self.role}".encode("utf-8")).hexdigest()[:16]
+
+    def __str__(self) -> str:
+        return f"{self.error_type}: {self.template} [{self.role}]"
+
+
+@dataclass
+class FixOps:
+    """File edits that carry over between workspaces: imports, 1:1 line swaps, requirement lines."""
+    add_imports: list[str] = field(default_factory=list)
+    replace_lines: list[tuple[str, str]] = field(default_factory=list)
+    add_requirements: list[str] = field(default_factory=list)
+    remove_requirements: list[str] = field(default_factory=list)
+    make_dirs: list[str] = field(default_factory=list)
+
+    def size(self) -> int:
+        return (len(self.add_imports) + len(self.replace_lines) + len(self.add_requirements)
+                + len(self.remove_requirements) + len(self.make_dirs))
+
+    def to_json(self) -> str:
+        return json.dumps(self.__dict__)
+
+    @classmethod
+    def from_json(cls, blob: str) -> "FixOps":
+        data = json.loads(blob or "{}")
+        data["replace_lines"] = [tuple(pair) for pair in data.get("replace_lines", [])]
+        return cls(**data)
+
+
+@dataclass
+class AppliedFix:
+    fix_id: int
+    signature: ErrorSignature
+    description: str
+
+
+def _template(message: str) -> str:
+    """Mask the run-specific parts of an error message: long/path-like strings and numbers."""
+    def quoted(m: re.Match) -> str:
+        inner = m.group(2)
+        return m.group(0) if _IDENT_RE.match(inner) and "/" not in inner else "<str>"
+
+    message = _QUOTED_RE.sub(quoted, message.strip())
+    message = _NUMBER_RE.sub("<n>", message)
+    return message[:200]
+
+
+def _role(rel: str | None, error_type: str) -> str:
+    if rel is None:
+        return "requirements" if error_type == "PipResolutionError" else "unknown"
+    if rel.endswith("backend/main.py"):
+        return "entrypoint"
+    if rel.endswith("requirements.txt"):
+        return "requirements"
+    if rel.endswith(".py"):
+        return "backend_module"
+    if rel.endswith(".html"):
+        return "template"
+    return "asset"
+
+
+def error_signature(error_text: str) -> ErrorSignature | None:
+    """Normalize a repair-loop error (install, syntax or runtime output) into a signature."""
+    pip = _PIP_RE.search(error_text)
+    if pip:
+        requirement = pip.group(1)
+        name = _REQ_NAME_RE.match(requirement)
+        package = name.group(1) if name else requirement
+        return ErrorSignature("PipResolutionError", f"no distribution for '{package.lower()}'", "requirements", REQUIREMENTS)
+
+    matches = _EXC_RE.findall(error_text)
+    if not matches:
+        return None
+    error_type, message = matches[-1]
+    error_type = error_type.rsplit(".", 1)[-1]
+
+    rel = None
+    for fname, _ in _FRAME_RE.findall(error_text):
+        idx = fname.replace("\\", "/").find("generated_app/")
+        if idx != -1:
+            rel = fname.replace("\\", "/")[idx:]
+    if rel is None and error_type == "SyntaxError":
+        m = re.search(r"SyntaxError in (\S+\.py)", error_text)
+        if m:
+            rel = f"generated_app/backend/{m.group(1)}"
+    return ErrorSignature(error_type, _template(message), _role(rel, error_type), rel, message.strip())
+
+
+# ─── Built-in fixers ────────────────────────────────────────────────────────
+
+
+def _builtin_ops(sig: ErrorSignature) -> tuple[FixOps, str] | None:
+    m = re.match(r"name '(\w+)' is not defined", sig.template)
+    if sig.error_type == "NameError" and m and m.group(1) in KNOWN_IMPORTS:
+        return FixOps(add_imports=[KNOWN_IMPORTS[m.group(1)]]), f"import {m.group(1)}"
+
+    # The template masks path-like strings, so the directory comes from the raw message
+    m = re.match(r"Directory '([\w./\-]+)' does not exist", sig.message)
+    if m and not m.group(1).startswith("/"):
+        return FixOps(make_dirs=[m.group(1)]), f"create directory {m.group(1)}"
+
+    m = re.match(r"No module named '([\w.]+)'", sig.template)
+    if sig.error_type in ("ModuleNotFoundError", "ImportError") and m:
+        top = m.group(1).split(".")[0]
+        if top in MODULE_PACKAGES:
+            return FixOps(add_requirements=[MODULE_PACKAGES[top]]), f"add {MODULE_PACKAGES[top]} to requirements"
+
+    m = re.match(r"no distribution for '(.+)'", sig.template)
+    if sig.error_type == "PipResolutionError" and m:
+        package = m.group(1)
+        if package in {p.lower() for p in MODULE_PACKAGES.values()}:
+            # A real package, so the pin is what's wrong: keep it unpinned
+            return FixOps(remove_requirements=[package], add_requirements=[package]), f"unpin {package}"
+        return FixOps(remove_requirements=[package]), f"drop unresolvable requirement {package}"
+    return None
+
+
+# ─── Applying ops ───────────────────────────────────────────────────────────
+
+
+def _read(path: Path) -> str:
+    try:
+        return path.read_text(encoding="utf-8")
+    except (OSError, UnicodeDecodeError):
+        return ""
+
+
+def _req_name(line: str) -> str | None:
+    m = _REQ_NAME_RE.match(line.split("#", 1)[0])
+    return m.group(1).lower().split("[")[0] if m else None
+
+
+def _apply_ops(ws: Path, ops: FixOps, target: str) -> bool:
+    """Apply ops to the workspace; returns False (changing nothing) if they don't fit this code."""
+    writes: dict[Path, str] = {}
+
+    if ops.add_imports or ops.replace_lines:
+        path = ws / target
+        text = _read(path)
+        if not text:
+            return False
+        lines = text.splitlines()
+        for old, new in ops.replace_lines:
+            hits = [i for i, line in enumerate(lines) if line.strip() == old.strip()]
+            if not hits:
+                return False
+            indent = lines[hits[0]][: len(lines[hits[0]]) - len(lines[hits[0]].lstrip())]
+            for i in hits:
+                lines[i] = indent + new.strip()
+        missing = [imp for imp in ops.add_imports if imp.strip() not in {l.strip() for l in lines}]
+        if missing:
+            # After the last top-level import (or at the top)
+            last = max((i for i, l in enumerate(lines) if l.startswith(("import ", "from "))), default=-1)
+            lines[last + 1:last + 1] = missing
+        new_text = "\n".join(lines) + ("\n" if text.endswith("\n") else "")
+        if new_text == text:
+            return False
+        writes[path] = new_text
+
+    if ops.add_requirements or ops.remove_requirements:
+        path = ws / REQUIREMENTS
+        lines = _read(path).splitlines()
+        drop = {r.lower() for r in ops.remove_requirements}
+        kept = [l for l in lines if _req_name(l) not in drop]
+        present = {_req_name(l) for l in kept}
+        kept += [r for r in ops.add_requirements if _req_name(r) not in present]
+        if kept == lines:
+            return False
+        writes[path] = "\n".join(kept) + "\n"
+
+    # Apps run with generated_app/backend as cwd; never create anything outside the workspace
+    dirs = [(ws / "generated_app" / "backend" / d).resolve() for d in ops.make_dirs]
+    if any(not d.is_relative_to(ws.resolve()) for d in dirs):
+        return False
+    for d in dirs:
+        d.mkdir(parents=True, exist_ok=True)
+    for path, text in writes.items():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+    return bool(writes or ops.make_dirs)
+
+
+def _target(sig: ErrorSignature) -> str:
+    if sig.file and sig.file.endswith(".py"):
+        return sig.file
+    return ENTRYPOINT
+
+
+def _with_session(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    with Session(engine) as session:
+        return fn(session, *args, **kwargs)
+
+
+def apply_cached_fix(ws: Path, sig: ErrorSignature) -> AppliedFix | None:
+    """
+    Apply a known fix for this signature, built-in first, then learned fixes that have
+    worked more often than not. Returns None if nothing applies (ask the LLM).
+    """
+    candidates: list[tuple[str, FixOps, str]] = []
+    builtin = _builtin_ops(sig)
+    if builtin is not None:
+        candidates.append(("builtin", builtin[0], builtin[1]))
+    for rec in _with_session(repo.find_fixes, sig.key):
+        if rec.source == "learned" and rec.successes >= rec.failures:
+            candidates.append(("learned", FixOps.from_json(rec.ops), rec.description))
+
+    for source, ops, description in candidates:
+        if _apply_ops(ws, ops, _target(sig)):
+            rec = _with_session(
+                repo.upsert_fix,
+                signature=sig.key,
+                source=source,
+                error_type=sig.error_type,
+                template=sig.template,
+                role=sig.role,
+                ops=ops.to_json(),
+                description=description,
+            )
+            _with_session(repo.record_fix_use, rec.id)
+            return AppliedFix(rec.id, sig, f"{source}: {description}")
+    return None
+
+
+def record_outcome(fix: AppliedFix, resolved: bool) -> None:
+    _with_session(repo.record_fix_outcome, fix.fix_id, resolved)
+
+
+# ─── Learning from LLM repairs ──────────────────────────────────────────────
+
+
+def snapshot(ws: Path) -> dict[str, str]:
+    """Backend sources + requirements before a repair patch, to diff against afterwards."""
+    backend = ws / "generated_app" / "backend"
+    files = {}
+    if backend.is_dir():
+        for p in backend.rglob("*"):
+            if p.is_file() and p.suffix in (".py", ".txt") and "venv" not in p.parts:
+                files[p.relative_to(ws).as_posix()] = _read(p)
+    return files
+
+
+def _ops_from_diff(before: dict[str, str], after: dict[str, str], target: str) -> FixOps | None:
+    ops = FixOps()
+    for rel in sorted(set(before) | set(after)):
+        old, new = before.get(rel, ""), after.get(rel, "")
+        if old == new:
+            continue
+        if rel.endswith("requirements.txt"):
+            old_names = {_req_name(l) for l in old.splitlines()} - {None}
+            new_lines = {_req_name(l): l.strip() for l in new.splitlines() if _req_name(l)}
+            ops.add_requirements += [line for name, line in new_lines.items() if name not in old_names]
+            ops.remove_requirements += sorted(old_names - set(new_lines))
+            continue
+        if rel != target:
+            return None  # touched another source file: not a local fix
+        a, b = old.splitlines(), new.splitlines()
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+            if tag == "equal":
+                continue
+            added = [l for l in b[j1:j2] if l.strip()]
+            if tag == "insert" and all(l.startswith(("import ", "from ")) for l in added):
+                ops.add_imports += added
+            elif tag == "replace" and i2 - i1 == j2 - j1:
+                ops.replace_lines += [(x, y) for x, y in zip(a[i1:i2], b[j1:j2]) if x.strip() != y.strip()]
+            else:
+                return None  # structural rewrite
+    if ops.size() == 0 or ops.size() > MAX_LEARNED_OPS:
+        return None
+    return ops
+
+
+def learn_fix(ws: Path, sig: ErrorSignature, before: dict[str, str]) -> bool:
+    """Store the reusable part of an LLM repair that resolved sig; False if it wasn't reusable."""
+    ops = _ops_from_diff(before, snapshot(ws), _target(sig))
+    if ops is None:
+        return False
+    rec = _with_session(
+        repo.upsert_fix,
+        signature=sig.key,
+        source="learned",
+        error_type=sig.error_type,
+        template=sig.template,
+        role=sig.role,
+        ops=ops.to_json(),
+        description=f"learned {ops.size()} line op(s)",
+    )
+    _with_session(repo.record_fix_outcome, rec.id, True)
+    return True
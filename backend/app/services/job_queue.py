@@ -0,0 +1,236 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+from sqlmodel import Session
+from app.db.database import engine
+from app.db import repo
+from app.services.timing import QUEUE_WAIT_SECONDS
+
+JobHandler = Callable[[int, dict[str, Any]], Awaitable[None]]
+
+
+class JobQueue:
+    """
+    Durable run queue in the Job table, drained by a fixed pool of async workers.
+
+    Delivery is at-least-once: a worker holds a lease on its job and keeps extending it
+    while the job runs. On graceful shutdown leased jobs go straight back to the queue;
+    if the process dies instead, the lease simply expires and any worker (after a
+    restart, or in another process) claims the job again. Jobs that keep getting
+    interrupted are failed after max_attempts.
+
+    cancel() stops a run for good: its queued jobs are dropped and an in-flight handler
+    task is cancelled (in another process, at that worker's next heartbeat), after
+    which on_cancel cleans up whatever the run left behind.
+    """
+    def __init__(
+        self,
+        handlers: dict[str, JobHandler],
+        workers: int = 2,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 3,
+        poll_interval: float = 2.0,
+        on_give_up: Callable[[int], Awaitable[None]] | None = None,
+        on_cancel: Callable[[int], Awaitable[None]] | None = None,
+    ):
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.on_give_up = on_give_up
+        self.on_cancel = on_cancel
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._busy = 0
+        self._waits: deque[float] = deque(maxlen=500)
+        self._processed = 0
+        # run_id -> (handler task, set once the job is finished and cleaned up)
+        self._running: dict[int, tuple[asyncio.Task, asyncio.Event]] = {}
+        self._cancelled: set[int] = set()
+        # Runs whose lease was lost (expired or taken over): stopped here, owned elsewhere now
+        self._lease_lost: set[int] = set()
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        released = await asyncio.to_thread(self._call, repo.release_jobs, self.owner)
+        if released:
+            print(f"[INFO] job queue: released {released} in-flight job(s) for the next start", flush=True)
+
+    def enqueue(self, session: Session, kind: str, run_id: int, payload: dict[str, Any]) -> int:
+        """Persist a job (from a sync route) and wake an idle worker."""
+        job = repo.enqueue_job(session, kind, run_id, json.dumps(payload))
+        self.notify()
+        return job.id
+
+    def notify(self) -> None:
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    @staticmethod
+    def _call(fn: Callable[..., Any], *args: Any) -> Any:
+        with Session(engine) as session:
+            return fn(session, *args)
+
+    async def cancel(self, run_id: int) -> bool:
+        """
+        Cancel a run's jobs. Returns True if its handler was running in this process
+        (it has been cancelled and cleaned up when this returns).
+        """
+        await asyncio.to_thread(self._call, repo.cancel_jobs, run_id)
+        running = self._running.get(run_id)
+        if running is None:
+            return False
+        task, finished = running
+        self._cancel_local(run_id, task)
+        try:
+            await asyncio.wait_for(finished.wait(), timeout=30)
+        except asyncio.TimeoutError:
+            print(f"[WARN] job queue: run {run_id} is slow to unwind after cancel", flush=True)
+        return True
+
+    def _cancel_local(self, run_id: int, task: asyncio.Task) -> None:
+        self._cancelled.add(run_id)
+        task.cancel()
+
+    async def _heartbeat(self, job_id: int, run_id: int, task: asyncio.Task) -> None:
+        """
+        Keep extending the job's lease. If it can't be kept (taken over, or not extended
+        in time because the DB kept failing) the handler is stopped: another worker may
+        already be running the same run in the same workspace.
+        """
+        loop = asyncio.get_running_loop()
+        extended_at = loop.time()
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                extended = await asyncio.to_thread(self._call, repo.extend_job_lease, job_id, self.owner, self.lease_seconds)
+                if extended:
+                    extended_at = loop.time()
+                    continue
+                job = await asyncio.to_thread(self._call, repo.get_job, job_id)
+            except Exception as e:
+                print(f"[WARN] job queue: could not extend lease of job {job_id}: {e}", flush=True)
+                if loop.time() - extended_at < self.lease_seconds:
+                    continue
+                job = None
+            if job is not None and job.status == "cancelled":
+                # Cancelled through another process
+                self._cancel_local(run_id, task)
+            else:
+                print(f"[WARN] job queue: lost the lease on job {job_id} (run {run_id}); stopping it here", flush=True)
+                self._lease_lost.add(run_id)
+                task.cancel()
+            return
+
+    async def _worker(self, index: int) -> None:
+        failures = 0
+        while True:
+            try:
+                job = await asyncio.to_thread(self._call, repo.claim_job, self.owner, self.lease_seconds)
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+                failures = 0
+            except Exception as e:
+                # e.g. "database is locked": keep the worker alive, back off a little
+                failures += 1
+                delay = min(self.poll_interval * 2 ** (failures - 1), 30.0)
+                print(f"[WARN] job queue worker {index}: {type(e).__name__}: {e}; retrying in {delay:.1f}s", flush=True)
+                await asyncio.sleep(delay)
+
+    async def _run(self, job) -> None:
+        if job.attempts > self.max_attempts:
+            await asyncio.to_thread(
+                self._call, repo.finish_job, job.id, self.owner, "failed", f"gave up after {job.attempts - 1} attempts"
+            )
+            if self.on_give_up is not None:
+                await self.on_give_up(job.run_id)
+            return
+
+        wait = (job.started_at - job.enqueued_at).total_seconds()
+        self._waits.append(wait)
+        QUEUE_WAIT_SECONDS.observe(wait, kind=job.kind)
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            await asyncio.to_thread(
+                self._call, repo.finish_job, job.id, self.owner, "failed", f"No handler for job kind {job.kind!r}"
+            )
+            return
+        task = asyncio.ensure_future(handler(job.run_id, json.loads(job.payload or "{}")))
+        finished = asyncio.Event()
+        self._running[job.run_id] = (task, finished)
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, job.run_id, task))
+        self._busy += 1
+        status, error = "done", None
+        try:
+            await task
+        except asyncio.CancelledError:
+            if job.run_id in self._lease_lost:
+                status = "lost"
+            elif job.run_id not in self._cancelled:
+                # Shutdown: stop() hands the lease back to the queue
+                raise
+            else:
+                status, error = "cancelled", "cancelled"
+        except Exception as e:
+            status, error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            self._busy -= 1
+            heartbeat.cancel()
+            if self._running.get(job.run_id, (None,))[0] is task:
+                del self._running[job.run_id]
+        try:
+            if status == "lost":
+                # The job belongs to whoever holds the lease now; leave its row alone
+                return
+            self._processed += 1
+            await asyncio.to_thread(self._call, repo.finish_job, job.id, self.owner, status, error)
+            if status == "cancelled" and self.on_cancel is not None:
+                await self.on_cancel(job.run_id)
+        finally:
+            self._cancelled.discard(job.run_id)
+            self._lease_lost.discard(job.run_id)
+            finished.set()
+
+    def stats(self) -> dict[str, Any]:
+        with Session(engine) as session:
+            counts = repo.job_counts(session)
+            oldest = repo.oldest_queued_job(session)
+        waits = sorted(self._waits)
+
+        def pct(p: float) -> float:
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        return {
+            "workers": self.workers,
+            "busy": self._busy,
+            "running_runs": sorted(self._running),
+            "jobs": counts,
+            "depth": counts.get("queued", 0),
+            "oldest_queued_s": (datetime.utcnow() - oldest.enqueued_at).total_seconds() if oldest else 0.0,
+            "processed": self._processed,
+            "wait_avg_s": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95_s": pct(0.95),
+            "wait_max_s": waits[-1] if waits else 0.0,
+        }
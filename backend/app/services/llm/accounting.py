@@ -0,0 +1,90 @@
+from __future__ import annotations
+from dataclasses import asdict, dataclass
+from typing import Any
+from app.db.models import LLMCall
+from app.db.repo import add_llm_call
+from app.services.llm.context import current_call
+from app.services.persist import spawn_persist
+from app.services.timing import LLM_CALL_SECONDS
+
+_NS_PER_MS = 1_000_000
+_USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "prompt_eval_ms", "eval_ms", "load_ms", "total_ms", "wall_ms")
+
+
+@dataclass
+class LLMUsage:
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    prompt_eval_ms: float | None = None
+    eval_ms: float | None = None
+    load_ms: float | None = None
+    total_ms: float | None = None
+    wall_ms: float = 0.0
+
+    @classmethod
+    def from_ollama(cls, final_chunk: dict[str, Any], wall_ms: float) -> "LLMUsage":
+        """Ollama's last stream chunk (done=true) carries counts and nanosecond durations."""
+        def ms(key: str) -> float | None:
+            value = final_chunk.get(key)
+            return value / _NS_PER_MS if isinstance(value, (int, float)) else None
+
+        return cls(
+            prompt_tokens=final_chunk.get("prompt_eval_count"),
+            completion_tokens=final_chunk.get("eval_count"),
+            prompt_eval_ms=ms("prompt_eval_duration"),
+            eval_ms=ms("eval_duration"),
+            load_ms=ms("load_duration"),
+            total_ms=ms("total_duration"),
+            wall_ms=wall_ms,
+        )
+
+    @classmethod
+    def from_openai(cls, usage: dict[str, Any] | None, wall_ms: float) -> "LLMUsage":
+        usage = usage or {}
+        return cls(
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            wall_ms=wall_ms,
+        )
+
+
+# In-process totals per model for /llm/stats; the per-run breakdown lives in the DB.
+_totals: dict[str, dict[str, float]] = {}
+
+
+def record_usage(model: str, usage: LLMUsage, endpoint: str | None = None) -> None:
+    """
+    Record one upstream LLM call, attributed to the run/stage from llm_call().
+    Called by providers when a response finishes; the DB write happens off the event loop.
+    """
+    ctx = current_call()
+    totals = _totals.setdefault(model, {"calls": 0})
+    totals["calls"] += 1
+    for key, value in asdict(usage).items():
+        if value is not None:
+            totals[key] = totals.get(key, 0) + value
+
+    LLM_CALL_SECONDS.observe(usage.wall_ms / 1000, model=model, stage=ctx.stage or "unknown")
+
+    fields = dict(asdict(usage), run_id=ctx.run_id, stage=ctx.stage, model=model, endpoint=endpoint)
+    spawn_persist(add_llm_call, fields, "LLM usage")
+
+
+def usage_totals() -> dict[str, dict[str, float]]:
+    return {model: dict(t) for model, t in _totals.items()}
+
+
+def summarize_calls(calls: list[LLMCall]) -> dict[str, Any]:
+    """Per-stage and overall totals for a run's LLM calls."""
+    def empty() -> dict[str, float]:
+        return {"calls": 0, **{k: 0 for k in _USAGE_FIELDS}}
+
+    by_stage: dict[str, dict[str, float]] = {}
+    total = empty()
+    for call in calls:
+        stage = by_stage.setdefault(call.stage or "unknown", empty())
+        for bucket in (stage, total):
+            bucket["calls"] += 1
+            for key in _USAGE_FIELDS:
+                bucket[key] += getattr(call, key) or 0
+    return {"stages": by_stage, "total": total}
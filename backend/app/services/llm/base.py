@@ -1,6 +1,31 @@
 from __future__ import annotations
+import hashlib
+import json
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, AsyncIterator
+
+# Per-call kwargs that control transport/caching rather than what the model generates.
+CONTROL_KWARGS = frozenset({"timeout", "cache", "validate", "priority"})
+
+def request_key(model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> str:
+    """
+    Content address of a chat request: model + prompts/messages + sampling options.
+    Two calls with the same key are expected to produce interchangeable responses.
+    """
+    options = {k: v for k, v in kwargs.items() if k not in CONTROL_KWARGS and k != "messages"}
+    blob = json.dumps(
+        {
+            "model": model,
+            "system": system,
+            "user": user,
+            "messages": kwargs.get("messages"),
+            "options": options,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
 
 class LLMClient(ABC):
     """
@@ -9,3 +34,46 @@ class LLMClient(ABC):
     @abstractmethod
     async def chat(self, model: str, system: str, user: str, **kwargs: Any) -> str:
         raise NotImplementedError
+
+    async def stream_chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> AsyncIterator[str]:
+        """
+        Yield the response as text chunks while the model is still generating.
+        Providers without native streaming fall back to a single chunk with the full reply.
+        Closing the iterator early (break / cancel) ends the upstream request.
+        """
+        yield await self.chat(model=model, system=system, user=user, **kwargs)
+
+    async def aopen(self) -> None:
+        """Open pooled connections up front (FastAPI startup). Optional for providers."""
+        return None
+
+    async def aclose(self) -> None:
+        """Release pooled connections. Providers without resources need not override."""
+        return None
+
+    def stats(self) -> dict[str, Any]:
+        return {}
+
+class LLMClientWrapper(LLMClient):
+    """
+    Base for layers that decorate another client (cache, request coalescing, ...).
+    Everything not overridden is delegated to the wrapped client.
+    """
+    def __init__(self, inner: LLMClient):
+        self.inner = inner
+
+    async def chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> str:
+        return await self.inner.chat(model=model, system=system, user=user, **kwargs)
+
+    async def stream_chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> AsyncIterator[str]:
+        async for chunk in self.inner.stream_chat(model=model, system=system, user=user, **kwargs):
+            yield chunk
+
+    async def aopen(self) -> None:
+        await self.inner.aopen()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+    def stats(self) -> dict[str, Any]:
+        return self.inner.stats()
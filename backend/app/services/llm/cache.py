@@ -0,0 +1,217 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable
+from app.services.llm.base import LLMClient, LLMClientWrapper, request_key
+
+
+class DiskLRUCache:
+    """
+    Size-bounded response store: one JSON file per key under root/<2-char shard>/.
+    Recency is tracked in memory (seeded from file mtimes on first use) and mirrored
+    to disk via utime so the LRU order survives restarts.
+    """
+    def __init__(self, root: Path, max_bytes: int, ttl_seconds: float):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._index: OrderedDict[str, int] | None = None  # key -> size, oldest first
+        self._total = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def _load_index(self) -> OrderedDict[str, int]:
+        if self._index is None:
+            entries = []
+            if self.root.exists():
+                for p in self.root.glob("*/*.json"):
+                    try:
+                        st = p.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, p.stem, st.st_size))
+            entries.sort()
+            self._index = OrderedDict((key, size) for _, key, size in entries)
+            self._total = sum(self._index.values())
+        return self._index
+
+    def _drop(self, key: str) -> None:
+        index = self._load_index()
+        size = index.pop(key, 0)
+        self._total -= size
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            index = self._load_index()
+            if key not in index:
+                return None
+            path = self._path(key)
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._drop(key)
+                return None
+            if self.ttl_seconds > 0 and time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+                self.expired += 1
+                self._drop(key)
+                return None
+            index.move_to_end(key)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return entry.get("response")
+
+    def put(self, key: str, response: str, meta: dict[str, Any] | None = None) -> None:
+        data = json.dumps(
+            {"created_at": time.time(), "response": response, **(meta or {})},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            index = self._load_index()
+            if key in index:
+                self._drop(key)
+            path = self._path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+            index[key] = len(data)
+            self._total += len(data)
+            while self._total > self.max_bytes and index:
+                oldest = next(iter(index))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if key in self._load_index():
+                self._drop(key)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            index = self._load_index()
+            return {
+                "entries": len(index),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+def _usable(validate: Callable[[str], bool], response: str) -> bool:
+    try:
+        return bool(validate(response))
+    except Exception:
+        return False
+
+
+class CachedLLMClient(LLMClientWrapper):
+    """
+    Content-addressed response cache in front of another LLMClient.
+
+    Keyed on model + system/user/messages + sampling options (see request_key).
+    Pass cache=False to chat() to bypass the cache for a single call. Pass
+    validate=<callable returning bool> to only store (and serve) responses the caller
+    can actually use; a bad response would otherwise be replayed on every retry.
+    """
+    def __init__(self, inner: LLMClient, store: DiskLRUCache):
+        super().__init__(inner)
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.rejected = 0
+
+    async def _lookup(self, key: str, model: str, validate: Callable[[str], bool] | None) -> str | None:
+        cached = await asyncio.to_thread(self.store.get, key)
+        if cached is None:
+            return None
+        if validate is not None and not _usable(validate, cached):
+            # Stored before validation existed, or the caller's rules changed
+            self.rejected += 1
+            await asyncio.to_thread(self.store.discard, key)
+            return None
+        self.hits += 1
+        print(f"DEBUG: LLM cache hit ({model}, {key[:12]})")
+        return cached
+
+    async def _store(self, key: str, model: str, response: str, validate: Callable[[str], bool] | None) -> None:
+        if not response:
+            return
+        if validate is not None and not _usable(validate, response):
+            self.rejected += 1
+            return
+        await asyncio.to_thread(self.store.put, key, response, {"model": model})
+
+    async def chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> str:
+        use_cache = kwargs.pop("cache", True)
+        validate = kwargs.pop("validate", None)
+        if not use_cache:
+            self.bypassed += 1
+            return await self.inner.chat(model=model, system=system, user=user, **kwargs)
+
+        key = request_key(model, system, user, **kwargs)
+        cached = await self._lookup(key, model, validate)
+        if cached is not None:
+            return cached
+
+        self.misses += 1
+        response = await self.inner.chat(model=model, system=system, user=user, **kwargs)
+        await self._store(key, model, response, validate)
+        return response
+
+    async def stream_chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> AsyncIterator[str]:
+        """
+        Cache hits replay as a single chunk. Misses stream through from the inner client
+        and are stored only if the stream ran to completion.
+        """
+        use_cache = kwargs.pop("cache", True)
+        validate = kwargs.pop("validate", None)
+        if not use_cache:
+            self.bypassed += 1
+            async for chunk in self.inner.stream_chat(model=model, system=system, user=user, **kwargs):
+                yield chunk
+            return
+
+        key = request_key(model, system, user, **kwargs)
+        cached = await self._lookup(key, model, validate)
+        if cached is not None:
+            yield cached
+            return
+
+        self.misses += 1
+        parts: list[str] = []
+        async for chunk in self.inner.stream_chat(model=model, system=system, user=user, **kwargs):
+            parts.append(chunk)
+            yield chunk
+        # chat() returns stripped text; store the same shape so both APIs share entries
+        response = "".join(parts).strip()
+        await self._store(key, model, response, validate)
+
+    def stats(self) -> dict[str, Any]:
+        out = dict(self.inner.stats())
+        out["cache"] = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "rejected": self.rejected,
+            **self.store.stats(),
+        }
+        return out
@@ -0,0 +1,26 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator
+
+@dataclass(frozen=True)
+class LLMCallContext:
+    """Who an LLM call is for: used for scheduling priority and per-run accounting."""
+    run_id: int | None = None
+    stage: str | None = None
+
+_current: ContextVar[LLMCallContext] = ContextVar("llm_call_context", default=LLMCallContext())
+
+def current_call() -> LLMCallContext:
+    return _current.get()
+
+@contextmanager
+def llm_call(run_id: int | None = None, stage: str | None = None) -> Iterator[LLMCallContext]:
+    """Attribute every LLM call made inside the block (and tasks it spawns) to run_id/stage."""
+    ctx = LLMCallContext(run_id=run_id, stage=stage)
+    token = _current.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current.reset(token)
@@ -1,14 +1,71 @@
 from __future__ import annotations
 from app.core.config import settings
 from app.services.llm.base import LLMClient
+from app.services.llm.cache import CachedLLMClient, DiskLRUCache
+from app.services.llm.http import default_limits
+from app.services.llm.scheduler import LLMScheduler, ScheduledLLMClient
+from app.services.llm.singleflight import SingleFlightLLMClient
 from app.services.llm.providers.ollama_client import OllamaLLM
 from app.services.llm.providers.openai_compat_client import OpenAICompatLLM
+from app.services.router import ModelRouter, get_endpoint_pool
 
-def get_llm_client() -> LLMClient:
+_shared_client: LLMClient | None = None
+
+def build_provider() -> LLMClient:
     mode = settings.LLM_MODE
     if mode == "api":
-        return OpenAICompatLLM(base_url=settings.API_BASE_URL, api_key=settings.API_KEY)
+        return OpenAICompatLLM(base_url=settings.API_BASE_URL, api_key=settings.API_KEY, limits=default_limits())
     if mode == "ollama":
-        return OllamaLLM(base_url=settings.OLLAMA_BASE_URL)
+        return OllamaLLM(
+            base_url=settings.OLLAMA_BASE_URL,
+            limits=default_limits(),
+            endpoints=get_endpoint_pool(),
+            health_interval=settings.OLLAMA_HEALTH_INTERVAL,
+            resident_models=ModelRouter().all_models(),
+            warm_up=settings.LLM_WARMUP_ENABLED,
+            keep_alive_range=(settings.LLM_KEEP_ALIVE_MIN, settings.LLM_KEEP_ALIVE_MAX),
+            residency_interval=settings.LLM_RESIDENCY_INTERVAL,
+        )
     raise ValueError(f"Unknown LLM_MODE: {mode}")
- 
\ No newline at end of file
+
+def build_llm_client() -> LLMClient:
+    # Layering (outermost first): cache -> single-flight -> scheduler -> provider.
+    # A cache miss that races an identical in-flight request joins it instead of hitting the model,
+    # so only distinct requests take a model slot.
+    client = build_provider()
+    client = ScheduledLLMClient(
+        client,
+        LLMScheduler(default_limit=settings.LLM_MAX_PARALLEL, model_limits=settings.LLM_MODEL_PARALLEL),
+    )
+    if settings.LLM_COALESCE_ENABLED:
+        client = SingleFlightLLMClient(client)
+    if settings.LLM_CACHE_ENABLED:
+        store = DiskLRUCache(
+            settings.LLM_CACHE_DIR,
+            max_bytes=settings.LLM_CACHE_MAX_MB * 1024 * 1024,
+            ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+        )
+        client = CachedLLMClient(client, store)
+    return client
+
+def get_llm_client() -> LLMClient:
+    """
+    Process-wide client: every run shares the same provider and its connection pool.
+    """
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = build_llm_client()
+    return _shared_client
+
+async def open_llm_client() -> LLMClient:
+    """Called on FastAPI startup so the pool lives on the server event loop."""
+    client = get_llm_client()
+    await client.aopen()
+    return client
+
+async def close_llm_client() -> None:
+    """Called on FastAPI shutdown to drain the pooled connections."""
+    global _shared_client
+    client, _shared_client = _shared_client, None
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,45 @@
+from __future__ import annotations
+import asyncio
+import httpx
+from app.core.config import settings
+
+
+def default_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+class PooledHTTPClient:
+    """
+    Long-lived, connection-pooled httpx.AsyncClient shared by every call a provider makes.
+
+    httpx connections belong to the event loop that opened them, so the client is
+    (re)created lazily per loop. In the API process everything runs on the server loop
+    and the same pool is reused across all runs; one-off scripts that call asyncio.run()
+    several times simply get a fresh pool for each loop.
+    """
+    def __init__(self, limits: httpx.Limits | None = None, headers: dict[str, str] | None = None):
+        self.limits = limits or default_limits()
+        self.headers = headers or {}
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def get(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                limits=self.limits,
+                headers=self.headers,
+                timeout=httpx.Timeout(None, connect=settings.LLM_CONNECT_TIMEOUT),
+            )
+            self._loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        if client is not None and not client.is_closed and self._loop is asyncio.get_running_loop():
+            await client.aclose()
+        self._loop = None
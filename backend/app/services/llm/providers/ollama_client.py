@@ -1,30 +1,123 @@
+import asyncio
 import httpx
 import sys
 import json
 import os
-from typing import Optional, List, Dict, Any
+import time
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+from app.services.llm.accounting import LLMUsage, record_usage
+from app.services.llm.base import LLMClient
+from app.services.llm.http import PooledHTTPClient
+from app.services.llm.residency import ResidencyManager
+from app.services.router import EndpointPool
 
 _STREAM_TO_STDOUT = os.getenv("OLLAMA_STREAM_TO_STDOUT", "").strip().lower() in ("1", "true", "yes")
 
-class OllamaLLM:
-    def __init__(self, base_url: str):
+# Chat-template tokens / role prefixes that completion-only models sometimes run on into.
+_STOP_MARKERS = ["<|im_start|>", "<|im_end|>", "<|endoftext|>", "User:", "Assistant:"]
+
+
+class _StopMarkerFilter:
+    """
+    Cuts a token stream at the first stop marker. Text that could still turn into a
+    marker is held back until the next chunk disambiguates it.
+    """
+    def __init__(self, markers: List[str]):
+        self.markers = markers
+        self.pending = ""
+        self.stopped = False
+
+    def feed(self, text: str) -> str:
+        buf = self.pending + text
+        cut = min((p for p in (buf.find(m) for m in self.markers) if p != -1), default=-1)
+        if cut != -1:
+            self.pending = ""
+            self.stopped = True
+            return buf[:cut]
+        hold = 0
+        for m in self.markers:
+            for n in range(min(len(m) - 1, len(buf)), hold, -1):
+                if buf.endswith(m[:n]):
+                    hold = n
+                    break
+        self.pending = buf[len(buf) - hold:] if hold else ""
+        return buf[: len(buf) - hold]
+
+    def flush(self) -> str:
+        out, self.pending = self.pending, ""
+        return out
+
+
+class OllamaLLM(LLMClient):
+    def __init__(
+        self,
+        base_url: str,
+        limits: Optional[httpx.Limits] = None,
+        endpoints: Optional[EndpointPool] = None,
+        health_interval: float = 15.0,
+        resident_models: Optional[List[str]] = None,
+        warm_up: bool = False,
+        keep_alive_range: Tuple[int, int] = (600, 4 * 3600),
+        residency_interval: float = 30.0,
+    ):
         self.base_url = base_url.rstrip("/")
+        self.endpoints = endpoints or EndpointPool([self.base_url])
+        self.health_interval = health_interval
+        self._health_task: Optional[asyncio.Task] = None
+        # Keep-alive pool reused by every call instead of a new client (and TCP handshake) per request.
+        # One client serves every endpoint; httpx keeps a connection pool per host.
+        self._http = PooledHTTPClient(limits)
+        self.residency = ResidencyManager(
+            self.endpoints,
+            self._http.get,
+            resident_models or [],
+            min_keep_alive=keep_alive_range[0],
+            max_keep_alive=keep_alive_range[1],
+        )
+        self.warm_up = warm_up
+        self.residency_interval = residency_interval
+        self._residency_task: Optional[asyncio.Task] = None
 
-    async def chat(
+    async def aopen(self) -> None:
+        self._http.get()
+        await self.endpoints.check_all(self._http.get())
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self.endpoints.monitor(self._http.get, self.health_interval))
+        if self.warm_up and (self._residency_task is None or self._residency_task.done()):
+            # Warm-up runs in the background; requests arriving meanwhile just wait on the load
+            self._residency_task = asyncio.create_task(self.residency.monitor(self.residency_interval))
+
+    async def aclose(self) -> None:
+        for attr in ("_health_task", "_residency_task"):
+            task = getattr(self, attr)
+            setattr(self, attr, None)
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        await self._http.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"endpoints": self.endpoints.stats(), "residency": self.residency.stats()}
+
+    def _build_request(
         self,
         model: str,
-        messages: Optional[List[Dict[str, Any]]] = None,
-        system: Optional[str] = None,
-        user: Optional[str] = None,
-        timeout: int = 1200,
-        max_tokens: int = 1200,
-        **kwargs: Any,
-    ) -> str:                                                   
-        """
-        Supports two calling styles:
-          A) chat(model=..., messages=[...], system="...")
-          B) chat(model=..., system="...", user="...")
-        """
+        messages: Optional[List[Dict[str, Any]]],
+        system: Optional[str],
+        user: Optional[str],
+        max_tokens: int,
+        temperature: Optional[float] = None,
+        seed: Optional[int] = None,
+    ) -> Tuple[str, Dict[str, Any], bool]:
+        """Returns (api path, payload, is_finetuned); the endpoint is chosen per call."""
+        options: Dict[str, Any] = {"num_predict": max_tokens}
+        if temperature is not None:
+            options["temperature"] = temperature
+        if seed is not None:
+            options["seed"] = seed
         # Build messages if caller used user/system style
         if messages is None:
             messages = []
@@ -44,78 +137,166 @@ class OllamaLLM:
         # a built-in chat template and work correctly with /api/chat.
         is_finetuned = any(kw in model.lower() for kw in ["lora", "ts", "taskspec", "code-model"])
 
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            if is_finetuned:
-                # ─── /api/generate WITH CORRECT Qwen2.5 INSTRUCT FORMAT ───
-                native_url = f"{self.base_url}/api/generate"
-                sys_prompt = ""
-                usr_prompt = ""
-                for msg in messages:
-                    role = msg.get("role", "")
-                    if role == "system":
-                        sys_prompt = msg.get("content", "")
-                    elif role == "user":
-                        usr_prompt = msg.get("content", "")
-                raw_prompt = (
-                    f"<|im_start|>system\n{sys_prompt}<|im_end|>\n"
-                    f"<|im_start|>user\n{usr_prompt}<|im_end|>\n"
-                    f"<|im_start|>assistant\n"
-                )
-                native_payload = {
-                    "model": model,
-                    "prompt": raw_prompt,
-                    "stream": True,
-                    "options": {"num_predict": max_tokens},
-                }
-            else:
-                # ─── /api/chat FOR STANDARD INSTRUCT MODELS ───
-                native_url = f"{self.base_url}/api/chat"
-                native_payload = {
-                    "model": model,
-                    "messages": messages,
-                    "stream": True,
-                    "options": {"num_predict": max_tokens},
-                }
+        if is_finetuned:
+            # ─── /api/generate WITH CORRECT Qwen2.5 INSTRUCT FORMAT ───
+            native_url = "/api/generate"
+            sys_prompt = ""
+            usr_prompt = ""
+            for msg in messages:
+                role = msg.get("role", "")
+                if role == "system":
+                    sys_prompt = msg.get("content", "")
+                elif role == "user":
+                    usr_prompt = msg.get("content", "")
+            raw_prompt = (
+                f"<|im_start|>system\n{sys_prompt}<|im_end|>\n"
+                f"<|im_start|>user\n{usr_prompt}<|im_end|>\n"
+                f"<|im_start|>assistant\n"
+            )
+            native_payload = {
+                "model": model,
+                "prompt": raw_prompt,
+                "stream": True,
+                "options": options,
+            }
+        else:
+            # ─── /api/chat FOR STANDARD INSTRUCT MODELS ───
+            native_url = "/api/chat"
+            native_payload = {
+                "model": model,
+                "messages": messages,
+                "stream": True,
+                "options": options,
+            }
+        return native_url, native_payload, is_finetuned
 
-            print(f"DEBUG: Ollama Request URL: {native_url}")
-            print(f"DEBUG: Ollama Model: {model}")
+    async def stream_chat(
+        self,
+        model: str,
+        system: Optional[str] = None,
+        user: Optional[str] = None,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        timeout: int = 1200,
+        max_tokens: int = 1200,
+        temperature: Optional[float] = None,
+        seed: Optional[int] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Yields content chunks from Ollama's NDJSON stream as they arrive, cut at the
+        first chat-template stop marker. Stopping early closes the HTTP stream, which
+        makes Ollama stop generating.
 
-            full_content = []
+        The call goes to the least-loaded healthy endpoint serving the model. Until the
+        first token arrives, connection and HTTP errors fail over to the next endpoint;
+        after that the error is raised, since the partial output was already yielded.
+        """
+        api_path, native_payload, is_finetuned = self._build_request(
+            model, messages, system, user, max_tokens, temperature=temperature, seed=seed
+        )
+        native_payload["keep_alive"] = self.residency.keep_alive_for(model)
 
+        print(f"DEBUG: Ollama Model: {model}")
+
+        client = self._http.get()
+        stop = _StopMarkerFilter(_STOP_MARKERS)
+        started = False
+        final_chunk: Dict[str, Any] = {}
+        last_error: Optional[Exception] = None
+        for ep in self.endpoints.pick(model):
+            native_url = f"{ep.url}{api_path}"
+            print(f"DEBUG: Ollama Request URL: {native_url}")
+            t0 = time.monotonic()
             try:
-                async with client.stream("POST", native_url, json=native_payload) as response:
-                    if response.status_code != 200:
-                        body = await response.aread()
-                        print(f"DEBUG: Ollama Error Response ({response.status_code}): {body.decode()}")
-                    response.raise_for_status()
-                    async for line in response.aiter_lines():
-                        if not line:
-                            continue
-                        try:
-                            chunk = json.loads(line)
+                with self.endpoints.lease(ep):
+                    async with client.stream("POST", native_url, json=native_payload, timeout=timeout) as response:
+                        if response.status_code != 200:
+                            body = await response.aread()
+                            print(f"DEBUG: Ollama Error Response ({response.status_code}): {body.decode()}")
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line:
+                                continue
+                            try:
+                                chunk = json.loads(line)
+                            except ValueError:
+                                continue
+                            if chunk.get("done"):
+                                final_chunk = chunk
                             if is_finetuned:
                                 content = chunk.get("response", "")
                             else:
                                 content = chunk.get("message", {}).get("content", "")
                             if content:
+                                if not started:
+                                    started = True
+                                    self.endpoints.observe(ep, time.monotonic() - t0)
                                 if _STREAM_TO_STDOUT:
                                     sys.stdout.write(content)
                                     sys.stdout.flush()
-                                full_content.append(content)
-                        except ValueError:
-                            pass
+                                text = stop.feed(content)
+                                if text:
+                                    yield text
+                                if stop.stopped:
+                                    break
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if started:
+                    print(f"Stream error: {e}")
+                    raise e
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                    # 4xx (unknown model, bad request) is the request's fault: another
+                    # endpoint would reject it too, and this one is healthy
+                    print(f"Stream error: {e}")
+                    raise e
+                self.endpoints.fail(ep)
+                last_error = e
+                print(f"Ollama endpoint {ep.url} failed ({e}); trying next endpoint")
+                continue
             except Exception as e:
                 print(f"Stream error: {e}")
                 raise e
+            break
+        else:
+            raise last_error or RuntimeError(f"No Ollama endpoint available for model {model}")
 
-            print("\n")  # Newline at end
+        # Counts/durations only arrive on the final chunk; a stream cut at a stop marker
+        # is still recorded with its wall time.
+        record_usage(model, LLMUsage.from_ollama(final_chunk, (time.monotonic() - t0) * 1000), endpoint=ep.url)
+        self.residency.note_request(model, ep.url)
+
+        tail = stop.flush()
+        if tail:
+            yield tail
+
+    async def chat(
+        self,
+        model: str,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        system: Optional[str] = None,
+        user: Optional[str] = None,
+        timeout: int = 1200,
+        max_tokens: int = 1200,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Supports two calling styles:
+          A) chat(model=..., messages=[...], system="...")
+          B) chat(model=..., system="...", user="...")
+        """
+        full_content = []
+        async for piece in self.stream_chat(
+            model=model,
+            system=system,
+            user=user,
+            messages=messages,
+            timeout=timeout,
+            max_tokens=max_tokens,
+            **kwargs,
+        ):
+            full_content.append(piece)
 
-            final_text = "".join(full_content)
-            print(f"DEBUG: Raw model output ({len(final_text)} chars): {repr(final_text[:500])}")
-            for marker in ["<|im_start|>", "<|im_end|>", "<|endoftext|>", "User:", "Assistant:"]:
-                pos = final_text.find(marker)
-                if pos != -1:
-                    final_text = final_text[:pos]
+        print("\n")  # Newline at end
 
-            return final_text.strip()
- 
\ No newline at end of file
+        final_text = "".join(full_content)
+        print(f"DEBUG: Raw model output ({len(final_text)} chars): {repr(final_text[:500])}")
+        return final_text.strip()
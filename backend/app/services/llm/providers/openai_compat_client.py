@@ -1,36 +1,111 @@
 from __future__ import annotations
+import json
+import time
+from typing import AsyncIterator
 import httpx
+from app.services.llm.accounting import LLMUsage, record_usage
 from app.services.llm.base import LLMClient
+from app.services.llm.http import PooledHTTPClient
 
 class OpenAICompatLLM(LLMClient):
     """
     Works with any OpenAI-compatible endpoint:
     POST {base_url}/v1/chat/completions
     """
-    def __init__(self, base_url: str, api_key: str):
+    def __init__(self, base_url: str, api_key: str, limits: httpx.Limits | None = None):
         self.base_url = base_url.rstrip("/")
         self.api_key = api_key
+        # TLS sessions stay open between calls; auth header is set once on the pooled client
+        self._http = PooledHTTPClient(limits, headers={"Authorization": f"Bearer {api_key}"})
 
-    async def chat(self, model: str, system: str, user: str, max_tokens: int | None = None, **kwargs: object) -> str:
+    async def aopen(self) -> None:
+        self._http.get()
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    def _payload(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        max_tokens: int | None,
+        temperature: float | None = None,
+        seed: int | None = None,
+    ) -> dict:
         if not self.base_url or not self.api_key:
             raise RuntimeError("API_BASE_URL or API_KEY missing for LLM_MODE=api")
 
-        url = f"{self.base_url}/v1/chat/completions"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-
         payload: dict = {
             "model": model,
             "messages": [
                 {"role": "system", "content": system},
                 {"role": "user", "content": user},
             ],
-            "temperature": 0.2,
+            "temperature": 0.2 if temperature is None else temperature,
         }
+        if seed is not None:
+            payload["seed"] = seed
         if max_tokens is not None:
             payload["max_tokens"] = max_tokens
+        return payload
 
-        async with httpx.AsyncClient(timeout=180) as client:
-            r = await client.post(url, headers=headers, json=payload)
+    async def stream_chat(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        max_tokens: int | None = None,
+        temperature: float | None = None,
+        seed: int | None = None,
+        **kwargs: object,
+    ) -> AsyncIterator[str]:
+        """Server-sent-events streaming (stream=true); yields delta content as it arrives."""
+        url = f"{self.base_url}/v1/chat/completions"
+        payload = self._payload(model, system, user, max_tokens, temperature=temperature, seed=seed)
+        payload["stream"] = True
+        # Ask for a final chunk with token usage (empty choices)
+        payload["stream_options"] = {"include_usage": True}
+
+        client = self._http.get()
+        usage = None
+        t0 = time.monotonic()
+        async with client.stream("POST", url, json=payload, timeout=180) as r:
             r.raise_for_status()
-            data = r.json()
-            return data["choices"][0]["message"]["content"]
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                usage = chunk.get("usage") or usage
+                choices = chunk.get("choices") or [{}]
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield content
+        record_usage(model, LLMUsage.from_openai(usage, (time.monotonic() - t0) * 1000), endpoint=self.base_url)
+
+    async def chat(
+        self,
+        model: str,
+        system: str,
+        user: str,
+        max_tokens: int | None = None,
+        temperature: float | None = None,
+        seed: int | None = None,
+        **kwargs: object,
+    ) -> str:
+        url = f"{self.base_url}/v1/chat/completions"
+        payload = self._payload(model, system, user, max_tokens, temperature=temperature, seed=seed)
+
+        client = self._http.get()
+        t0 = time.monotonic()
+        r = await client.post(url, json=payload, timeout=180)
+        r.raise_for_status()
+        data = r.json()
+        record_usage(model, LLMUsage.from_openai(data.get("usage"), (time.monotonic() - t0) * 1000), endpoint=self.base_url)
+        return data["choices"][0]["message"]["content"]
@@ -0,0 +1,156 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from app.services.router import Endpoint, EndpointPool, model_tag
+
+_NS_PER_MS = 1_000_000
+
+
+@dataclass
+class _ModelResidency:
+    arrivals: deque[float] = field(default_factory=lambda: deque(maxlen=64))
+    keep_alive: int = 0
+    loads: int = 0
+    evictions: int = 0
+    last_load_ms: float | None = None
+    resident_on: set[str] = field(default_factory=set)
+
+
+class ResidencyManager:
+    """
+    Keeps the pipeline's Ollama models loaded.
+
+    - warm_up(): loads every model on its endpoints (an empty /api/generate call).
+    - keep_alive_for(): the keep_alive sent with each request, sized from the gaps
+      between recent requests so a model outlives a typical lull in traffic.
+    - monitor(): polls /api/ps and reloads models that were evicted while still in use,
+      i.e. whose last request is younger than their keep_alive. Models nobody has asked
+      for since their keep_alive ran out are left unloaded, so they don't push out
+      models that are actually busy.
+    """
+    def __init__(
+        self,
+        pool: EndpointPool,
+        get_client: Callable[[], Any],
+        models: list[str],
+        min_keep_alive: int = 600,
+        max_keep_alive: int = 4 * 3600,
+    ):
+        self.pool = pool
+        self.get_client = get_client
+        self.min_keep_alive = min_keep_alive
+        self.max_keep_alive = max_keep_alive
+        self.models: dict[str, _ModelResidency] = {}
+        for m in models:
+            self._state(m)
+
+    def _state(self, model: str) -> _ModelResidency:
+        st = self.models.get(model)
+        if st is None:
+            st = self.models[model] = _ModelResidency(keep_alive=self._default_keep_alive())
+        return st
+
+    def _default_keep_alive(self) -> int:
+        return min(self.max_keep_alive, max(self.min_keep_alive, 1800))
+
+    def note_request(self, model: str, endpoint: str | None = None) -> None:
+        st = self._state(model)
+        if endpoint is not None:
+            st.resident_on.add(endpoint)
+        st.arrivals.append(time.monotonic())
+        gaps = sorted(b - a for a, b in zip(st.arrivals, list(st.arrivals)[1:]))
+        if len(gaps) >= 2:
+            p90 = gaps[min(len(gaps) - 1, int(0.9 * len(gaps)))]
+            st.keep_alive = int(min(self.max_keep_alive, max(self.min_keep_alive, 3 * p90)))
+
+    def keep_alive_for(self, model: str) -> int:
+        return self._state(model).keep_alive
+
+    def _recently_used(self, st: _ModelResidency) -> bool:
+        return bool(st.arrivals) and time.monotonic() - st.arrivals[-1] < st.keep_alive
+
+    async def load(self, model: str, ep: Endpoint) -> None:
+        st = self._state(model)
+        t0 = time.monotonic()
+        try:
+            r = await self.get_client().post(
+                f"{ep.url}/api/generate",
+                json={"model": model, "keep_alive": st.keep_alive},
+                timeout=600,
+            )
+            r.raise_for_status()
+            data = r.json()
+        except Exception as e:
+            print(f"[WARN] could not load {model} on {ep.url}: {e}", flush=True)
+            return
+        load_ns = data.get("load_duration")
+        st.last_load_ms = load_ns / _NS_PER_MS if isinstance(load_ns, (int, float)) else (time.monotonic() - t0) * 1000
+        st.loads += 1
+        st.resident_on.add(ep.url)
+        print(f"[INFO] loaded {model} on {ep.url} in {st.last_load_ms:.0f} ms (keep_alive={st.keep_alive}s)", flush=True)
+
+    async def _loaded_models(self, ep: Endpoint) -> set[str] | None:
+        try:
+            r = await self.get_client().get(f"{ep.url}/api/ps", timeout=5)
+            r.raise_for_status()
+            return {m.get("name", "") for m in r.json().get("models", [])}
+        except Exception:
+            return None
+
+    async def warm_up(self) -> None:
+        # Load sequentially per endpoint: parallel loads on one box just fight over VRAM
+        by_endpoint: dict[str, list[str]] = {}
+        for model in self.models:
+            for ep in self.pool.endpoints_for(model):
+                by_endpoint.setdefault(ep.url, []).append(model)
+
+        async def warm_endpoint(url: str, models: list[str]) -> None:
+            ep = self.pool.endpoints[url]
+            loaded = await self._loaded_models(ep) or set()
+            for model in models:
+                if model_tag(model) in loaded:
+                    self._state(model).resident_on.add(url)
+                else:
+                    await self.load(model, ep)
+
+        await asyncio.gather(*(warm_endpoint(u, ms) for u, ms in by_endpoint.items()))
+
+    async def check(self) -> None:
+        for ep in self.pool.endpoints.values():
+            if not ep.healthy:
+                continue
+            loaded = await self._loaded_models(ep)
+            if loaded is None:
+                continue
+            for model, st in self.models.items():
+                if ep.url not in st.resident_on:
+                    continue
+                if model_tag(model) in loaded:
+                    continue
+                st.resident_on.discard(ep.url)
+                st.evictions += 1
+                if self._recently_used(st):
+                    await self.load(model, ep)
+
+    async def monitor(self, interval: float, warm_up: bool = True) -> None:
+        """Warm up once, then check residency forever; run as a background task."""
+        if warm_up:
+            await self.warm_up()
+        while True:
+            await asyncio.sleep(interval)
+            await self.check()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            model: {
+                "keep_alive_s": st.keep_alive,
+                "resident_on": sorted(st.resident_on),
+                "loads": st.loads,
+                "evictions": st.evictions,
+                "last_load_ms": st.last_load_ms,
+            }
+            for model, st in self.models.items()
+        }
@@ -0,0 +1,168 @@
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+from app.services.llm.base import LLMClient, LLMClientWrapper
+from app.services.llm.context import current_call
+
+# Lower runs first. Fixing an existing app beats starting a new one; within fresh
+# generation the cheap enhancement call goes ahead of spec and codegen.
+STAGE_PRIORITY: dict[str, int] = {
+    "repair": 0,
+    "modify": 0,
+    "enhance": 1,
+    "spec": 2,
+    "codegen": 3,
+}
+DEFAULT_PRIORITY = 2
+
+
+class _ModelQueue:
+    """Admission queue for one model: at most `limit` calls in flight, the rest wait in priority order."""
+    def __init__(self, model: str, limit: int):
+        self.model = model
+        self.limit = max(1, limit)
+        self.active = 0
+        self.heap: list[list[Any]] = []  # [priority, fair_tag, seq, future]
+        self.seq = itertools.count()
+        # Start-time fair queuing within a priority class: each run's next request is
+        # tagged after its previous one, so one run cannot starve the others.
+        self.vtime = 0
+        self.run_tags: dict[int, int] = {}
+        self.waits: deque[float] = deque(maxlen=512)
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def tag_for(self, run_id: int | None) -> int:
+        if run_id is None:
+            return self.vtime
+        tag = max(self.vtime, self.run_tags.get(run_id, -1) + 1)
+        self.run_tags[run_id] = tag
+        if len(self.run_tags) > 1024:
+            self.run_tags = {r: t for r, t in self.run_tags.items() if t >= self.vtime}
+        return tag
+
+    def record_wait(self, seconds: float) -> None:
+        self.waits.append(seconds)
+        self.granted += 1
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+
+    def queued(self) -> int:
+        return sum(1 for e in self.heap if not e[3].done())
+
+    def snapshot(self) -> dict[str, Any]:
+        recent = sorted(self.waits)
+
+        def pct(p: float) -> float:
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(p * len(recent)))] * 1000
+
+        by_priority: dict[int, int] = {}
+        for e in self.heap:
+            if not e[3].done():
+                by_priority[e[0]] = by_priority.get(e[0], 0) + 1
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued(),
+            "queued_by_priority": by_priority,
+            "granted": self.granted,
+            "wait_avg_ms": (self.total_wait / self.granted * 1000) if self.granted else 0.0,
+            "wait_max_ms": self.max_wait * 1000,
+            "wait_p50_ms": pct(0.50),
+            "wait_p95_ms": pct(0.95),
+        }
+
+
+class LLMScheduler:
+    def __init__(self, default_limit: int = 1, model_limits: dict[str, int] | None = None):
+        self.default_limit = default_limit
+        self.model_limits = model_limits or {}
+        self._queues: dict[str, _ModelQueue] = {}
+
+    def _queue(self, model: str) -> _ModelQueue:
+        q = self._queues.get(model)
+        if q is None:
+            q = _ModelQueue(model, self.model_limits.get(model, self.default_limit))
+            self._queues[model] = q
+        return q
+
+    def _release(self, q: _ModelQueue) -> None:
+        q.active -= 1
+        while q.heap:
+            entry = heapq.heappop(q.heap)
+            fut = entry[3]
+            if fut.done():  # waiter was cancelled while queued
+                continue
+            q.active += 1
+            q.vtime = max(q.vtime, entry[1])
+            fut.set_result(None)
+            break
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: int = DEFAULT_PRIORITY, run_id: int | None = None) -> AsyncIterator[None]:
+        q = self._queue(model)
+        enqueued = time.monotonic()
+        if q.active < q.limit and not q.queued():
+            q.active += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(q.heap, [priority, q.tag_for(run_id), next(q.seq), fut])
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # Slot was handed to us just as we got cancelled: pass it on
+                    self._release(q)
+                else:
+                    fut.cancel()
+                raise
+        q.record_wait(time.monotonic() - enqueued)
+        try:
+            yield
+        finally:
+            self._release(q)
+
+    def stats(self) -> dict[str, Any]:
+        return {model: q.snapshot() for model, q in self._queues.items()}
+
+
+class ScheduledLLMClient(LLMClientWrapper):
+    """
+    Routes every call through LLMScheduler so each model only sees as many concurrent
+    requests as it has parallel slots. Priority comes from the calling stage (see
+    llm_call()) unless a priority= kwarg is given.
+    """
+    def __init__(self, inner: LLMClient, scheduler: LLMScheduler):
+        super().__init__(inner)
+        self.scheduler = scheduler
+
+    def _priority(self, kwargs: dict[str, Any]) -> tuple[int, int | None]:
+        ctx = current_call()
+        priority = kwargs.pop("priority", None)
+        if priority is None:
+            priority = STAGE_PRIORITY.get(ctx.stage or "", DEFAULT_PRIORITY)
+        return priority, ctx.run_id
+
+    async def chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> str:
+        priority, run_id = self._priority(kwargs)
+        async with self.scheduler.slot(model, priority, run_id):
+            return await self.inner.chat(model=model, system=system, user=user, **kwargs)
+
+    async def stream_chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> AsyncIterator[str]:
+        priority, run_id = self._priority(kwargs)
+        async with self.scheduler.slot(model, priority, run_id):
+            async for chunk in self.inner.stream_chat(model=model, system=system, user=user, **kwargs):
+                yield chunk
+
+    def stats(self) -> dict[str, Any]:
+        out = dict(self.inner.stats())
+        out["scheduler"] = self.scheduler.stats()
+        return out
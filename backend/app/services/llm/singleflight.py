@@ -0,0 +1,120 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, AsyncIterator
+from app.services.llm.base import LLMClient, LLMClientWrapper, request_key
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamFlight:
+    """One upstream stream fanned out to every subscriber; late joiners replay buffered chunks."""
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.waiters = 0
+        self.updated = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def notify(self) -> None:
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+
+class SingleFlightLLMClient(LLMClientWrapper):
+    """
+    Coalesces concurrent identical chat() requests into one upstream call.
+
+    The first caller for a request key starts the upstream call; callers that arrive
+    while it is still running await the same result. Nothing is kept once the call
+    finishes (that is the response cache's job). If every waiter is cancelled the
+    upstream call is cancelled too, so abandoned requests stop using the GPU.
+    """
+    def __init__(self, inner: LLMClient):
+        super().__init__(inner)
+        self._flights: dict[str, _Flight] = {}
+        self._streams: dict[str, _StreamFlight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> str:
+        key = request_key(model, system, user, **kwargs)
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(self.inner.chat(model=model, system=system, user=user, **kwargs))
+            flight = _Flight(task)
+            self._flights[key] = flight
+            task.add_done_callback(lambda _t, key=key, flight=flight: self._forget(key, flight))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            print(f"DEBUG: Coalesced identical in-flight LLM request ({model}, {key[:12]})")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    async def _pump(self, key: str, flight: _StreamFlight, model: str, system: str | None, user: str | None, kwargs: dict[str, Any]) -> None:
+        try:
+            async for chunk in self.inner.stream_chat(model=model, system=system, user=user, **kwargs):
+                flight.chunks.append(chunk)
+                flight.notify()
+        except BaseException as e:
+            flight.error = e
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            flight.done = True
+            flight.notify()
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    async def stream_chat(self, model: str, system: str | None = None, user: str | None = None, **kwargs: Any) -> AsyncIterator[str]:
+        key = request_key(model, system, user, **kwargs)
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._pump(key, flight, model, system, user, kwargs))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            print(f"DEBUG: Coalesced identical in-flight LLM stream ({model}, {key[:12]})")
+
+        flight.waiters += 1
+        pos = 0
+        try:
+            while True:
+                while pos < len(flight.chunks):
+                    yield flight.chunks[pos]
+                    pos += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.updated.wait()
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done and flight.task is not None:
+                flight.task.cancel()
+
+    def stats(self) -> dict[str, Any]:
+        out = dict(self.inner.stats())
+        out["singleflight"] = {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._flights) + len(self._streams),
+        }
+        return out
@@ -1,7 +1,73 @@
+import asyncio
 from sqlmodel import Session
-from app.db.repo import add_log
+from app.db.database import engine
+from app.db.repo import add_log, add_logs
+
+# Most events written per transaction by the background log writer.
+LOG_BATCH = 200
 
 def log(session: Session, run_id: int, stage: str, message: str, level: str = "INFO"):
     # Mirror logs to terminal so users can trace flow live.
     print(f"[{level}] [run:{run_id}] [{stage}] {message}", flush=True)
     add_log(session, run_id=run_id, stage=stage, level=level, message=message)
+
+def _write_logs(events: list[dict]) -> None:
+    with Session(engine) as session:
+        add_logs(session, events)
+
+class _LogWriter:
+    """
+    Persists log events from a single background task, in submission order, batching
+    whatever has queued up into one transaction. Pipeline stages don't wait on SQLite
+    for every line they log.
+    """
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def submit(self, event: dict) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._drain(self._queue))
+        self._queue.put_nowait(event)
+
+    async def _drain(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < LOG_BATCH and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await asyncio.to_thread(_write_logs, batch)
+            except Exception as e:
+                print(f"[WARN] could not persist {len(batch)} log events: {e}", flush=True)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def flush(self) -> None:
+        if self._queue is not None and self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+_writer = _LogWriter()
+
+async def alog(run_id: int, stage: str, message: str, level: str = "INFO"):
+    """log() for async code: the DB write is queued to the background log writer."""
+    print(f"[{level}] [run:{run_id}] [{stage}] {message}", flush=True)
+    _writer.submit({"run_id": run_id, "stage": stage, "level": level, "message": message})
+
+async def flush_logs() -> None:
+    """Wait until every queued log event is in the database."""
+    await _writer.flush()
+
+async def close_logs() -> None:
+    await _writer.close()
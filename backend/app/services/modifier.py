@@ -18,6 +18,10 @@ FORMAT B — JSON (only if you cannot use A):
 {"files":[{"path":"generated_app/frontend/contact.html","content":"<!DOCTYPE html>\\n...\\n"}]}
 Every element MUST have "path" and "content" (complete file). Escape " as \\" and newlines as \\n inside content.
 
+Files shown as "--- EXCERPT: PATH ..." are incomplete: never rewrite them with format A or B.
+If one of them must change, reply with a unified diff (--- a/PATH, +++ b/PATH, @@ -START,COUNT +START,COUNT @@ hunks)
+for every file you change, taking START from the "[lines A-B]" markers.
+
 Guidelines:
 - If the user says "contact page" / "about page", edit generated_app/frontend/contact.html or about.html — do not invent homepage.html or maps.html.
 - Change only files that need edits; always send the FULL file content for each changed file.
@@ -78,7 +82,8 @@ Assistant (repeat for every HTML file that contains the navbar; use href paths y
 
 async def llm_modify(llm: LLMClient, model: str, user_request: str, context: str) -> str:
     user_prompt = f"USER REQUEST: {user_request}\n\nCURRENT CODE CONTEXT:\n{context}\n\nPlease generate a patch to implement the requested changes."
-    return await llm.chat(model=model, system=SYSTEM_MODIFY, user=user_prompt, max_tokens=16384)
+    # Never cached: a retry must get a fresh answer, not the patch that failed to apply
+    return await llm.chat(model=model, system=SYSTEM_MODIFY, user=user_prompt, max_tokens=16384, cache=False)
 
 
 SYSTEM_MODIFY_JSON_ONLY = """You output ONLY one valid JSON object. No markdown, no code fences, no text before or after.
@@ -105,4 +110,4 @@ async def llm_modify_json_only(llm: LLMClient, model: str, user_request: str, co
         f"USER REQUEST:\n{user_request}\n\nCURRENT CODE CONTEXT:\n{context}\n\n"
         "Respond with the JSON object only."
     )
-    return await llm.chat(model=model, system=SYSTEM_MODIFY_JSON_ONLY, user=user, max_tokens=16384)
+    return await llm.chat(model=model, system=SYSTEM_MODIFY_JSON_ONLY, user=user, max_tokens=16384, cache=False)
@@ -1,31 +1,51 @@
 from __future__ import annotations
 import asyncio
+import time
 from pathlib import Path
 from sqlmodel import Session
 
 from app.core.config import settings
 from app.services.workspace import project_workspace, write_files
-from app.services.logging_service import log
+from app.services.logging_service import alog, flush_logs
+from app.services.dag import DAG, NodeTiming
+from app.services.timing import record_timing, timed
+from app.services.sandbox.base import ExecResult
+from app.services.sandbox.syntax_check import compile_error
 from app.services.sandbox.venv_runner import VenvSandboxRunner
-from app.db.repo import update_run_status
+from app.db.database import engine
+from app.db.repo import get_run, update_run_status
 
+from app.services.llm.context import llm_call
 from app.services.llm.factory import get_llm_client
 from app.services.router import ModelRouter
 from app.services.prompt_enhancer import llm_enhance_prompt
 from app.services.spec_generator import llm_prompt_to_spec
 from app.services.code_generator import (
     llm_spec_to_code,
+    parse_gen_output,
     post_process_output,
     repair_main_routes_on_disk,
     GenOutput,
     GenFile,
 )
+from app.services.prompt_to_spec import TaskSpec
 from app.services.repair import llm_repair
+from app.services.context_packer import estimate_tokens, pack_context
+from app.services.checkpoints import RunCheckpoints
+from app.services.file_hashes import FileHashes
+from app.services.prompt_index import PromptMatch, prompt_index
 from app.services.patcher import apply_unified_patch
+from app.services.fix_cache import (
+    AppliedFix,
+    ErrorSignature,
+    apply_cached_fix,
+    error_signature,
+    learn_fix,
+    record_outcome as record_fix_outcome,
+    snapshot as fix_snapshot,
+)
 
 
-from app.core.utils import parse_traceback
-
 def validate_generated_files(files: list) -> list[str]:
     """
     Validates generated files for quality issues.
@@ -94,130 +114,378 @@ def validate_generated_files(files: list) -> list[str]:
 
 
 
-def _context_snippets(workspace: Path, error_text: str = "") -> str:
+def _syntax_warnings(f: GenFile) -> list[str]:
+    if not f.path.endswith(".py"):
+        return []
+    error = compile_error(f.path, f.content.encode("utf-8"))
+    return [error] if error else []
+
+
+def _codegen_problems(gen: GenOutput) -> list[str]:
+    """What a parallel codegen sample is judged by: validation warnings plus syntax errors."""
+    if not gen.files:
+        return ["No files generated"]
+    problems = validate_generated_files([{"path": f.path, "content": f.content} for f in gen.files])
+    for f in gen.files:
+        problems.extend(_syntax_warnings(f))
+    return problems
+
+
+class _StreamedFiles:
     """
-    Send only important files to repair model (avoid huge context).
-    Uses error traceback to narrow down files.
+    on_file callback for streaming codegen: materializes each file into the workspace
+    and runs the per-file checks as soon as the model finishes emitting it.
     """
-    relevant_files = set()
-    if error_text:
-        matches = parse_traceback(error_text)
-        for fname, _ in matches:
-            # Clean up path (sometimes weird in trace)
-            if "generated_app" in fname:
-                # keep logical path relative to workspace
-                # e.g. .../generated_app/backend/main.py
-                # we try to find suffix in our candidate list
-                start_idx = fname.find("generated_app")
-                if start_idx != -1:
-                    rel = fname[start_idx:].replace("\\", "/")
-                    relevant_files.add(rel)
-
-    # Priority order only — no demo-specific filenames (menu/order/styles) required.
-    candidates: list[str] = [
-        "generated_app/backend/main.py",
-        "generated_app/backend/requirements.txt",
-    ]
-    seen: set[str] = set(candidates)
-
-    frontend_dir = workspace / "generated_app" / "frontend"
-    if frontend_dir.exists():
-        for pattern in ("*.html", "*.css", "*.js"):
-            for f in sorted(frontend_dir.glob(pattern)):
-                rel = f.relative_to(workspace).as_posix()
-                if rel not in seen:
-                    seen.add(rel)
-                    candidates.append(rel)
-    
-    # If we found specific files in trace, prioritize them + requirements.txt
-    if relevant_files:
-        relevant_files.add("generated_app/backend/requirements.txt")
-        main_py = "generated_app/backend/main.py"
-        if (workspace / main_py).exists():
-            relevant_files.add(main_py)
-        final_list = sorted(relevant_files)
-    else:
-        # Fallback to all candidates
-        final_list = candidates
-
-    parts = []
-    for rel in final_list:
-        p = workspace / rel
-        if p.exists():
-            text = p.read_text(encoding="utf-8")
-            # limit size per file
-            text = text[:4000]
-            parts.append(f"\n--- FILE: {rel} (Use this exact path for patching) ---\n{text}\n")
-    return "\n".join(parts)
+    def __init__(self, workspace: Path):
+        self.workspace = workspace
+        self.written: dict[str, str] = {}
+        self.warnings: dict[str, list[str]] = {}
+        self.closed = False
+        self._waiters: list[tuple[str, asyncio.Future]] = []
+
+    def _materialize(self, f: GenFile) -> list[str]:
+        write_files(self.workspace, [{"path": f.path, "content": f.content}])
+        return validate_generated_files([{"path": f.path, "content": f.content}]) + _syntax_warnings(f)
+
+    async def __call__(self, f: GenFile) -> None:
+        warnings = await asyncio.to_thread(self._materialize, f)
+        self.written[f.path] = f.content
+        # A retry re-emits files; keep the latest version's results only
+        self.warnings[f.path] = warnings
+        for suffix, fut in self._waiters:
+            if f.path.endswith(suffix) and not fut.done():
+                fut.set_result(f.content)
+
+    async def first(self, suffix: str) -> str | None:
+        """Content of the first streamed file whose path ends with suffix; None if the stream ends without one."""
+        for path, content in self.written.items():
+            if path.endswith(suffix):
+                return content
+        if self.closed:
+            return None
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((suffix, fut))
+        return await fut
+
+    def close(self) -> None:
+        self.closed = True
+        for _, fut in self._waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+
+# Key files hardening re-processes after a patch (paths relative to generated_app)
+HARDENED_FILES = ("backend/main.py", "backend/requirements.txt", "frontend/app.js", "frontend/main.css")
+
+
+def _harden_patched_files(ws: Path, changed: set[str]) -> list[str]:
+    """
+    Re-run post-processing over the key files a repair patch changed. Files that
+    post-processing leaves as they are aren't rewritten, so their mtimes stay put.
+    Returns the paths that were rewritten.
+    """
+    generated_app_dir = ws / "generated_app"
+    files_to_harden = []
+    for rel in HARDENED_FILES:
+        path = generated_app_dir / rel
+        if f"generated_app/{rel}" in changed and path.exists():
+            files_to_harden.append(GenFile(path=rel, content=path.read_text(encoding="utf-8")))
+    if not files_to_harden:
+        return []
+
+    original = {f.path: f.content for f in files_to_harden}
+    processed = post_process_output(GenOutput(files=files_to_harden))
+    rewritten = []
+    for f in processed.files:
+        if f.content == original.get(f.path):
+            continue
+        full_path = generated_app_dir / f.path.replace("\\", "/")
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        full_path.write_text(f.content, encoding="utf-8")
+        rewritten.append(f.path)
+    return rewritten
+
+
+def _validate_changed(ws: Path, changed: set[str]) -> list[str]:
+    files = []
+    for rel in sorted(changed):
+        path = ws / rel
+        if path.is_file() and path.suffix in (".py", ".html", ".css", ".js"):
+            files.append({"path": rel, "content": path.read_text(encoding="utf-8", errors="replace")})
+    return validate_generated_files(files)
+
 
 
 class Orchestrator:
     def __init__(self):
         self.runner = VenvSandboxRunner()
+        self.runner.on_preview_stopped = self._preview_stopped
         self.router = ModelRouter()
         self.llm = get_llm_client()
 
-    def execute_run(self, session: Session, run, prompt: str, host: str = "0.0.0.0"):
+    async def _attributed(self, coro, run_id: int, stage: str):
+        # Scheduler priority and usage accounting read the run/stage from this context
+        with llm_call(run_id=run_id, stage=stage):
+            return await coro
+
+    async def _set_status(self, run, status: str, attempts: int | None = None) -> None:
+        def _write() -> None:
+            with Session(engine) as session:
+                db_run = get_run(session, run.id)
+                if db_run is not None:
+                    update_run_status(session, db_run, status, attempts=attempts)
+
+        # Logs are written in the background; land them before the status clients poll on
+        await flush_logs()
+        await asyncio.to_thread(_write)
+        run.status = status
+        if attempts is not None:
+            run.attempts = attempts
+
+    async def _settle_fix(
+        self,
+        run_id: int,
+        ws: Path,
+        pending: tuple[ErrorSignature, AppliedFix | None, dict[str, str] | None] | None,
+        succeeded: bool,
+    ) -> None:
         """
-        Sync entrypoint (FastAPI route uses sync).
-        Internally we call async LLM via asyncio.run().
+        Once the attempt after a fix has finished: score a cached fix, or learn from an
+        LLM repair. Only an attempt that succeeded counts as resolved; a different (or
+        unparseable) error afterwards may just mean the fix uncovered the next problem.
         """
-        update_run_status(session, run, "running", attempts=run.attempts + 1)
-        ws: Path = project_workspace(run.project_id, run.id)
-        log(session, run.id, "workspace", f"Workspace: {ws}")
-
-        # Use unique port per run to avoid conflicts
-        port = settings.PREVIEW_PORT_BASE + run.id
-        log(session, run.id, "run", f"Will start generated app on http://{host}:{port}")
+        if pending is None:
+            return
+        sig, applied, before = pending
+        resolved = succeeded
+        try:
+            if applied is not None:
+                await asyncio.to_thread(record_fix_outcome, applied, resolved)
+            elif resolved and before is not None and await asyncio.to_thread(learn_fix, ws, sig, before):
+                await alog(run_id, "repair", f"Learned a reusable fix for {sig}")
+        except Exception as e:
+            await alog(run_id, "repair", f"Fix cache update failed: {e}", level="WARN")
 
+    async def _similar_run(self, run_id: int, text: str, kind: str) -> PromptMatch | None:
+        if not settings.PROMPT_REUSE_ENABLED:
+            return None
         try:
-            # 0) PROMPT ENHANCEMENT
-            log(session, run.id, "enhance", "Enhancing prompt...")
-            enhance_model = self.router.enhance_model().model
-            enhanced_prompt = asyncio.run(llm_enhance_prompt(self.llm, enhance_model, prompt))
-            log(session, run.id, "enhance", f"Enhanced Prompt:\n{enhanced_prompt}")
-
-            # 1) PROMPT -> SPEC (LLM)
-            log(session, run.id, "spec", "Starting spec generation...")
-            spec_model = self.router.spec_model().model
-            spec = asyncio.run(llm_prompt_to_spec(self.llm, spec_model, enhanced_prompt))
+            return await asyncio.to_thread(prompt_index.query, text, kind, settings.PROMPT_WARM_THRESHOLD)
+        except Exception as e:
+            await alog(run_id, "enhance", f"Prompt index lookup failed: {e}", level="WARN")
+            return None
+
+    async def _preview_stopped(self, run_id: int, reason: str) -> None:
+        """A successful run whose app was reaped or evicted becomes "stopped": nothing serves it any more."""
+        def _mark() -> None:
+            with Session(engine) as session:
+                db_run = get_run(session, run_id)
+                if db_run is not None and db_run.status == "success":
+                    update_run_status(session, db_run, "stopped")
+
+        await alog(run_id, "preview", f"Preview stopped ({reason}); its port was released. Resume or modify the run to start it again.")
+        await flush_logs()
+        await asyncio.to_thread(_mark)
+
+    async def cancel_cleanup(self, run) -> None:
+        """
+        After a run's task was cancelled: LLM streams and pip/uvicorn start-ups were
+        torn down by the cancellation itself; stop the app it may have left running
+        (freeing the preview port) and mark the run cancelled.
+        """
+        await self.runner.release_preview(run.id)
+        await alog(run.id, "cancel", "Run cancelled; stopped its processes and released the preview port", level="WARN")
+        await self._set_status(run, "cancelled")
+
+    async def execute_run(self, run, prompt: str, host: str = "0.0.0.0"):
+        """
+        Runs the whole pipeline on the server's event loop: LLM calls, sandbox
+        subprocesses and DB writes are awaited, and blocking file work is pushed to
+        worker threads, so many runs can progress concurrently in one process.
+        """
+        await self._set_status(run, "running", attempts=run.attempts + 1)
+        ws: Path = project_workspace(run.project_id, run.id)
+        await alog(run.id, "workspace", f"Workspace: {ws}")
+
+        # Port leased from the preview pool; kept across repair attempts
+        port = await self.runner.lease_port(run.id)
+        if port is None:
+            await alog(run.id, "run", "No free preview port (all in use by running builds)", level="ERROR")
+            await self._set_status(run, "failed")
+            return
+        await alog(run.id, "run", f"Will start generated app on http://{host}:{port}")
+
+        # Stages form a DAG: venv setup (and the dependency install, as soon as the
+        # streamed requirements.txt lands) overlaps with the LLM stages, and the
+        # post-codegen bookkeeping runs side by side. Each node's timing is logged.
+        ckpt = RunCheckpoints(ws)
+        streamed = _StreamedFiles(ws)
+        backend_dir = ws / "generated_app" / "backend"
+        req_path = backend_dir / "requirements.txt"
+        # Past run with a near-duplicate prompt; its TaskSpec is reused or used as a warm start
+        similar: dict[str, PromptMatch] = {}
+
+        async def prepare() -> None:
+            saved_prompt = (ckpt.load("prompt") or {}).get("prompt")
+            if saved_prompt != prompt:
+                await asyncio.to_thread(ckpt.invalidate_from, "prompt")
+                await asyncio.to_thread(ckpt.save, "prompt", {"prompt": prompt})
+            elif ckpt.last_completed() != "prompt":
+                await alog(run.id, "resume", f"Resuming from checkpoints: {', '.join(ckpt.completed())}")
+
+        # 0) PROMPT ENHANCEMENT
+        async def enhance(prepare: None) -> str:
+            cached = ckpt.load("enhance")
+            if cached is not None:
+                enhanced_prompt = cached["enhanced_prompt"]
+                await alog(run.id, "enhance", "Enhanced prompt restored from checkpoint")
+            elif (match := await self._similar_run(run.id, prompt, "prompt")) and match.similarity >= settings.PROMPT_REUSE_THRESHOLD:
+                similar["match"] = match
+                enhanced_prompt = match.enhanced_prompt
+                await alog(run.id, "enhance", f"♻️ Prompt matches run {match.run_id} (similarity {match.similarity:.2f}); reusing its enhanced prompt and TaskSpec")
+                await asyncio.to_thread(ckpt.invalidate_from, "enhance")
+                await asyncio.to_thread(ckpt.save, "enhance", {"enhanced_prompt": enhanced_prompt})
+            else:
+                if match is not None:
+                    similar["match"] = match
+                await alog(run.id, "enhance", "Enhancing prompt...")
+                enhance_model = self.router.enhance_model().model
+                enhanced_prompt = await self._attributed(llm_enhance_prompt(self.llm, enhance_model, prompt), run.id, "enhance")
+                await asyncio.to_thread(ckpt.invalidate_from, "enhance")
+                await asyncio.to_thread(ckpt.save, "enhance", {"enhanced_prompt": enhanced_prompt})
+            await alog(run.id, "enhance", f"Enhanced Prompt:\n{enhanced_prompt}")
+            return enhanced_prompt
+
+        # 1) PROMPT -> SPEC (LLM)
+        async def spec(enhance: str) -> TaskSpec:
+            cached = ckpt.load("spec")
+            if cached is not None:
+                task_spec = TaskSpec.model_validate(cached)
+                await alog(run.id, "spec", "TaskSpec restored from checkpoint")
+            else:
+                match = similar.get("match")
+                if match is None or match.similarity < settings.PROMPT_REUSE_THRESHOLD:
+                    by_enhanced = await self._similar_run(run.id, enhance, "enhanced")
+                    if by_enhanced is not None and (match is None or by_enhanced.similarity > match.similarity):
+                        match = similar["match"] = by_enhanced
+                if match is not None and match.similarity >= settings.PROMPT_REUSE_THRESHOLD:
+                    task_spec = TaskSpec.model_validate(match.spec)
+                    similar["reused"] = match
+                    await alog(run.id, "spec", f"♻️ Reusing TaskSpec of run {match.run_id} ({match.kind} similarity {match.similarity:.2f})")
+                else:
+                    reference = TaskSpec.model_validate(match.spec) if match is not None else None
+                    if reference is not None:
+                        await alog(run.id, "spec", f"Warm start from the TaskSpec of run {match.run_id} ({match.kind} similarity {match.similarity:.2f})")
+                    await alog(run.id, "spec", "Starting spec generation...")
+                    spec_model = self.router.spec_model().model
+                    task_spec = await self._attributed(
+                        llm_prompt_to_spec(self.llm, spec_model, enhance, reference=reference), run.id, "spec"
+                    )
+                await asyncio.to_thread(ckpt.invalidate_from, "spec")
+                await asyncio.to_thread(ckpt.save, "spec", task_spec.model_dump())
             import json as _json
-            log(session, run.id, "spec", f"TaskSpec Generated:\n{_json.dumps(spec.model_dump(), indent=2)}")
+            await alog(run.id, "spec", f"TaskSpec Generated:\n{_json.dumps(task_spec.model_dump(), indent=2)}")
+            return task_spec
+
+        # 2) SPEC -> CODE FILES (LLM - Full Generation)
+        async def codegen(spec: TaskSpec) -> GenOutput:
+            try:
+                gen = None
+                cached = ckpt.load("gen_output")
+                if cached is not None:
+                    gen = GenOutput.model_validate(cached)
+                    await alog(run.id, "codegen", "Generated code restored from checkpoint")
+                elif ckpt.has("codegen_raw"):
+                    # Model finished but the run died before (or while) parsing
+                    try:
+                        gen = parse_gen_output(ckpt.load("codegen_raw")["raw"])
+                        await alog(run.id, "codegen", "Generated code re-parsed from raw checkpoint")
+                    except (ValueError, TypeError, KeyError):
+                        gen = None
+                if gen is None:
+                    await alog(run.id, "codegen", "Starting code generation...")
+                    code_model = self.router.code_model().model
+                    await asyncio.to_thread(ckpt.invalidate_from, "codegen_raw")
+
+                    async def save_raw(raw: str) -> None:
+                        await asyncio.to_thread(ckpt.save, "codegen_raw", {"raw": raw})
+
+                    samples = settings.CODEGEN_SAMPLES
+                    if samples > 1:
+                        await alog(run.id, "codegen", f"Sampling {samples} candidates in parallel; first clean one wins")
+                    gen = await self._attributed(
+                        llm_spec_to_code(
+                            self.llm,
+                            code_model,
+                            spec,
+                            on_file=streamed,
+                            on_raw=save_raw,
+                            samples=samples,
+                            check=_codegen_problems,
+                            temperatures=settings.CODEGEN_SAMPLE_TEMPERATURES or (0.2,),
+                            on_log=lambda msg: alog(run.id, "codegen", msg),
+                        ),
+                        run.id,
+                        "codegen",
+                    )
+                    if streamed.written:
+                        await alog(run.id, "codegen", f"⚡ {len(streamed.written)} files written and checked while streaming")
+            finally:
+                streamed.close()
+            if not ckpt.has("gen_output"):
+                await asyncio.to_thread(ckpt.save, "gen_output", gen.model_dump())
 
-            # 2) SPEC -> CODE FILES (LLM - Full Generation)
-            log(session, run.id, "codegen", "Starting code generation...")
-            code_model = self.router.code_model().model
-            gen = asyncio.run(llm_spec_to_code(self.llm, code_model, spec))
-            
             # Informative LLM phase logging mimicking local script
             plan_preview = gen.plan[:120] + "..." if len(gen.plan) > 120 else gen.plan
-            log(session, run.id, "codegen", f"📋 Plan: {plan_preview}")
-            log(session, run.id, "codegen", f"📄 Manifest: {len(gen.manifest)} entries generated")
-            log(session, run.id, "codegen", f"📁 Files: {len(gen.files)} required pieces of code")
-
-            # 2.6) VALIDATION (NEW STAGE)
-            log(session, run.id, "validate", "Validating generated files...")
-            validation_warnings = validate_generated_files([{"path": f.path, "content": f.content} for f in gen.files])
+            await alog(run.id, "codegen", f"📋 Plan: {plan_preview}")
+            await alog(run.id, "codegen", f"📄 Manifest: {len(gen.manifest)} entries generated")
+            await alog(run.id, "codegen", f"📁 Files: {len(gen.files)} required pieces of code")
+            return gen
+
+        # 2.6) VALIDATION (NEW STAGE)
+        async def validate(codegen: GenOutput) -> list[str]:
+            await alog(run.id, "validate", "Validating generated files...")
+            # Files already checked during streaming reuse those results
+            validation_warnings = []
+            unchecked = []
+            for f in codegen.files:
+                if streamed.written.get(f.path) == f.content:
+                    validation_warnings.extend(streamed.warnings.get(f.path, []))
+                else:
+                    unchecked.append({"path": f.path, "content": f.content})
+            validation_warnings.extend(await asyncio.to_thread(validate_generated_files, unchecked))
             if validation_warnings:
                 for warning in validation_warnings:
-                    log(session, run.id, "validate", f"⚠️ {warning}", level="WARN")
-                log(session, run.id, "validate", f"Found {len(validation_warnings)} quality issues (non-blocking)")
+                    await alog(run.id, "validate", f"⚠️ {warning}", level="WARN")
+                await alog(run.id, "validate", f"Found {len(validation_warnings)} quality issues (non-blocking)")
             else:
-                log(session, run.id, "validate", "✅ All validation checks passed")
+                await alog(run.id, "validate", "✅ All validation checks passed")
+            return validation_warnings
 
+        async def write(codegen: GenOutput) -> list[dict]:
             # Fix truncated main.py / missing FileResponse routes before write
-            post_out = post_process_output(gen)
+            post_out = post_process_output(codegen)
             final_files = [{"path": f.path, "content": f.content} for f in post_out.files]
-            
-            # Write generated files
-            write_files(ws, final_files)
-            
+
+            if (ws / "generated_app").is_dir() and await asyncio.to_thread(ckpt.patched_since, "gen_output"):
+                # Resumed after repairs/modifications: the workspace is newer than the checkpoint
+                await alog(run.id, "resume", "Keeping generated_app/ as patched; not rewriting it from the gen_output checkpoint")
+                return final_files
+
+            # Write generated files (skip ones already on disk from the stream, unchanged by post-processing)
+            await asyncio.to_thread(write_files, ws, [f for f in final_files if streamed.written.get(f["path"]) != f["content"]])
+            final_paths = {f["path"] for f in final_files}
+            for stale in set(streamed.written) - final_paths:
+                (ws / stale).unlink(missing_ok=True)
+
             # Show extracted files iteratively
-            log(session, run.id, "codegen", f"📂 Writing to output directory...")
+            await alog(run.id, "codegen", f"📂 Writing to output directory...")
             for f in final_files:
-                log(session, run.id, "codegen", f"  ✅ Extracted: {f['path']} ({len(f['content'])} chars)")
-                
-            # Write run.sh launch script
+                await alog(run.id, "codegen", f"  ✅ Extracted: {f['path']} ({len(f['content'])} chars)")
+            return final_files
+
+        # Write run.sh launch script (static, so it doesn't wait for codegen)
+        async def run_script() -> None:
             run_script_path = ws / "generated_app" / "run.sh"
             run_script_content = (
                 "#!/bin/bash\n"
@@ -227,166 +495,218 @@ class Orchestrator:
                 "echo '🚀 Starting app...'\n"
                 "uvicorn main:app --reload --host 0.0.0.0 --port 8000\n"
             )
-            run_script_path.write_text(run_script_content, encoding="utf-8")
+            run_script_path.parent.mkdir(parents=True, exist_ok=True)
+            await asyncio.to_thread(run_script_path.write_text, run_script_content, encoding="utf-8")
             try:
                 run_script_path.chmod(0o755)
             except:
                 pass # Unix style permissions might raise NotImplementedError on some Windows configs
-            log(session, run.id, "codegen", "  ✅ Extracted: run.sh (auto-generated launch script)")
-            log(session, run.id, "codegen", f"─── Summary ───\n✅ Created: {len(final_files)} primary files + launch script")
-
-            backend_dir = ws / "generated_app" / "backend"
-            req_path = backend_dir / "requirements.txt"
 
-            # 3) VENV SETUP
-            log(session, run.id, "sandbox", "Setting up virtual environment...")
-            self.runner.setup(ws)
-            log(session, run.id, "sandbox", "Venv sandbox created")
+        # 3) VENV SETUP
+        async def venv() -> None:
+            await alog(run.id, "sandbox", "Setting up virtual environment...")
+            async with timed(run.id, "venv_create"):
+                await self.runner.setup(ws)
+            await alog(run.id, "sandbox", "Venv sandbox created")
+
+        # 3.5) EARLY DEPENDENCY INSTALL, from requirements.txt as soon as it is streamed
+        async def prefetch_deps(venv: None) -> tuple[str, ExecResult] | None:
+            requirements = await streamed.first("backend/requirements.txt")
+            if not requirements or not requirements.strip():
+                return None
+            await alog(run.id, "deps", "Installing dependencies while code generation continues...")
+            async with timed(run.id, "pip_install", detail="during codegen"):
+                return requirements, await self.runner.install_deps(ws, req_path)
+
+        # 4) RUN + REPAIR LOOP (Includes Dependency Install)
+        async def run_app(
+            enhance: str,
+            spec: TaskSpec,
+            write: list[dict],
+            run_script: None,
+            validate: list[str],
+            prefetch_deps: tuple[str, ExecResult] | None,
+        ) -> None:
+            await alog(run.id, "codegen", "  ✅ Extracted: run.sh (auto-generated launch script)")
+            await alog(run.id, "codegen", f"─── Summary ───\n✅ Created: {len(write)} primary files + launch script")
+
+            hashes = FileHashes(ws)
+            await asyncio.to_thread(hashes.commit)
 
-            # 4) RUN + REPAIR LOOP (Includes Dependency Install)
             attempts = 0
+            # Cached fixes don't use up LLM repair attempts; each signature gets one try
+            cached_fixes = 0
+            tried_signatures: set[str] = set()
+            pending_fix = None
             while True:
                 attempts += 1
-                if attempts > settings.MAX_REPAIR_ATTEMPTS:
-                    update_run_status(session, run, "failed")
-                    log(session, run.id, "repair", "Max repair attempts reached", level="ERROR")
+                if attempts - cached_fixes > settings.MAX_REPAIR_ATTEMPTS:
+                    await self._set_status(run, "failed")
+                    await alog(run.id, "repair", "Max repair attempts reached", level="ERROR")
                     return
 
-                # A. Install Dependencies
-                log(session, run.id, "deps", f"Installing dependencies (Attempt {attempts})...")
-                install_res = self.runner.install_deps(ws, req_path)
+                # A. Install Dependencies (reusing the early install if requirements didn't change since)
+                current_reqs = req_path.read_text(encoding="utf-8") if req_path.exists() else ""
+                if attempts == 1 and prefetch_deps is not None and prefetch_deps[0] == current_reqs:
+                    install_res = prefetch_deps[1]
+                    await alog(run.id, "deps", "Dependencies were installed during code generation")
+                else:
+                    await alog(run.id, "deps", f"Installing dependencies (Attempt {attempts})...")
+                    async with timed(run.id, "pip_install", detail=f"attempt {attempts}"):
+                        install_res = await self.runner.install_deps(ws, req_path)
                 
                 if install_res.exit_code != 0:
                     # Installation Failed -> Repair
                     err = (install_res.stderr or "").strip()
                     out = (install_res.stdout or "").strip()
-                    log(session, run.id, "deps", out if out else "No stdout")
-                    log(session, run.id, "deps", err if err else "Unknown install error", level="ERROR")
+                    await alog(run.id, "deps", out if out else "No stdout")
+                    await alog(run.id, "deps", err if err else "Unknown install error", level="ERROR")
                     
-                    log(session, run.id, "repair", "Dependency install failed, attempting repair...")
+                    await alog(run.id, "repair", "Dependency install failed, attempting repair...")
                     # Fall through to repair logic below
                     error_text = f"Dependency Installation Failed:\n{err}\nOutput:\n{out}"
                     # Skip execution, go straight to repair
                 else:
                     if install_res.stdout:
-                        log(session, run.id, "deps", install_res.stdout.strip())
+                        await alog(run.id, "deps", install_res.stdout.strip())
 
                     # B. Run Uvicorn
-                    log(session, run.id, "run", f"Starting uvicorn attempt {attempts}")
+                    await alog(run.id, "run", f"Starting uvicorn attempt {attempts}")
 
                     # Sanity Check: Syntax
-                    syntax_err = self.runner.check_syntax(ws)
+                    async with timed(run.id, "syntax_check", detail=f"attempt {attempts}"):
+                        syntax_err = await self.runner.check_syntax(ws)
                     if syntax_err:
-                        log(session, run.id, "run", "Syntax check failed, skipping run", level="ERROR")
+                        await alog(run.id, "run", "Syntax check failed, skipping run", level="ERROR")
                         error_text = f"Syntax Error:\n{syntax_err}"
                     else:
-                        run_res = self.runner.run_uvicorn(ws, backend_dir, host=host, port=port, run_id=run.id)
+                        async with timed(run.id, "uvicorn_ready", detail=f"attempt {attempts}"):
+                            run_res = await self.runner.run_uvicorn(ws, backend_dir, host=host, port=port, run_id=run.id)
 
                         if run_res.exit_code == 0:
-                            update_run_status(session, run, "success")
-                            log(session, run.id, "done", "Generated app ran successfully")
+                            await self._settle_fix(run.id, ws, pending_fix, succeeded=True)
+                            if settings.PROMPT_REUSE_ENABLED and "reused" not in similar:
+                                # A spec that produced a working app becomes reusable for similar prompts
+                                try:
+                                    await asyncio.to_thread(prompt_index.add, run.id, prompt, enhance, spec.model_dump())
+                                except Exception as e:
+                                    await alog(run.id, "spec", f"Could not index prompt: {e}", level="WARN")
+                            await self._set_status(run, "success")
+                            await alog(run.id, "done", "Generated app ran successfully")
                             return
 
                         # Failed
                         err = (run_res.stderr or "").strip()
                         out = (run_res.stdout or "").strip()
-                        log(session, run.id, "run", out if out else "No stdout")
-                        log(session, run.id, "run", err if err else "No stderr", level="ERROR")
+                        await alog(run.id, "run", out if out else "No stdout")
+                        await alog(run.id, "run", err if err else "No stderr", level="ERROR")
                         error_text = f"Runtime Error:\n{err}\nOutput:\n{out}"
 
-                # C. Repair (LLM) -> PATCH -> APPLY
+                # C. Known error signature? Apply the cached fix instead of asking the LLM
+                sig = error_signature(error_text)
+                await self._settle_fix(run.id, ws, pending_fix, succeeded=False)
+                pending_fix = None
+                if sig is not None and sig.key not in tried_signatures:
+                    tried_signatures.add(sig.key)
+                    try:
+                        applied = await asyncio.to_thread(apply_cached_fix, ws, sig)
+                    except Exception as e:
+                        applied = None
+                        await alog(run.id, "repair", f"Fix cache lookup failed: {e}", level="WARN")
+                    if applied is not None:
+                        cached_fixes += 1
+                        pending_fix = (sig, applied, None)
+                        await alog(run.id, "repair", f"♻️ Known error ({sig}); applied cached fix [{applied.description}], skipping LLM repair")
+                        continue
+
+                # D. Repair (LLM) -> PATCH -> APPLY
+                repair_started = time.time()
                 repair_model = self.router.repair_model().model
-                context = _context_snippets(ws, error_text=error_text)
+                context = await asyncio.to_thread(pack_context, ws, settings.REPAIR_CONTEXT_TOKENS, error_text=error_text)
+                await alog(run.id, "repair", f"Packed repair context (~{estimate_tokens(context)} tokens)")
                 
                 # Check if we should abort if context is empty or error invalid? 
                 # (Assuming llm_repair handles general queries)
                 
-                log(session, run.id, "repair", "Generating repair patch...")
-                patch = asyncio.run(llm_repair(self.llm, repair_model, error_text=error_text, context=context))
+                await alog(run.id, "repair", "Generating repair patch...")
+                patch = await self._attributed(llm_repair(self.llm, repair_model, error_text=error_text, context=context), run.id, "repair")
 
-                log(session, run.id, "repair", "Applying patch from repair LLM")
-                apply_unified_patch(ws, patch)
-                log(session, run.id, "repair", "Patch applied, retrying run...")
+                await asyncio.to_thread(ckpt.save_patch, "repair", patch)
+                await alog(run.id, "repair", "Applying patch from repair LLM")
+                before = await asyncio.to_thread(fix_snapshot, ws) if sig is not None else None
+                await asyncio.to_thread(apply_unified_patch, ws, patch)
+                await alog(run.id, "repair", "Patch applied, retrying run...")
 
                 # --- NEW HARDENING BLOCK --- #
+                # Only files the patch actually changed are hardened and validated
                 try:
-                    log(session, run.id, "repair", "Running hardening logic on patched files...")
-                    
-                    files_to_harden = []
-                    generated_app_dir = ws / "generated_app"
-                    
-                    # Check main.py
-                    main_py_path = generated_app_dir / "backend" / "main.py"
-                    if main_py_path.exists():
-                        files_to_harden.append(GenFile(path="backend/main.py", content=main_py_path.read_text(encoding="utf-8")))
-                    
-                    # Check requirements.txt
-                    req_txt_path = generated_app_dir / "backend" / "requirements.txt"
-                    if req_txt_path.exists():
-                        files_to_harden.append(GenFile(path="backend/requirements.txt", content=req_txt_path.read_text(encoding="utf-8")))
-
-                    # Check app.js
-                    app_js_path = generated_app_dir / "frontend" / "app.js"
-                    if app_js_path.exists():
-                        files_to_harden.append(GenFile(path="frontend/app.js", content=app_js_path.read_text(encoding="utf-8")))
-
-                    # Check main.css
-                    main_css_path = generated_app_dir / "frontend" / "main.css"
-                    if main_css_path.exists():
-                        files_to_harden.append(GenFile(path="frontend/main.css", content=main_css_path.read_text(encoding="utf-8")))
-
-                    if files_to_harden:
-                        dummy_output = GenOutput(files=files_to_harden)
-                        processed = post_process_output(dummy_output)
-                        
-                        for f in processed.files:
-                            # We assume path is relative to generated_app
-                            # Note: f.path might be absolute if post_process modifies it incorrectly, 
-                            # but GenFile paths are typically relative as created above.
-                            # However, post_process checks endsswith, so it's safe.
-                            
-                            # Handle potential path separators
-                            clean_path = f.path.replace("\\", "/")
-                            full_path = generated_app_dir / clean_path
-                            
-                            full_path.parent.mkdir(parents=True, exist_ok=True)
-                            full_path.write_text(f.content, encoding="utf-8")
-                            
-                        log(session, run.id, "repair", "Hardening complete: Files validated and potential errors fixed.")
+                    changed = await asyncio.to_thread(hashes.changed)
+                    await alog(run.id, "repair", f"Patch changed {len(changed)} file(s): {', '.join(sorted(changed)) or 'none'}")
+                    rewritten = await asyncio.to_thread(_harden_patched_files, ws, changed)
+                    if rewritten:
+                        await alog(run.id, "repair", f"Hardening fixed: {', '.join(rewritten)}")
+                    for warning in await asyncio.to_thread(_validate_changed, ws, changed):
+                        await alog(run.id, "validate", f"⚠️ {warning}", level="WARN")
                 except Exception as e:
-                     log(session, run.id, "repair", f"Hardening warning: {e}", level="WARN")
+                     await alog(run.id, "repair", f"Hardening warning: {e}", level="WARN")
+                await asyncio.to_thread(hashes.commit)
+                record_timing(run.id, "repair_attempt", time.time() - repair_started, started=repair_started, detail=f"attempt {attempts}")
+                if sig is not None:
+                    pending_fix = (sig, None, before)
+
+        async def log_timing(t: NodeTiming) -> None:
+            record_timing(run.id, t.name, t.duration_s, kind="stage", status=t.status, started=t.started)
+            await alog(run.id, "timing", f"⏱ {t.name}: {t.status} in {t.duration_s:.2f}s (started at +{t.waited_s:.2f}s)")
+
+        dag = DAG(on_node_done=log_timing)
+        dag.add("prepare", prepare)
+        dag.add("enhance", enhance, deps=("prepare",))
+        dag.add("spec", spec, deps=("enhance",))
+        dag.add("codegen", codegen, deps=("spec",))
+        dag.add("validate", validate, deps=("codegen",))
+        dag.add("write", write, deps=("codegen",))
+        dag.add("run_script", run_script)
+        dag.add("venv", venv)
+        dag.add("prefetch_deps", prefetch_deps, deps=("venv",))
+        dag.add("run_app", run_app, deps=("enhance", "spec", "write", "run_script", "validate", "prefetch_deps"))
 
+        try:
+            await dag.run()
         except Exception as e:
-            log(session, run.id, "fatal", f"{type(e).__name__}: {e}", level="ERROR")
-            update_run_status(session, run, "failed")
+            await alog(run.id, "fatal", f"{type(e).__name__}: {e}", level="ERROR")
+            await self._set_status(run, "failed")
+        if run.status != "success":
+            await self.runner.release_preview(run.id)
 
-    def execute_modification(self, session: Session, run, user_request: str, host: str = "0.0.0.0"):
+    async def execute_modification(self, run, user_request: str, host: str = "0.0.0.0"):
         """
         Applies a manual code modification requested by the user.
         """
         from app.services.modifier import llm_modify, llm_modify_json_only
         
-        update_run_status(session, run, "running")
+        await self._set_status(run, "running")
         ws: Path = project_workspace(run.project_id, run.id)
-        log(session, run.id, "modify", f"Processing change request: {user_request}")
+        ckpt = RunCheckpoints(ws)
+        await alog(run.id, "modify", f"Processing change request: {user_request}")
+        started = time.time()
 
         try:
             # 1) Gather context (All key files)
-            log(session, run.id, "modify", "Gathering codebase context...")
-            context = _context_snippets(ws) # Fallback to candidates if no errors
+            await alog(run.id, "modify", "Gathering codebase context...")
+            context = await asyncio.to_thread(pack_context, ws, settings.MODIFY_CONTEXT_TOKENS, request_text=user_request)
             
             # 2) Call Modifier LLM (retry once if patch cannot be parsed)
             modify_model = self.router.code_model().model # Use code model for modification
-            log(session, run.id, "modify", "Consulting LLM for changes...")
-            patch = asyncio.run(llm_modify(self.llm, modify_model, user_request, context))
+            await alog(run.id, "modify", "Consulting LLM for changes...")
+            patch = await self._attributed(llm_modify(self.llm, modify_model, user_request, context), run.id, "modify")
+            await asyncio.to_thread(ckpt.save_patch, "modify", patch)
 
             # 3) Apply Patch
-            log(session, run.id, "modify", "Applying changes to codebase...")
+            await alog(run.id, "modify", "Applying changes to codebase...")
             try:
-                apply_unified_patch(ws, patch)
+                await asyncio.to_thread(apply_unified_patch, ws, patch)
             except ValueError as parse_err:
-                log(
-                    session,
+                await alog(
                     run.id,
                     "modify",
                     f"First modify output was not parseable ({parse_err}). Retrying with stricter format...",
@@ -398,47 +718,67 @@ class Orchestrator:
                     + '(1) Patch: lines *** Begin Patch then *** Update File: generated_app/... then +++ REPLACE ENTIRE FILE +++ then full file then *** End Patch;\n'
                     + 'OR (2) One JSON object: {"files":[{"path":"generated_app/frontend/foo.html","content":"..."}]} with valid JSON strings (escape quotes and newlines). No other text.'
                 )
-                patch = asyncio.run(llm_modify(self.llm, modify_model, retry_prompt, context))
+                patch = await self._attributed(llm_modify(self.llm, modify_model, retry_prompt, context), run.id, "modify")
+                await asyncio.to_thread(ckpt.save_patch, "modify", patch)
                 try:
-                    apply_unified_patch(ws, patch)
+                    await asyncio.to_thread(apply_unified_patch, ws, patch)
                 except ValueError as e2:
-                    log(
-                        session,
+                    await alog(
                         run.id,
                         "modify",
                         f"Second modify output was not parseable ({e2}). JSON-only modify attempt...",
                         level="WARN",
                     )
-                    patch = asyncio.run(
-                        llm_modify_json_only(self.llm, modify_model, user_request, context)
+                    patch = await self._attributed(
+                        llm_modify_json_only(self.llm, modify_model, user_request, context),
+                        run.id,
+                        "modify",
                     )
-                    apply_unified_patch(ws, patch)
-            log(session, run.id, "modify", "Changes applied successfully.")
-            if repair_main_routes_on_disk(ws):
-                log(session, run.id, "modify", "Repaired missing FastAPI routes in main.py for all HTML pages.")
+                    await asyncio.to_thread(ckpt.save_patch, "modify", patch)
+                    await asyncio.to_thread(apply_unified_patch, ws, patch)
+            await alog(run.id, "modify", "Changes applied successfully.")
+            if await asyncio.to_thread(repair_main_routes_on_disk, ws):
+                await alog(run.id, "modify", "Repaired missing FastAPI routes in main.py for all HTML pages.")
 
             # 4) Verify (Run the app again)
-            log(session, run.id, "modify", "Verifying changes by restarting app...")
+            await alog(run.id, "modify", "Verifying changes by restarting app...")
             # We reuse the repair loop logic or just call a simplified version
             # For simplicity, we just trigger a verify run
-            port = settings.PREVIEW_PORT_BASE + run.id
+            port = await self.runner.lease_port(run.id)
+            if port is None:
+                await alog(run.id, "modify", "No free preview port (all in use by running builds)", level="ERROR")
+                await self._set_status(run, "failed")
+                return
             backend_dir = ws / "generated_app" / "backend"
             
-            # Check syntax
-            syntax_err = self.runner.check_syntax(ws)
+            # Check syntax (files the modification didn't touch passed already)
+            async with timed(run.id, "syntax_check", detail="after modify"):
+                syntax_err = await self.runner.check_syntax(ws)
             if syntax_err:
-                log(session, run.id, "modify", f"Syntax error after modification: {syntax_err}", level="ERROR")
-                update_run_status(session, run, "failed")
+                await alog(run.id, "modify", f"Syntax error after modification: {syntax_err}", level="ERROR")
+                await self._set_status(run, "failed")
                 return
 
-            run_res = self.runner.run_uvicorn(ws, backend_dir, host=host, port=port, run_id=run.id)
+            async with timed(run.id, "uvicorn_ready", detail="after modify"):
+                run_res = await self.runner.run_uvicorn(ws, backend_dir, host=host, port=port, run_id=run.id)
             if run_res.exit_code == 0:
-                update_run_status(session, run, "success")
-                log(session, run.id, "done", "Modification applied and app is running.")
+                await self._set_status(run, "success")
+                await alog(run.id, "done", "Modification applied and app is running.")
             else:
-                log(session, run.id, "modify", "App failed to start after modification. Entering repair mode...", level="WARN")
-                update_run_status(session, run, "failed")
+                await alog(run.id, "modify", "App failed to start after modification. Entering repair mode...", level="WARN")
+                await self._set_status(run, "failed")
         
         except Exception as e:
-            log(session, run.id, "fatal", f"Modification failed: {str(e)}", level="ERROR")
-            update_run_status(session, run, "failed")
+            await alog(run.id, "fatal", f"Modification failed: {str(e)}", level="ERROR")
+            await self._set_status(run, "failed")
+        finally:
+            if run.status != "success":
+                await self.runner.release_preview(run.id)
+            record_timing(
+                run.id,
+                "modify",
+                time.time() - started,
+                kind="stage",
+                status="ok" if run.status == "success" else "failed",
+                started=started,
+            )
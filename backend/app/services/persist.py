@@ -0,0 +1,36 @@
+from __future__ import annotations
+import asyncio
+from typing import Any, Callable
+from sqlmodel import Session
+from app.db.database import engine
+
+_pending: set[asyncio.Task] = set()
+
+
+def _persist(fn: Callable[..., Any], fields: dict[str, Any], what: str) -> None:
+    try:
+        with Session(engine) as session:
+            fn(session, **fields)
+    except Exception as e:
+        # Instrumentation must never fail a run
+        print(f"[WARN] could not record {what}: {e}", flush=True)
+
+
+def spawn_persist(fn: Callable[..., Any], fields: dict[str, Any], what: str) -> None:
+    """
+    Write one instrumentation row with fn(session, **fields) off the event loop
+    (inline when there is no running loop). Errors are logged, not raised.
+    """
+    try:
+        task = asyncio.get_running_loop().create_task(asyncio.to_thread(_persist, fn, fields, what))
+    except RuntimeError:
+        _persist(fn, fields, what)
+        return
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def flush() -> None:
+    """Wait for queued writes (called on shutdown)."""
+    if _pending:
+        await asyncio.gather(*list(_pending), return_exceptions=True)
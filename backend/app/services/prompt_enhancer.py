@@ -21,6 +21,11 @@ Output: Build a library portal where students can search books, issue books, and
 """
 
 
+def is_valid_enhancement(text: str) -> bool:
+    """One non-empty sentence-like line, as SYSTEM_PROMPT_ENHANCE asks for; worth caching."""
+    text = text.strip()
+    return bool(text) and "\n\n" not in text and not text.startswith(("{", "[", "#", "-", "*"))
+
 async def llm_enhance_prompt(llm: LLMClient, model: str, user_prompt: str) -> str:
     """
     Enriches the user's short prompt into a detailed description,
@@ -29,7 +34,8 @@ async def llm_enhance_prompt(llm: LLMClient, model: str, user_prompt: str) -> st
     enriched = await llm.chat(
         model=model,
         system=SYSTEM_PROMPT_ENHANCE,
-        user=user_prompt
+        user=user_prompt,
+        validate=is_valid_enhancement,
     )
     enriched = enriched.strip()
 
@@ -0,0 +1,177 @@
+from __future__ import annotations
+import hashlib
+import json
+import random
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any
+from sqlmodel import Session
+from app.db.database import engine
+from app.db import repo
+
+# 128 MinHash values split into 32 LSH bands of 4 rows: prompts with Jaccard
+# similarity around 0.4 and up share a band with high probability.
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+KINDS = ("prompt", "enhanced")
+# add() skips a run whose prompts are at least this similar to an entry with the same spec
+DUPLICATE_SIMILARITY = 0.9
+_WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "app", "application", "build", "create", "for", "i", "in", "is", "it",
+    "make", "me", "my", "of", "on", "please", "site", "that", "the", "to", "want", "we",
+    "web", "website", "with",
+}
+
+
+def tokens(text: str, kind: str = "prompt") -> set[str]:
+    """
+    Shingles for MinHash: content words (crudely singularized) for short user prompts;
+    enhanced prompts are long enough that word bigrams help separate them.
+    """
+    words = []
+    for w in _WORD.findall(text.lower()):
+        if len(w) > 3 and w.endswith("s") and not w.endswith("ss"):
+            w = w[:-1]
+        if w not in STOPWORDS:
+            words.append(w)
+    out = set(words)
+    if kind == "enhanced":
+        out.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return out
+
+
+def _hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash(shingles: set[str]) -> list[int] | None:
+    if not shingles:
+        return None
+    hashes = [_hash(s) for s in shingles]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+
+def similarity(a: list[int], b: list[int]) -> float:
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def _bands(sig: list[int]) -> list[tuple[int, ...]]:
+    return [(i,) + tuple(sig[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS)]
+
+
+@dataclass
+class PromptMatch:
+    entry_id: int
+    run_id: int
+    kind: str  # which text matched: prompt | enhanced
+    similarity: float
+    prompt: str
+    enhanced_prompt: str
+    spec: dict[str, Any]
+
+
+class PromptIndex:
+    """
+    MinHash/LSH index over the prompts of past successful runs, with their enhanced
+    prompt and TaskSpec. Signatures live in the PromptIndexEntry table; this process
+    keeps the LSH buckets in memory and pulls in newer rows (from any process) before
+    each lookup, so the index is never rebuilt from scratch.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._sigs: dict[str, dict[int, list[int]]] = {k: {} for k in KINDS}
+        self._buckets: dict[str, dict[tuple[int, ...], set[int]]] = {k: {} for k in KINDS}
+
+    def _insert(self, kind: str, entry_id: int, sig: list[int]) -> None:
+        self._sigs[kind][entry_id] = sig
+        for band in _bands(sig):
+            self._buckets[kind].setdefault(band, set()).add(entry_id)
+
+    def _sync(self, session: Session) -> None:
+        for entry in repo.list_prompt_entries(session, after_id=self._last_id):
+            self._insert("prompt", entry.id, json.loads(entry.prompt_minhash))
+            self._insert("enhanced", entry.id, json.loads(entry.enhanced_minhash))
+            self._last_id = entry.id
+
+    def query(self, text: str, kind: str, threshold: float) -> PromptMatch | None:
+        """Most similar indexed run whose prompt (or enhanced prompt) is at least threshold similar."""
+        sig = minhash(tokens(text, kind))
+        if sig is None:
+            return None
+        with Session(engine) as session, self._lock:
+            self._sync(session)
+            candidates: set[int] = set()
+            for band in _bands(sig):
+                candidates |= self._buckets[kind].get(band, set())
+            best_id, best = None, 0.0
+            for entry_id in candidates:
+                score = similarity(sig, self._sigs[kind][entry_id])
+                # Ties go to the newest entry
+                if best_id is None or score > best or (score == best and entry_id > best_id):
+                    best_id, best = entry_id, score
+            if best_id is None or best < threshold:
+                return None
+            entry = repo.get_prompt_entry(session, best_id)
+        if entry is None:
+            return None
+        return PromptMatch(
+            entry_id=entry.id,
+            run_id=entry.run_id,
+            kind=kind,
+            similarity=best,
+            prompt=entry.prompt,
+            enhanced_prompt=entry.enhanced_prompt,
+            spec=json.loads(entry.spec),
+        )
+
+    def _duplicate(self, session: Session, prompt_sig: list[int], enhanced_sig: list[int], spec: dict[str, Any]) -> bool:
+        candidates: set[int] = set()
+        for band in _bands(prompt_sig):
+            candidates |= self._buckets["prompt"].get(band, set())
+        for entry_id in candidates:
+            if similarity(prompt_sig, self._sigs["prompt"][entry_id]) < DUPLICATE_SIMILARITY:
+                continue
+            if similarity(enhanced_sig, self._sigs["enhanced"][entry_id]) < DUPLICATE_SIMILARITY:
+                continue
+            entry = repo.get_prompt_entry(session, entry_id)
+            if entry is not None and json.loads(entry.spec) == spec:
+                return True
+        return False
+
+    def add(self, run_id: int, prompt: str, enhanced_prompt: str, spec: dict[str, Any]) -> bool:
+        """
+        Index a successful run. Returns False if there is nothing to index, or if an
+        entry with the same spec and (near-)identical prompts is already there.
+        """
+        prompt_sig = minhash(tokens(prompt, "prompt"))
+        enhanced_sig = minhash(tokens(enhanced_prompt, "enhanced"))
+        if prompt_sig is None or enhanced_sig is None:
+            return False
+        spec_json = json.dumps(spec, ensure_ascii=False)
+        with Session(engine) as session, self._lock:
+            self._sync(session)
+            if self._duplicate(session, prompt_sig, enhanced_sig, json.loads(spec_json)):
+                return False
+            repo.add_prompt_entry(
+                session,
+                run_id=run_id,
+                prompt=prompt,
+                enhanced_prompt=enhanced_prompt,
+                spec=spec_json,
+                prompt_minhash=json.dumps(prompt_sig),
+                enhanced_minhash=json.dumps(enhanced_sig),
+            )
+            self._sync(session)
+        return True
+
+
+prompt_index = PromptIndex()
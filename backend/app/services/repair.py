@@ -11,6 +11,16 @@ Rules:
 3. Then output the NEW CONTENT of the file (complete file), prefixed with: +++ REPLACE ENTIRE FILE +++
 4. End output with: *** End Patch
 
+Files shown as "--- EXCERPT: PATH ..." are incomplete. If you need to change one, do NOT use
+the format above; reply instead with a unified diff for every file you change:
+--- a/PATH
++++ b/PATH
+@@ -START,COUNT +START,COUNT @@
+ unchanged context line
+-removed line
++added line
+Take START from the "[lines A-B]" markers and copy context lines exactly from the excerpt.
+
 HINTS:
 - If the error is "NameError" or "ImportError", check your imports!
 - 'HTMLResponse' is in 'fastapi.responses' (NOT fastapi).
@@ -29,4 +39,6 @@ from fastapi import FastAPI
 
 async def llm_repair(llm: LLMClient, model: str, error_text: str, context: str) -> str:
     user = f"ERROR:\n{error_text}\n\nCONTEXT:\n{context}\n\nReturn the repair patch in the specified [*** Begin Patch] format."
-    return await llm.chat(model=model, system=SYSTEM_REPAIR, user=user)
+    # Never serve repairs from the response cache: a replayed patch that did not fix
+    # the error last time would just burn another attempt.
+    return await llm.chat(model=model, system=SYSTEM_REPAIR, user=user, cache=False)
@@ -1,12 +1,148 @@
 from __future__ import annotations
-from dataclasses import dataclass
+import asyncio
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator
 from app.core.config import settings
 
 @dataclass(frozen=True)
 class ModelChoice:
     model: str
 
+
+def model_tag(model: str) -> str:
+    # Ollama lists untagged models as "<name>:latest"
+    return model if ":" in model else f"{model}:latest"
+
+
+@dataclass
+class Endpoint:
+    url: str
+    healthy: bool = True
+    inflight: int = 0
+    ewma_latency: float | None = None  # seconds to first token
+    failures: int = 0
+    models: set[str] = field(default_factory=set)
+    last_check: float = 0.0
+
+    def score(self, prior: float) -> float:
+        # Expected wait if we add one more request: queue length x typical latency
+        return (self.inflight + 1) * (self.ewma_latency if self.ewma_latency is not None else prior)
+
+
+class EndpointPool:
+    """
+    Ollama endpoints that can serve each model, with rolling latency and in-flight counts.
+    pick() orders the candidates for one call, least loaded first; callers fail over
+    down that list.
+    """
+    ALPHA = 0.3
+    MAX_FAILURES = 2
+
+    def __init__(self, urls: list[str], model_endpoints: dict[str, list[str]] | None = None):
+        self.endpoints: dict[str, Endpoint] = {}
+        self.shared: list[str] = [self._add(u).url for u in urls]
+        self.model_endpoints: dict[str, list[str]] = {}
+        for model, model_urls in (model_endpoints or {}).items():
+            self.model_endpoints[model] = [self._add(u).url for u in model_urls]
+
+    def _add(self, url: str) -> Endpoint:
+        url = url.rstrip("/")
+        ep = self.endpoints.get(url)
+        if ep is None:
+            ep = self.endpoints[url] = Endpoint(url)
+        return ep
+
+    def endpoints_for(self, model: str) -> list[Endpoint]:
+        if model in self.model_endpoints:
+            return [self.endpoints[u] for u in self.model_endpoints[model]]
+        tag = model_tag(model)
+        shared = [self.endpoints[u] for u in self.shared]
+        # Endpoints whose /api/tags listed the model; before the first health check
+        # (or if nobody lists it) fall back to every shared endpoint.
+        serving = [ep for ep in shared if tag in ep.models]
+        return serving or shared
+
+    def pick(self, model: str) -> list[Endpoint]:
+        candidates = self.endpoints_for(model)
+        known = [ep.ewma_latency for ep in candidates if ep.ewma_latency is not None]
+        prior = min(known) if known else 0.0
+        healthy = [ep for ep in candidates if ep.healthy]
+        unhealthy = [ep for ep in candidates if not ep.healthy]
+        # Unhealthy endpoints stay at the end as a last resort: the health check may be stale
+        return sorted(healthy, key=lambda ep: ep.score(prior)) + unhealthy
+
+    @contextmanager
+    def lease(self, ep: Endpoint) -> Iterator[Endpoint]:
+        ep.inflight += 1
+        try:
+            yield ep
+        finally:
+            ep.inflight -= 1
+
+    def observe(self, ep: Endpoint, latency: float) -> None:
+        ep.ewma_latency = latency if ep.ewma_latency is None else (
+            self.ALPHA * latency + (1 - self.ALPHA) * ep.ewma_latency
+        )
+        ep.failures = 0
+        ep.healthy = True
+
+    def fail(self, ep: Endpoint) -> None:
+        ep.failures += 1
+        if ep.failures >= self.MAX_FAILURES:
+            ep.healthy = False
+
+    async def check(self, client: Any, ep: Endpoint, timeout: float = 5.0) -> None:
+        try:
+            r = await client.get(f"{ep.url}/api/tags", timeout=timeout)
+            r.raise_for_status()
+            ep.models = {m.get("name", "") for m in r.json().get("models", [])}
+            ep.healthy = True
+            ep.failures = 0
+        except Exception:
+            ep.healthy = False
+        ep.last_check = time.time()
+
+    async def check_all(self, client: Any) -> None:
+        await asyncio.gather(*(self.check(client, ep) for ep in self.endpoints.values()))
+
+    async def monitor(self, get_client: Any, interval: float) -> None:
+        """Health-check every endpoint forever; run as a background task."""
+        while True:
+            await self.check_all(get_client())
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            ep.url: {
+                "healthy": ep.healthy,
+                "inflight": ep.inflight,
+                "ewma_latency_ms": ep.ewma_latency * 1000 if ep.ewma_latency is not None else None,
+                "failures": ep.failures,
+                "models": sorted(ep.models),
+            }
+            for ep in self.endpoints.values()
+        }
+
+
+_endpoint_pool: EndpointPool | None = None
+
+def get_endpoint_pool() -> EndpointPool:
+    global _endpoint_pool
+    if _endpoint_pool is None:
+        _endpoint_pool = EndpointPool(settings.OLLAMA_ENDPOINTS, settings.OLLAMA_MODEL_ENDPOINTS)
+    return _endpoint_pool
+
+
 class ModelRouter:
+    def all_models(self) -> list[str]:
+        """Every distinct model the pipeline stages use (for warm-up/residency)."""
+        names = [settings.MODEL_ENHANCE, settings.MODEL_SPEC, settings.MODEL_CODE, settings.MODEL_REPAIR]
+        return list(dict.fromkeys(n for n in names if n))
+
+    # Endpoints are picked per call by the Ollama provider (EndpointPool.pick), which
+    # sees the load at request time; the router only chooses the model.
     def spec_model(self) -> ModelChoice:
         return ModelChoice(settings.MODEL_SPEC)
 
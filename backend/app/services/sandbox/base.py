@@ -10,10 +10,10 @@ class ExecResult:
 
 class SandboxRunner(ABC):
     @abstractmethod
-    def setup(self, workspace: Path) -> None: ...
+    async def setup(self, workspace: Path) -> None: ...
 
     @abstractmethod
-    def install_deps(self, workspace: Path, requirements_path: Path) -> ExecResult: ...
+    async def install_deps(self, workspace: Path, requirements_path: Path) -> ExecResult: ...
 
     @abstractmethod
-    def run(self, workspace: Path, entrypoint: str) -> ExecResult: ...
+    async def run(self, workspace: Path, entrypoint: str) -> ExecResult: ...
@@ -0,0 +1,174 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Awaitable, Callable
+from app.services.sandbox.base import ExecResult
+
+Exec = Callable[[list[str], Path], Awaitable[ExecResult]]
+
+DEPS_PTH = "_p2p_deps.pth"  # sorts before the template's .pth, so these shadow it
+READY_MARKER = ".p2p_ready"
+PIP_FLAGS = ["--no-input", "--disable-pip-version-check", "--default-timeout", "120"]
+_NAME = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[([^\]]*)\])?")
+
+
+def canonical_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _parse(line: str) -> tuple[str, frozenset[str], str] | None:
+    """(canonical name, canonical extras, rest of the line) of a requirement, or None."""
+    m = _NAME.match(line)
+    if m is None:
+        return None
+    extras = frozenset(canonical_name(e.strip()) for e in (m.group(2) or "").split(",") if e.strip())
+    rest = re.sub(r"\s+", "", line[m.end():])
+    if rest.startswith("["):
+        return None  # unclosed extras
+    return canonical_name(m.group(1)), extras, rest
+
+
+def normalize_requirements(content: str, provided: tuple[str, ...] = ()) -> list[str] | None:
+    """
+    Sorted, de-duplicated requirement lines with canonical names and extras and no
+    whitespace, minus packages the sandbox already provides (a requirement with extras
+    is only dropped if the provided entry has those extras too). None if a line isn't
+    a plain requirement (pip options, URLs, local paths) and so can't be cached by content.
+    """
+    skip: dict[str, frozenset[str]] = {}
+    for p in provided:
+        parsed = _parse(p)
+        if parsed is not None:
+            skip[parsed[0]] = parsed[1]
+    out: set[str] = set()
+    for raw in content.splitlines():
+        line = raw.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith("-") or "://" in line or line.startswith((".", "/")):
+            return None
+        parsed = _parse(line)
+        if parsed is None:
+            return None
+        name, extras, rest = parsed
+        if name in skip and extras <= skip[name]:
+            continue
+        out.add(name + (f"[{','.join(sorted(extras))}]" if extras else "") + rest)
+    return sorted(out)
+
+
+class DepCache:
+    """
+    Content-addressed dependency sets shared by all run venvs.
+
+    A requirement set is identified by the hash of its normalized lines, the
+    interpreter/template version and the venv's baseline distributions. The baseline is
+    passed to pip as constraints (`-c`), so transitive dependencies resolve to the
+    versions the venv already has instead of shadowing them with others. The first run
+    needing a set installs it with `pip install --target` into <root>/sets/<key>/site,
+    from wheels in the shared
+    <root>/wheelhouse (`--no-index --find-links`); the wheelhouse is only filled from
+    the index when it is missing something, and never when offline. The installed
+    distributions are written to resolved.txt as the set's lock. Every later run with
+    the same set just gets a .pth file pointing at that site-packages.
+    """
+    def __init__(self, root: Path, version: str, exec_fn: Exec, offline: bool = False):
+        self.root = root
+        self.version = version
+        self.wheelhouse = root / "wheelhouse"
+        self.sets = root / "sets"
+        self.offline = offline
+        self._exec = exec_fn
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def key(self, requirements: list[str], constraints: list[str] = ()) -> str:
+        blob = "\n".join([self.version, *requirements, "--constraints--", *constraints])
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+    def entry(self, key: str) -> Path:
+        return self.sets / key
+
+    def link(self, site_packages: Path, key: str | None) -> None:
+        """Point a venv at a materialized set (or detach it when key is None)."""
+        pth = site_packages / DEPS_PTH
+        if key is None:
+            pth.unlink(missing_ok=True)
+            return
+        site_packages.mkdir(parents=True, exist_ok=True)
+        pth.write_text(str((self.entry(key) / "site").resolve()) + "\n", encoding="utf-8")
+
+    async def materialize(
+        self, pip: list[str], requirements: list[str], constraints: list[str] = ()
+    ) -> tuple[str, ExecResult]:
+        """
+        Make sure the set is installed in the cache, resolved against the baseline
+        constraints (name==version lines); returns its key and the (last) pip result.
+        """
+        key = self.key(requirements, constraints)
+        entry = self.entry(key)
+        if (entry / READY_MARKER).exists():
+            return key, ExecResult(0, f"Reused cached dependency set {key}", "")
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if (entry / READY_MARKER).exists():
+                return key, ExecResult(0, f"Reused cached dependency set {key}", "")
+            build = entry.with_name(f"{key}.build-{os.getpid()}")
+            # Filesystem work runs off the event loop
+            await asyncio.to_thread(self._prepare, build, requirements, constraints)
+            try:
+                resolve = ["-r", str(build / "requirements.txt"), "-c", str(build / "constraints.txt")]
+                install = pip + [
+                    "install", *PIP_FLAGS, "--no-index", "--find-links", str(self.wheelhouse),
+                    "--target", str(build / "site"), *resolve,
+                ]
+                res = await self._exec(install, build)
+                if res.exit_code != 0 and not self.offline:
+                    # Wheelhouse is missing something: fetch/build the wheels, then retry offline
+                    fetch = await self._exec(
+                        pip + ["wheel", *PIP_FLAGS, "--wheel-dir", str(self.wheelhouse), *resolve], build
+                    )
+                    if fetch.exit_code != 0:
+                        return key, fetch
+                    await asyncio.to_thread(shutil.rmtree, build / "site", ignore_errors=True)
+                    res = await self._exec(install, build)
+                if res.exit_code != 0:
+                    return key, res
+                await asyncio.to_thread(self._publish, build, entry, key)
+                return key, res
+            finally:
+                await asyncio.to_thread(shutil.rmtree, build, ignore_errors=True)
+
+    def _prepare(self, build: Path, requirements: list[str], constraints: list[str]) -> None:
+        shutil.rmtree(build, ignore_errors=True)
+        build.mkdir(parents=True)
+        (build / "requirements.txt").write_text("\n".join(requirements) + "\n", encoding="utf-8")
+        (build / "constraints.txt").write_text("\n".join(constraints) + "\n", encoding="utf-8")
+        self.wheelhouse.mkdir(parents=True, exist_ok=True)
+
+    def _publish(self, build: Path, entry: Path, key: str) -> None:
+        (build / "resolved.txt").write_text("\n".join(installed(build / "site")) + "\n", encoding="utf-8")
+        (build / READY_MARKER).write_text(key, encoding="utf-8")
+        try:
+            os.rename(build, entry)
+        except OSError:
+            # Same set materialized concurrently by another process
+            pass
+
+    def resolved(self, key: str) -> list[str]:
+        try:
+            return (self.entry(key) / "resolved.txt").read_text(encoding="utf-8").split()
+        except OSError:
+            return []
+
+
+def installed(site: Path) -> list[str]:
+    """name==version for every distribution in a site-packages (or --target) directory."""
+    out = []
+    for info in site.glob("*.dist-info"):
+        name, _, version = info.name[: -len(".dist-info")].partition("-")
+        out.append(f"{canonical_name(name)}=={version}")
+    return sorted(out)
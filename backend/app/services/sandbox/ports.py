@@ -0,0 +1,70 @@
+from __future__ import annotations
+import os
+import socket
+import uuid
+from sqlmodel import Session
+from app.db.database import engine
+from app.db import repo
+
+
+def port_bindable(port: int) -> bool:
+    """True if nothing else is listening on the port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        if os.name != "nt":
+            # Like uvicorn: a port in TIME_WAIT is still free to use
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(("0.0.0.0", port))
+        except OSError:
+            return False
+    return True
+
+
+class PortPool:
+    """
+    Leases preview ports from [base, base + count) to runs. A run keeps its port for
+    repair attempts and later modifications until the lease is released; freed ports
+    are handed to the next run. Ports something else is listening on are skipped.
+
+    Leases are rows in the PreviewLease table (unique per port), so API processes
+    sharing the DB never hand out the same port. Each process renews its leases (see
+    renew()); one that stops renewing loses them after lease_seconds.
+    """
+    def __init__(self, base: int, count: int, lease_seconds: float):
+        self.base = base
+        self.count = max(1, count)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def lease(self, run_id: int) -> int | None:
+        """The run's port (existing lease first); None when every port is taken."""
+        with Session(engine) as session:
+            existing = repo.get_port_lease(session, run_id)
+            if existing is not None and repo.renew_port_lease(session, run_id, self.owner, self.lease_seconds):
+                return existing.port
+            taken = {lease.port for lease in repo.list_port_leases(session)}
+            for port in range(self.base, self.base + self.count):
+                if port in taken or not port_bindable(port):
+                    continue
+                if repo.try_lease_port(session, port, run_id, self.owner, self.lease_seconds):
+                    return port
+        return None
+
+    def release(self, run_id: int) -> int | None:
+        with Session(engine) as session:
+            return repo.release_port(session, run_id)
+
+    def port_of(self, run_id: int) -> int | None:
+        with Session(engine) as session:
+            lease = repo.get_port_lease(session, run_id)
+            return lease.port if lease is not None else None
+
+    def renew(self) -> int:
+        """Keep this process's leases alive."""
+        with Session(engine) as session:
+            return repo.renew_port_leases(session, self.owner, self.lease_seconds)
+
+    def leases(self) -> dict[int, int]:
+        """run_id -> port for every live lease, from any process."""
+        with Session(engine) as session:
+            return {lease.run_id: lease.port for lease in repo.list_port_leases(session)}
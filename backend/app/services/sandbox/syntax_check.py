@@ -0,0 +1,96 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import os
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Trees with at least this many files needing a compile are spread over worker processes
+PARALLEL_MIN_FILES = 16
+POOL_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+CACHE_SIZE = 4096
+
+# content hash -> formatted error (None: compiles cleanly)
+_results: OrderedDict[str, str | None] = OrderedDict()
+_results_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+
+
+def compile_error(filename: str, source: bytes) -> str | None:
+    """py_compile-style report for one file, or None if it compiles."""
+    try:
+        compile(source, filename, "exec", dont_inherit=True)
+    except (SyntaxError, ValueError) as e:
+        return "".join(traceback.format_exception_only(type(e), e)).rstrip()
+    return None
+
+
+def _compile_batch(items: list[tuple[str, bytes]]) -> list[str | None]:
+    return [compile_error(name, source) for name, source in items]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+    return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def _remember(digest: str, error: str | None) -> None:
+    with _results_lock:
+        _results[digest] = error
+        _results.move_to_end(digest)
+        while len(_results) > CACHE_SIZE:
+            _results.popitem(last=False)
+
+
+async def check_files(files: list[Path]) -> dict[Path, str]:
+    """
+    Compile every file in-process and return all syntax errors, keyed by file.
+    Results are cached by content hash (and include the file path, which is part of
+    the report), so an unchanged file is never compiled twice. Large batches are
+    compiled in a process pool, since compile() holds the GIL.
+    """
+    errors: dict[Path, str] = {}
+    todo: list[tuple[Path, str, bytes]] = []
+    for path in files:
+        try:
+            source = path.read_bytes()
+        except OSError as e:
+            errors[path] = f"OSError: {e}"
+            continue
+        digest = hashlib.sha256(str(path).encode("utf-8") + b"\0" + source).hexdigest()
+        with _results_lock:
+            cached = _results.get(digest, ...)
+        if cached is ...:
+            todo.append((path, digest, source))
+        elif cached is not None:
+            errors[path] = cached
+
+    if not todo:
+        return errors
+    items = [(str(path), source) for path, _, source in todo]
+    if len(todo) >= PARALLEL_MIN_FILES:
+        loop = asyncio.get_running_loop()
+        chunk = -(-len(items) // POOL_WORKERS)
+        batches = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+        parts = await asyncio.gather(*(loop.run_in_executor(_get_pool(), _compile_batch, b) for b in batches))
+        results = [r for part in parts for r in part]
+    else:
+        results = await asyncio.to_thread(_compile_batch, items)
+
+    for (path, digest, _), error in zip(todo, results):
+        _remember(digest, error)
+        if error is not None:
+            errors[path] = error
+    return {path: errors[path] for path in files if path in errors}
@@ -1,49 +1,136 @@
 from __future__ import annotations
+import asyncio
+import hashlib
 import os
+import shutil
 import subprocess
 import sys
+import time
+from collections import deque
 from pathlib import Path
-from typing import IO, Any
+from typing import IO, Awaitable, Callable
+from app.core.config import settings
 from app.services.sandbox.base import SandboxRunner, ExecResult
+from app.services.sandbox.dep_cache import DepCache, installed, normalize_requirements
+from app.services.sandbox.syntax_check import check_files
+from app.services.sandbox.ports import PortPool
+
+# Installed into every sandbox before the app's own requirements
+BASELINE_PACKAGES = ("fastapi", "uvicorn", "aiofiles")
+# Bump to force a fresh template when its build recipe changes
+TEMPLATE_REVISION = 1
+TEMPLATE_PTH = "_p2p_template.pth"
+READY_MARKER = ".p2p_ready"
+
+
+def template_version() -> str:
+    """Template directory name: changes with the interpreter and the baseline package set."""
+    key = "|".join([sys.version, sys.executable, ",".join(BASELINE_PACKAGES), str(TEMPLATE_REVISION)])
+    return f"py{sys.version_info.major}{sys.version_info.minor}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+
+def site_packages(venv_dir: Path) -> Path:
+    if os.name == "nt":
+        return venv_dir / "Lib" / "site-packages"
+    return venv_dir / "lib" / f"python{sys.version_info.major}.{sys.version_info.minor}" / "site-packages"
+
+# uvicorn logs this once the socket is bound (after application start-up)
+UVICORN_READY_LINE = "Uvicorn running on"
+UVICORN_START_TIMEOUT = 12.0
+UVICORN_REPORT_LINES = 400
+
+
+class _UvicornChild:
+    """A started uvicorn process whose stdout/stderr are pumped into log files."""
+    def __init__(self, proc: asyncio.subprocess.Process, out_log: IO[str], err_log: IO[str]):
+        self.proc = proc
+        self.ready = asyncio.Event()
+        self.stdout: deque[str] = deque(maxlen=UVICORN_REPORT_LINES)
+        self.stderr: deque[str] = deque(maxlen=UVICORN_REPORT_LINES)
+        # Bumped by every access-log line (uvicorn writes those to stdout)
+        self.last_activity = time.monotonic()
+        self._logs = (out_log, err_log)
+        # Done once both pipes hit EOF (the process is gone) and the log files are closed
+        self.drained: asyncio.Future = asyncio.ensure_future(self._pump_all())
+
+    async def _pump_all(self) -> None:
+        out_log, err_log = self._logs
+        try:
+            await asyncio.gather(
+                self._pump(self.proc.stdout, out_log, self.stdout),
+                self._pump(self.proc.stderr, err_log, self.stderr),
+            )
+        finally:
+            out_log.close()
+            err_log.close()
+
+    async def _pump(self, stream: asyncio.StreamReader | None, sink: IO[str], buf: deque[str]) -> None:
+        if stream is None:
+            return
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # Line longer than the stream limit: take what is buffered
+                line = await stream.read(1 << 16)
+            if not line:
+                return
+            text = line.decode("utf-8", errors="replace")
+            sink.write(text)
+            sink.flush()
+            buf.append(text)
+            if buf is self.stdout:
+                self.last_activity = time.monotonic()
+            if UVICORN_READY_LINE in text:
+                self.ready.set()
+
+    def stdout_text(self) -> str:
+        return "".join(self.stdout)
+
+    def stderr_text(self) -> str:
+        return "".join(self.stderr)
+
 
 class VenvSandboxRunner(SandboxRunner):
+    """
+    Runs generated apps in a per-workspace venv. Every subprocess is an asyncio
+    subprocess, so pip installs and app start-ups never block the event loop that is
+    driving other runs.
+    """
     def __init__(self, venv_dir_name: str = ".venv_sandbox"):
         self.venv_dir_name = venv_dir_name
-        self._uvicorn_children: dict[int, tuple[subprocess.Popen[Any], IO[str], IO[str]]] = {}
+        self._uvicorn_children: dict[int, _UvicornChild] = {}
+        self.ports = PortPool(settings.PREVIEW_PORT_BASE, settings.PREVIEW_PORT_COUNT, settings.PREVIEW_LEASE_SECONDS)
+        # Called with (run_id, reason) when a live preview is stopped to free resources
+        self.on_preview_stopped: Callable[[int, str], Awaitable[None]] | None = None
+        self._template_lock = asyncio.Lock()
+        self._template_failed = False
+        self.dep_cache = DepCache(
+            settings.DEP_CACHE_ROOT, template_version(), lambda cmd, cwd: self._exec(cmd, cwd=cwd), offline=settings.DEP_CACHE_OFFLINE
+        )
 
     def _venv_dir(self, workspace: Path) -> Path:
         return workspace / self.venv_dir_name
 
-    def check_syntax(self, workspace: Path) -> str | None:
+    async def check_syntax(self, workspace: Path) -> str | None:
         """
-        Runs python -m py_compile on all .py files in generated_app/backend.
-        Returns error string if any, else None.
+        Compiles all .py files in generated_app/backend in process; unchanged files hit
+        syntax_check's content cache. The sandbox venv runs this same interpreter, so
+        the grammar matches. Returns every syntax error found, or None.
         """
         backend_dir = workspace / "generated_app" / "backend"
         if not backend_dir.exists():
             return "Backend directory not found"
 
         # Find all .py files
-        py_files = list(backend_dir.rglob("*.py"))
+        py_files = [p for p in backend_dir.rglob("*.py") if "__pycache__" not in p.parts]
         if not py_files:
             return None
 
-        for py_file in py_files:
-            # Run compile
-            # We run inside venv
-            cmd = [str(self._python_executable(workspace)), "-m", "py_compile", str(py_file)]
-            res = subprocess.run(cmd, capture_output=True, text=True)
-            if res.returncode != 0:
-                # Syntax error
-                return f"SyntaxError in {py_file.name}:\n{res.stderr}"
-        
-        return None
-
-    def _python_executable(self, workspace: Path) -> Path:
-        if sys.platform == "win32":
-            return workspace / ".venv_sandbox" / "Scripts" / "python.exe"
-        else:
-            return workspace / ".venv_sandbox" / "bin" / "python"
+        errors = await check_files(py_files)
+        if not errors:
+            return None
+        return "\n\n".join(f"SyntaxError in {path.name}:\n{report}" for path, report in errors.items())
 
     def _python_path(self, workspace: Path) -> Path:
         venv_dir = self._venv_dir(workspace)
@@ -54,18 +141,140 @@ class VenvSandboxRunner(SandboxRunner):
     def _pip_cmd(self, workspace: Path) -> list[str]:
         return [str(self._python_path(workspace)), "-m", "pip"]
 
-    def setup(self, workspace: Path) -> None:
+    async def _check_call(self, cmd: list[str], cwd: Path) -> None:
+        res = await self._exec(cmd, cwd=cwd)
+        if res.exit_code != 0:
+            raise subprocess.CalledProcessError(res.exit_code, cmd, res.stdout, res.stderr)
+
+    async def _template(self) -> Path | None:
+        """
+        The shared template venv for this interpreter and baseline, built on first use.
+        It is built under a temporary name and renamed into place, so concurrent builders
+        (other workers or processes) never see a half-built template.
+        """
+        root = settings.VENV_TEMPLATE_ROOT / template_version()
+        if (root / READY_MARKER).exists():
+            return root
+        if self._template_failed:
+            return None
+        async with self._template_lock:
+            if (root / READY_MARKER).exists():
+                return root
+            build = root.with_name(f"{root.name}.build-{os.getpid()}")
+            try:
+                shutil.rmtree(build, ignore_errors=True)
+                build.parent.mkdir(parents=True, exist_ok=True)
+                await self._check_call([sys.executable, "-m", "venv", str(build)], cwd=build.parent)
+                py = build / ("Scripts/python.exe" if os.name == "nt" else "bin/python")
+                await self._check_call(
+                    [str(py), "-m", "pip", "install", "--no-input", "--disable-pip-version-check", *BASELINE_PACKAGES],
+                    cwd=build.parent,
+                )
+                (build / READY_MARKER).write_text(template_version(), encoding="utf-8")
+                try:
+                    os.rename(build, root)
+                except OSError:
+                    # Another process finished first; use theirs
+                    shutil.rmtree(build, ignore_errors=True)
+            except (OSError, subprocess.CalledProcessError) as e:
+                shutil.rmtree(build, ignore_errors=True)
+                self._template_failed = True
+                print(f"[WARN] venv template build failed, using per-run venvs: {e}", flush=True)
+                return None
+        return root if (root / READY_MARKER).exists() else None
+
+    async def _layer_on_template(self, workspace: Path, template: Path) -> None:
+        """
+        Bare venv (no pip of its own) whose site-packages points at the template's via a
+        .pth file. Packages installed later land in the run's own site-packages and
+        shadow the template's; pip itself is imported from the template.
+        """
         venv_dir = self._venv_dir(workspace)
-        if not venv_dir.exists():
-            subprocess.run([sys.executable, "-m", "venv", str(venv_dir)], check=True)
-            # Pre-install core dependencies as a safety baseline
-            cmd = self._pip_cmd(workspace) + ["install", "fastapi", "uvicorn", "aiofiles"]
-            subprocess.run(cmd, check=True)
+        if not self._python_path(workspace).exists():
+            await self._check_call([sys.executable, "-m", "venv", "--without-pip", str(venv_dir)], cwd=workspace)
+        site = site_packages(venv_dir)
+        site.mkdir(parents=True, exist_ok=True)
+        (site / TEMPLATE_PTH).write_text(str(site_packages(template).resolve()) + "\n", encoding="utf-8")
+        await self._check_call(
+            [str(self._python_path(workspace)), "-c", "import pip, " + ", ".join(BASELINE_PACKAGES)], cwd=workspace
+        )
 
-    def install_deps(self, workspace: Path, requirements_path: Path) -> ExecResult:
+    async def setup(self, workspace: Path) -> None:
+        venv_dir = self._venv_dir(workspace)
+        # Marker written last: setup runs alongside codegen and can be cancelled halfway
+        ready = venv_dir / READY_MARKER
+        if ready.exists():
+            return
+        template = await self._template() if settings.VENV_TEMPLATE_ENABLED else None
+        if template is not None:
+            try:
+                await self._layer_on_template(workspace, template)
+                ready.write_text(template.name, encoding="utf-8")
+                return
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"[WARN] layering {workspace} on the venv template failed, building a full venv: {e}", flush=True)
+                shutil.rmtree(venv_dir, ignore_errors=True)
+
+        if not self._python_path(workspace).exists():
+            await self._check_call([sys.executable, "-m", "venv", str(venv_dir)], cwd=workspace)
+        # Pre-install core dependencies as a safety baseline
+        cmd = self._pip_cmd(workspace) + ["install", *BASELINE_PACKAGES]
+        await self._check_call(cmd, cwd=workspace)
+        ready.write_text("", encoding="utf-8")
+
+    async def install_deps(self, workspace: Path, requirements_path: Path) -> ExecResult:
         if (not requirements_path.exists()) or requirements_path.read_text(encoding="utf-8").strip() == "":
+            self.dep_cache.link(site_packages(self._venv_dir(workspace)), None)
             return ExecResult(exit_code=0, stdout="No requirements to install.", stderr="")
 
+        requirements = normalize_requirements(requirements_path.read_text(encoding="utf-8"), BASELINE_PACKAGES)
+        if settings.DEP_CACHE_ENABLED and requirements is not None:
+            return await self._install_cached(workspace, requirements)
+        return await self._pip_install(workspace, requirements_path)
+
+    async def _install_cached(self, workspace: Path, requirements: list[str]) -> ExecResult:
+        """
+        Link the venv to the shared install of this requirement set, materializing it
+        first if no run needed the same set before.
+        """
+        site = site_packages(self._venv_dir(workspace))
+        if not requirements:
+            self.dep_cache.link(site, None)
+            return ExecResult(exit_code=0, stdout="All requirements are provided by the sandbox baseline.", stderr="")
+        try:
+            baseline = await asyncio.to_thread(self._baseline, site)
+            key, res = await self.dep_cache.materialize(self._pip_cmd(workspace), requirements, baseline)
+        except OSError as e:
+            print(f"[WARN] dependency cache unavailable, installing into the venv: {e}", flush=True)
+            req_file = workspace / ".p2p_requirements.txt"
+            req_file.write_text("\n".join(requirements) + "\n", encoding="utf-8")
+            return await self._pip_install(workspace, req_file)
+        if res.exit_code != 0:
+            return res
+        self.dep_cache.link(site, key)
+        resolved = self.dep_cache.resolved(key)
+        return ExecResult(
+            exit_code=0,
+            stdout=f"{res.stdout.strip()}\nDependency set {key} linked ({len(resolved)} packages): {' '.join(resolved)}",
+            stderr="",
+        )
+
+    def _baseline(self, site: Path) -> list[str]:
+        """Distributions the venv has without a dependency set: its own and the template's."""
+        sites = [site]
+        template_pth = site / TEMPLATE_PTH
+        if template_pth.exists():
+            sites.append(Path(template_pth.read_text(encoding="utf-8").strip()))
+        dists: dict[str, str] = {}
+        for s in reversed(sites):
+            # The venv's own site-packages comes first on sys.path, so its versions win
+            for line in installed(s):
+                dists[line.partition("==")[0]] = line
+        return sorted(dists.values())
+
+    async def _pip_install(self, workspace: Path, requirements_path: Path) -> ExecResult:
+        # Detach any cached set first, or its packages would keep shadowing this install
+        self.dep_cache.link(site_packages(self._venv_dir(workspace)), None)
         cmd = self._pip_cmd(workspace) + [
             "install",
             "--no-input",
@@ -73,142 +282,234 @@ class VenvSandboxRunner(SandboxRunner):
             "--default-timeout", "120",
             "-r", str(requirements_path),
         ]
-        return self._exec(cmd, cwd=workspace)
-
-    async def _wait_for_port(self, host: str, port: int, timeout: int = 15) -> bool:
-        import socket
-        import time
-        start = time.time()
-        while time.time() - start < timeout:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(1)
-                try:
-                    s.connect((host, port))
-                    return True
-                except (socket.timeout, ConnectionRefusedError):
-                    time.sleep(1)
-        return False
+        return await self._exec(cmd, cwd=workspace)
 
-    def stop_uvicorn_for_run(self, run_id: int) -> None:
-        existing = self._uvicorn_children.pop(run_id, None)
-        if not existing:
-            return
-        proc, out_log, err_log = existing
+    async def _port_open(self, host: str, port: int, timeout: float = 1.0) -> bool:
         try:
-            if proc.poll() is None:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
+
+    async def _probe_port(self, host: str, port: int) -> None:
+        """Returns once the port accepts connections; retries back off from 10 ms to 250 ms."""
+        delay = 0.01
+        while not await self._port_open(host, port, timeout=0.5):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    async def _wait_ready(self, child: _UvicornChild, host: str, port: int, probe: bool) -> str:
+        """
+        Race the signals a start-up can produce: uvicorn's "running on" log line, the
+        port accepting connections, the process exiting. Returns ready | exited | timeout.
+        """
+        waiters = {
+            asyncio.ensure_future(child.ready.wait()): "ready",
+            asyncio.ensure_future(child.proc.wait()): "exited",
+        }
+        if probe:
+            waiters[asyncio.ensure_future(self._probe_port(host, port))] = "ready"
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=UVICORN_START_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+            outcomes = {waiters[t] for t in done}
+            if "ready" in outcomes and child.proc.returncode is None:
+                return "ready"
+            return "exited" if "exited" in outcomes else "timeout"
+        finally:
+            for t in waiters:
+                t.cancel()
+            await asyncio.gather(*waiters, return_exceptions=True)
+
+    async def _terminate(self, child: _UvicornChild) -> None:
+        proc = child.proc
+        try:
+            if proc.returncode is None:
                 proc.terminate()
                 try:
-                    proc.wait(timeout=5)
-                except subprocess.TimeoutExpired:
+                    await asyncio.wait_for(proc.wait(), timeout=5)
+                except asyncio.TimeoutError:
                     proc.kill()
-        finally:
+                    await proc.wait()
+        except ProcessLookupError:
+            pass
+        # Pipes hit EOF once the process is gone; the pumps then close the log files
+        try:
+            await asyncio.wait_for(asyncio.shield(child.drained), timeout=2)
+        except asyncio.TimeoutError:
+            child.drained.cancel()
+
+    async def stop_uvicorn_for_run(self, run_id: int) -> None:
+        existing = self._uvicorn_children.pop(run_id, None)
+        if existing is not None:
+            await self._terminate(existing)
+
+    async def lease_port(self, run_id: int) -> int | None:
+        """Preview port for the run; when the pool is exhausted the least recently used preview is stopped for it."""
+        port = await asyncio.to_thread(self.ports.lease, run_id)
+        if port is None and await self._evict_lru(exclude=run_id, reason="port pool exhausted"):
+            port = await asyncio.to_thread(self.ports.lease, run_id)
+        return port
+
+    async def release_preview(self, run_id: int) -> None:
+        """Stop the run's app and give its port back to the pool."""
+        await self.stop_uvicorn_for_run(run_id)
+        await asyncio.to_thread(self.ports.release, run_id)
+
+    async def _stop_preview(self, run_id: int, reason: str) -> None:
+        await self.release_preview(run_id)
+        if self.on_preview_stopped is not None:
             try:
-                out_log.close()
-            except Exception:
-                pass
+                await self.on_preview_stopped(run_id, reason)
+            except Exception as e:
+                print(f"[WARN] preview stop hook failed for run {run_id}: {e}", flush=True)
+
+    async def _evict_lru(self, exclude: int | None, reason: str) -> bool:
+        live = [(child.last_activity, rid) for rid, child in self._uvicorn_children.items() if rid != exclude]
+        if not live:
+            return False
+        await self._stop_preview(min(live)[1], reason)
+        return True
+
+    async def reap_idle(self, idle_seconds: float) -> list[int]:
+        """Stop previews that exited on their own or haven't served a request for idle_seconds."""
+        now = time.monotonic()
+        reaped = []
+        for run_id, child in list(self._uvicorn_children.items()):
+            if child.proc.returncode is not None:
+                await self._stop_preview(run_id, f"app exited with code {child.proc.returncode}")
+            elif now - child.last_activity > idle_seconds:
+                await self._stop_preview(run_id, f"idle for {int(now - child.last_activity)}s")
+            else:
+                continue
+            reaped.append(run_id)
+        return reaped
+
+    async def reap_forever(self, interval: float, idle_seconds: float) -> None:
+        """Reap idle previews and renew this process's port leases every interval."""
+        while True:
+            await asyncio.sleep(interval)
             try:
-                err_log.close()
-            except Exception:
-                pass
+                await asyncio.to_thread(self.ports.renew)
+                await self.reap_idle(idle_seconds)
+            except Exception as e:
+                print(f"[WARN] preview reaper: {e}", flush=True)
 
-    def run_uvicorn(self, workspace: Path, app_dir: Path, host: str, port: int, run_id: int | None = None) -> ExecResult:
-        import time
+    async def stop_all(self) -> None:
+        for run_id in list(self._uvicorn_children):
+            await self.release_preview(run_id)
+
+    def previews(self) -> list[dict]:
+        now = time.monotonic()
+        leases = self.ports.leases()
+        return [
+            {
+                "run_id": run_id,
+                "port": port,
+                "live": run_id in self._uvicorn_children,
+                "idle_s": round(now - self._uvicorn_children[run_id].last_activity, 1) if run_id in self._uvicorn_children else None,
+            }
+            for run_id, port in sorted(leases.items())
+        ]
+
+    async def run_uvicorn(self, workspace: Path, app_dir: Path, host: str, port: int, run_id: int | None = None) -> ExecResult:
         py = str(self._python_path(workspace))
         cmd = [py, "-m", "uvicorn", "main:app", "--host", host, "--port", str(port)]
-        
+        probe_host = host if host != "0.0.0.0" else "127.0.0.1"
+
         # Prepare log files
         log_dir = workspace / ".logs"
         log_dir.mkdir(exist_ok=True)
-        
-        # Use 'a' append mode to persist logs across attempts
-        out_log = open(log_dir / "uvicorn.stdout.log", "a", encoding="utf-8")
-        err_log = open(log_dir / "uvicorn.stderr.log", "a", encoding="utf-8")
 
+        child = None
         try:
             if run_id is not None:
-                self.stop_uvicorn_for_run(run_id)
+                await self.stop_uvicorn_for_run(run_id)
+            # Cap on concurrently live previews: make room by stopping the least recently used
+            while len(self._uvicorn_children) >= max(1, settings.PREVIEW_MAX_LIVE):
+                if not await self._evict_lru(exclude=run_id, reason="too many live previews"):
+                    break
+            # If something else already holds the port, a successful connect proves nothing
+            probe = not await self._port_open(probe_host, port, timeout=0.2)
 
             popen_kwargs = {
                 "cwd": str(app_dir),
-                "stdout": out_log,
-                "stderr": err_log,
-                "text": True,
+                "stdout": asyncio.subprocess.PIPE,
+                "stderr": asyncio.subprocess.PIPE,
+                "limit": 1 << 20,
             }
             if os.name == "nt":
                 popen_kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
 
-            proc = subprocess.Popen(cmd, **popen_kwargs)
-                
-            # Check for early exit (e.g. invalid arguments, port already in use)
-            time.sleep(2)
-            if proc.poll() is not None:
-                # Process exited immediately
-                stdout = (log_dir / "uvicorn.stdout.log").read_text(encoding="utf-8")
-                stderr = (log_dir / "uvicorn.stderr.log").read_text(encoding="utf-8")
-                out_log.close()
-                err_log.close()
-                return ExecResult(exit_code=proc.returncode, stdout=stdout, stderr=stderr or "Process failed to start")
-
-            # Wait for port to become active
-            is_up = False
-            import socket
-            start_wait = time.time()
-            while time.time() - start_wait < 10:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(1)
-                    try:
-                        s.connect((host if host != "0.0.0.0" else "127.0.0.1", port))
-                        is_up = True
-                        break
-                    except (socket.timeout, ConnectionRefusedError):
-                        if proc.poll() is not None:
-                            break
-                        time.sleep(1)
-
-            if is_up:
+            proc = await asyncio.create_subprocess_exec(*cmd, **popen_kwargs)
+            # Output is teed into the log files (appended across attempts) and kept in
+            # memory for this attempt's error report
+            child = _UvicornChild(
+                proc,
+                open(log_dir / "uvicorn.stdout.log", "a", encoding="utf-8"),
+                open(log_dir / "uvicorn.stderr.log", "a", encoding="utf-8"),
+            )
+            outcome = await self._wait_ready(child, probe_host, port, probe)
+
+            if outcome == "ready":
                 if run_id is not None:
-                    self._uvicorn_children[run_id] = (proc, out_log, err_log)
-                else:
-                    out_log.close()
-                    err_log.close()
+                    self._uvicorn_children[run_id] = child
                 return ExecResult(exit_code=0, stdout=f"Uvicorn started and listening on http://{host}:{port}", stderr="")
 
-            if proc.poll() is not None:
-                stdout = (log_dir / "uvicorn.stdout.log").read_text(encoding="utf-8")
-                stderr = (log_dir / "uvicorn.stderr.log").read_text(encoding="utf-8")
-                out_log.close()
-                err_log.close()
-                return ExecResult(exit_code=proc.returncode, stdout=stdout, stderr=stderr)
-            out_log.close()
-            err_log.close()
-            return ExecResult(exit_code=1, stdout="Uvicorn started but port timed out", stderr="Health check failed")
-                    
+            if outcome == "exited":
+                await self._terminate(child)
+                return ExecResult(
+                    exit_code=proc.returncode, stdout=child.stdout_text(), stderr=child.stderr_text() or "Process failed to start"
+                )
+
+            # Still running but never became reachable: don't leave it holding the port
+            await self._terminate(child)
+            return ExecResult(
+                exit_code=1,
+                stdout=f"Uvicorn started but port timed out\n{child.stdout_text()}",
+                stderr=f"Health check failed\n{child.stderr_text()}",
+            )
+
+        except asyncio.CancelledError:
+            # Run cancelled while the app was starting: don't leave it holding the port
+            if child is not None:
+                await self._terminate(child)
+            raise
         except Exception as e:
-            try:
-                out_log.close()
-            except Exception:
-                pass
-            try:
-                err_log.close()
-            except Exception:
-                pass
+            if child is not None:
+                await self._terminate(child)
             return ExecResult(exit_code=1, stdout="", stderr=str(e))
-        # Note: We don't have a 'finally' that closes if it's still running, 
-        # because the subprocess owns the duped handles. 
-        # But our python file objects should be closed eventually or let GC handle them.
-        # However, if we return Success, we don't want to close them if it kills the stream? 
-        # Actually it won't on Windows/Linux Popen.
 
+    async def _exec(self, cmd: list[str], cwd: Path) -> ExecResult:
+        p = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=str(cwd),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await p.communicate()
+        except asyncio.CancelledError:
+            # Don't leave pip & co. running when the run is cancelled
+            if p.returncode is None:
+                p.kill()
+                await p.wait()
+            raise
+        return ExecResult(
+            exit_code=p.returncode,
+            stdout=stdout.decode("utf-8", errors="replace"),
+            stderr=stderr.decode("utf-8", errors="replace"),
+        )
 
-    def _exec(self, cmd: list[str], cwd: Path) -> ExecResult:
-        p = subprocess.run(cmd, cwd=str(cwd), capture_output=True, text=True)
-        return ExecResult(exit_code=p.returncode, stdout=p.stdout, stderr=p.stderr)
-
-    def run(self, workspace: Path, entrypoint: str) -> ExecResult:
+    async def run(self, workspace: Path, entrypoint: str) -> ExecResult:
         """
         Generic runner: executes a python file inside the venv.
         Useful for non-uvicorn commands too.
         """
         py = str(self._python_path(workspace))
         cmd = [py, str((workspace / entrypoint).resolve())]
-        return self._exec(cmd, cwd=workspace)
+        return await self._exec(cmd, cwd=workspace)
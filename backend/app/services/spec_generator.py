@@ -1,4 +1,5 @@
 from __future__ import annotations
+import json
 from app.services.prompt_to_spec import TaskSpec
 from app.services.llm.base import LLMClient
 
@@ -54,7 +55,20 @@ def repair_spec_json(data: dict) -> dict:
                 page["sections"] = repaired_sections
     return data
 
-async def llm_prompt_to_spec(llm: LLMClient, model: str, prompt: str) -> TaskSpec:
+def parse_spec(raw: str) -> TaskSpec:
+    # Parse as dict first so it can be repaired before validation
+    data = json.loads(extract_json(raw))
+    return TaskSpec.model_validate(repair_spec_json(data))
+
+def _is_valid_spec(raw: str) -> bool:
+    try:
+        parse_spec(raw)
+    except Exception:
+        return False
+    return True
+
+async def llm_prompt_to_spec(llm: LLMClient, model: str, prompt: str, reference: TaskSpec | None = None) -> TaskSpec:
+    """reference: TaskSpec of a similar earlier app, offered to the model as a starting point."""
     # Check if we are using the fine-tuned model
     model_lower = model.lower()
     is_finetuned = "taskspec" in model_lower or "ts" in model_lower or "lora" in model_lower
@@ -65,6 +79,13 @@ async def llm_prompt_to_spec(llm: LLMClient, model: str, prompt: str) -> TaskSpe
     else:
         system = SYSTEM_SPEC
         user = f"USER_PROMPT:\n{prompt}\n\nReturn TaskSpec JSON only."
+        if reference is not None:
+            user = (
+                f"USER_PROMPT:\n{prompt}\n\n"
+                "A closely related app was planned earlier with this TaskSpec. Start from it, keep what fits, "
+                f"and adapt names, pages and data to USER_PROMPT:\n{json.dumps(reference.model_dump(), ensure_ascii=False)}\n\n"
+                "Return TaskSpec JSON only."
+            )
     
     attempts = 0
     max_attempts = 3
@@ -72,15 +93,12 @@ async def llm_prompt_to_spec(llm: LLMClient, model: str, prompt: str) -> TaskSpe
     while attempts < max_attempts:
         attempts += 1
         try:
-            raw = await llm.chat(model=model, system=system, user=user, max_tokens=4096)
-            cleaned = extract_json(raw)
-            
-            # Try to parse as dict first for repair
-            import json
-            data = json.loads(cleaned)
-            data = repair_spec_json(data)
-            
-            return TaskSpec.model_validate(data)
+            # Retries repeat the same corrective prompt: never let them replay a cached answer
+            raw = await llm.chat(
+                model=model, system=system, user=user, max_tokens=4096,
+                cache=attempts == 1, validate=_is_valid_spec,
+            )
+            return parse_spec(raw)
             
         except Exception as e:
             if attempts >= max_attempts:
@@ -0,0 +1,126 @@
+from __future__ import annotations
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator
+from app.db.repo import add_stage_timing
+from app.services.persist import spawn_persist
+
+# Prometheus-style bucket upper bounds (seconds); LLM stages and pip installs run long.
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+QUEUE_BUCKETS = (0.05, 0.25, 1, 5, 15, 30, 60, 300, 900, 3600)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with labels, rendered in the Prometheus text format.
+    Observations come from the event loop and worker threads, and /metrics renders from
+    the threadpool, so the series are only touched under a lock.
+    """
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], list[float]] = {}  # counts per bucket + [+Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(snapshot.items()):
+            base = [f'{n}="{_escape(v)}"' for n, v in zip(self.labels, key)]
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                labels = ",".join(base + [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{{{labels}}} {int(count)}")
+            label_str = "{" + ",".join(base) + "}" if base else ""
+            lines.append(f"{self.name}_sum{label_str} {series[-1]}")
+            lines.append(f"{self.name}_count{label_str} {int(series[-2])}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = Histogram(
+    "p2p_stage_duration_seconds", "Pipeline stage and sub-step durations.", ("kind", "name", "status"), STAGE_BUCKETS
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "p2p_queue_wait_seconds", "Time runs spend queued before a worker picks them up.", ("kind",), QUEUE_BUCKETS
+)
+LLM_CALL_SECONDS = Histogram(
+    "p2p_llm_call_duration_seconds", "Wall time of upstream LLM calls.", ("model", "stage"), STAGE_BUCKETS
+)
+_HISTOGRAMS = (STAGE_SECONDS, QUEUE_WAIT_SECONDS, LLM_CALL_SECONDS)
+
+def record_timing(
+    run_id: int | None,
+    name: str,
+    duration_s: float,
+    kind: str = "step",
+    status: str = "ok",
+    started: float | None = None,
+    detail: str | None = None,
+) -> None:
+    """
+    Record one timed stage ("stage") or sub-step ("step") of a run: observed into the
+    histogram right away, persisted to the StageTiming table off the event loop.
+    started is a time.time() timestamp (defaults to now - duration).
+    """
+    STAGE_SECONDS.observe(duration_s, kind=kind, name=name, status=status)
+    if run_id is None:
+        return
+    start = started if started is not None else time.time() - duration_s
+    fields = dict(
+        run_id=run_id,
+        name=name,
+        kind=kind,
+        status=status,
+        detail=detail,
+        started_at=datetime.utcfromtimestamp(start),
+        duration_ms=duration_s * 1000,
+    )
+    spawn_persist(add_stage_timing, fields, "stage timing")
+
+
+@asynccontextmanager
+async def timed(run_id: int | None, name: str, kind: str = "step", detail: str | None = None) -> AsyncIterator[None]:
+    """Time the enclosed block; it is recorded as failed/cancelled if it raises."""
+    started = time.time()
+    t0 = time.monotonic()
+    status = "ok"
+    try:
+        yield
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        record_timing(run_id, name, time.monotonic() - t0, kind=kind, status=status, started=started, detail=detail)
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for hist in _HISTOGRAMS:
+        lines.extend(hist.render())
+    return "\n".join(lines) + "\n"
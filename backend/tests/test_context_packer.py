@@ -0,0 +1,44 @@
+from app.services.context_packer import estimate_tokens, pack_context
+
+MAIN = "\n".join(
+    ["import os", "from fastapi import FastAPI", "", "app = FastAPI()", ""]
+    + [f"def helper_{i}():\n    return {i}\n" for i in range(60)]
+    + ["def broken():", "    return undefined_name", ""]
+)
+TRACE = '''Traceback (most recent call last):
+  File "/tmp/ws/generated_app/backend/main.py", line {line}, in broken
+NameError: name 'undefined_name' is not defined
+'''
+
+
+def _workspace(tmp_path):
+    backend = tmp_path / "generated_app" / "backend"
+    (backend / "templates").mkdir(parents=True)
+    (backend / "main.py").write_text(MAIN)
+    (backend / "templates" / "index.html").write_text("<h1>hello</h1>\n")
+    (backend / "requirements.txt").write_text("fastapi\n")
+    (tmp_path / "generated_app" / "venv").mkdir()
+    (tmp_path / "generated_app" / "venv" / "skipped.py").write_text("x = 1\n")
+    return tmp_path
+
+
+def test_everything_fits_whole_under_a_large_budget(tmp_path):
+    out = pack_context(_workspace(tmp_path), 100_000)
+    assert "generated_app/backend/main.py" in out
+    assert "generated_app/backend/templates/index.html" in out
+    assert "EXCERPT" not in out
+    assert "skipped.py" not in out
+
+
+def test_small_budget_keeps_the_traceback_function_as_an_excerpt(tmp_path):
+    line = MAIN.splitlines().index("    return undefined_name") + 1
+    budget = 300
+    out = pack_context(_workspace(tmp_path), budget, error_text=TRACE.format(line=line))
+    assert "EXCERPT" in out
+    assert "return undefined_name" in out
+    assert "helper_30" not in out
+    assert estimate_tokens(out) <= budget
+
+
+def test_missing_workspace_packs_nothing(tmp_path):
+    assert pack_context(tmp_path, 1000) == ""
@@ -0,0 +1,95 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from app.services import dag
+from app.services.dag import DAG
+
+
+def test_nodes_get_dependency_results_and_independent_ones_overlap():
+    async def main():
+        running = set()
+        overlapped = []
+
+        async def step(name, value):
+            running.add(name)
+            await asyncio.sleep(0.01)
+            overlapped.append(set(running))
+            running.discard(name)
+            return value
+
+        dag = DAG()
+        dag.add("a", lambda: step("a", 1))
+        dag.add("b", lambda: step("b", 2))
+        dag.add("sum", lambda a, b: step("sum", a + b), deps=("a", "b"))
+        return await dag.run(), overlapped
+
+    results, overlapped = asyncio.run(main())
+    assert results == {"a": 1, "b": 2, "sum": 3}
+    assert {"a", "b"} in overlapped
+
+
+def test_failure_cancels_running_nodes_and_is_raised():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    async def boom():
+        raise RuntimeError("boom")
+
+    dag = DAG()
+    dag.add("slow", slow)
+    dag.add("boom", boom)
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(dag.run())
+    assert cancelled == ["slow"]
+    status = {t.name: t.status for t in dag.timings()}
+    assert status == {"slow": "cancelled", "boom": "failed"}
+
+
+def test_cycles_unknown_deps_and_duplicates_are_rejected():
+    async def noop(**_):
+        return None
+
+    dag = DAG()
+    dag.add("a", noop, deps=("b",))
+    dag.add("b", noop, deps=("a",))
+    with pytest.raises(ValueError, match="Cycle"):
+        asyncio.run(dag.run())
+
+    dag = DAG()
+    dag.add("a", noop, deps=("missing",))
+    with pytest.raises(ValueError, match="Unknown DAG dependency"):
+        asyncio.run(dag.run())
+
+    with pytest.raises(ValueError, match="Duplicate"):
+        dag.add("a", noop)
+
+
+def test_node_hook_sees_finished_nodes():
+    seen = []
+
+    async def hook(timing):
+        seen.append((timing.name, timing.status))
+
+    async def one():
+        return 1
+
+    dag = DAG(on_node_done=hook)
+    dag.add("one", one)
+    asyncio.run(dag.run())
+    assert seen == [("one", "ok")]
+
+
+def test_backend_new_copy_is_identical():
+    here = Path(dag.__file__)
+    other = here.parents[3] / "backend-new" / "app" / "pipeline" / "dag.py"
+    if not other.exists():
+        pytest.skip("backend-new is not checked out")
+    assert other.read_bytes() == here.read_bytes()
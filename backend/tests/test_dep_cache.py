@@ -0,0 +1,62 @@
+import asyncio
+from pathlib import Path
+
+from app.services.sandbox.base import ExecResult
+from app.services.sandbox.dep_cache import DepCache, canonical_name, installed, normalize_requirements
+
+
+def test_normalize_sorts_dedupes_and_canonicalizes():
+    content = "Flask_Login >= 0.6\nrequests\n\n# comment\nrequests  # again\nfastapi==0.110.0\n"
+    assert normalize_requirements(content) == ["fastapi==0.110.0", "flask-login>=0.6", "requests"]
+
+
+def test_normalize_skips_provided_packages():
+    assert normalize_requirements("fastapi\nuvicorn\nrequests\n", provided=("FastAPI", "uvicorn")) == ["requests"]
+
+
+def test_normalize_refuses_lines_it_cannot_key_by_content():
+    for line in ("-r other.txt", "git+https://example.com/x.git", "./local_pkg", "/abs/pkg", "[broken"):
+        assert normalize_requirements(f"fastapi\n{line}\n") is None
+
+
+def test_key_depends_on_requirements_and_constraints(tmp_path):
+    cache = DepCache(tmp_path, "py3.11", exec_fn=None)
+    key = cache.key(["requests"], ["idna==3.6"])
+    assert key == cache.key(["requests"], ["idna==3.6"])
+    assert key != cache.key(["requests"], ["idna==3.7"])
+    assert key != cache.key(["httpx"], ["idna==3.6"])
+
+
+def test_installed_lists_dist_info_directories(tmp_path):
+    (tmp_path / "Flask_Login-0.6.3.dist-info").mkdir()
+    (tmp_path / "requests-2.31.0.dist-info").mkdir()
+    (tmp_path / "requests").mkdir()
+    assert installed(tmp_path) == ["flask-login==0.6.3", "requests==2.31.0"]
+    assert canonical_name("Zope.Interface") == "zope-interface"
+
+
+def test_extras_are_kept_unless_the_baseline_provides_them():
+    assert normalize_requirements("uvicorn[standard]\nfastapi\n", provided=("fastapi", "uvicorn")) == ["uvicorn[standard]"]
+    assert normalize_requirements("Uvicorn [ Standard ] >= 0.29\n") == ["uvicorn[standard]>=0.29"]
+    assert normalize_requirements("uvicorn[standard]\n", provided=("uvicorn[standard]",)) == []
+    assert normalize_requirements("passlib[bcrypt,argon2]\n") == ["passlib[argon2,bcrypt]"]
+    assert normalize_requirements("uvicorn[standard\n") is None
+
+
+def test_materialize_prepares_and_publishes_the_set(tmp_path):
+    calls = []
+
+    async def fake_pip(cmd, cwd):
+        calls.append(cmd)
+        assert (cwd / "requirements.txt").read_text() == "uvicorn[standard]\n"
+        site = Path(cmd[cmd.index("--target") + 1])
+        (site / "uvicorn-0.29.0.dist-info").mkdir(parents=True)
+        return ExecResult(0, "installed", "")
+
+    cache = DepCache(tmp_path, "py3.11", fake_pip, offline=True)
+    key, res = asyncio.run(cache.materialize(["pip"], ["uvicorn[standard]"], ["uvicorn==0.29.0"]))
+    assert res.exit_code == 0
+    assert cache.resolved(key) == ["uvicorn==0.29.0"]
+    key2, res = asyncio.run(cache.materialize(["pip"], ["uvicorn[standard]"], ["uvicorn==0.29.0"]))
+    assert key2 == key and len(calls) == 1
+    assert list((tmp_path / "sets").iterdir()) == [cache.entry(key)]
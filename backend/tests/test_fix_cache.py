@@ -0,0 +1,96 @@
+import pytest
+
+pytest.importorskip("sqlmodel")
+
+from app.services.fix_cache import ENTRYPOINT, REQUIREMENTS, FixOps, _apply_ops, _builtin_ops, error_signature  # noqa: E402
+
+TRACE = '''Traceback (most recent call last):
+  File "/tmp/ws/run_{run}/generated_app/backend/main.py", line {line}, in <module>
+    app.mount("/static", StaticFiles(directory="static"))
+NameError: name 'StaticFiles' is not defined
+'''
+
+
+def test_signature_ignores_run_specific_paths_and_line_numbers():
+    a = error_signature(TRACE.format(run=1, line=12))
+    b = error_signature(TRACE.format(run=2, line=40))
+    assert a.key == b.key
+    assert (a.error_type, a.role, a.file) == ("NameError", "entrypoint", "generated_app/backend/main.py")
+    assert a.template == "name 'StaticFiles' is not defined"
+
+
+def test_signature_masks_numbers_and_long_strings():
+    sig = error_signature("ValueError: expected 3 items, got 7 from 'a very long string value with spaces'")
+    assert sig.template == "expected <n> items, got <n> from <str>"
+    assert sig.role == "unknown"
+
+
+def test_pip_errors_become_a_requirements_signature():
+    sig = error_signature("ERROR: No matching distribution found for FastAPI==0.0.1")
+    assert sig.error_type == "PipResolutionError"
+    assert sig.template == "no distribution for 'fastapi'"
+    assert sig.file == REQUIREMENTS
+
+
+def test_text_without_an_exception_has_no_signature():
+    assert error_signature("all good") is None
+
+
+def _workspace(tmp_path, main, requirements="fastapi\nuvicorn\n"):
+    backend = tmp_path / "generated_app" / "backend"
+    backend.mkdir(parents=True)
+    (backend / "main.py").write_text(main)
+    (backend / "requirements.txt").write_text(requirements)
+    return tmp_path
+
+
+def test_apply_ops_adds_imports_after_the_last_import(tmp_path):
+    ws = _workspace(tmp_path, "import os\nfrom fastapi import FastAPI\n\napp = FastAPI()\n")
+    assert _apply_ops(ws, FixOps(add_imports=["from fastapi.staticfiles import StaticFiles"]), ENTRYPOINT)
+    assert (ws / ENTRYPOINT).read_text().splitlines()[:3] == [
+        "import os", "from fastapi import FastAPI", "from fastapi.staticfiles import StaticFiles",
+    ]
+    # Already there: nothing to do
+    assert not _apply_ops(ws, FixOps(add_imports=["from fastapi.staticfiles import StaticFiles"]), ENTRYPOINT)
+
+
+def test_apply_ops_replaces_lines_keeping_indentation(tmp_path):
+    ws = _workspace(tmp_path, "def f():\n    return x\n")
+    assert _apply_ops(ws, FixOps(replace_lines=[("return x", "return 1")]), ENTRYPOINT)
+    assert (ws / ENTRYPOINT).read_text() == "def f():\n    return 1\n"
+
+
+def test_apply_ops_changes_nothing_when_a_line_is_missing(tmp_path):
+    ws = _workspace(tmp_path, "x = 1\n")
+    ops = FixOps(add_imports=["import os"], replace_lines=[("y = 2", "y = 3")])
+    assert not _apply_ops(ws, ops, ENTRYPOINT)
+    assert (ws / ENTRYPOINT).read_text() == "x = 1\n"
+
+
+def test_apply_ops_edits_requirements_and_makes_dirs(tmp_path):
+    ws = _workspace(tmp_path, "x = 1\n", requirements="fastapi==0.0.1\nuvicorn[standard]\n")
+    ops = FixOps(remove_requirements=["fastapi", "uvicorn"], add_requirements=["fastapi"], make_dirs=["static"])
+    assert _apply_ops(ws, ops, ENTRYPOINT)
+    assert (ws / REQUIREMENTS).read_text() == "fastapi\n"
+    assert (ws / "generated_app" / "backend" / "static").is_dir()
+
+
+def test_missing_directory_fix_matches_path_like_names(tmp_path):
+    ws = _workspace(tmp_path, "x = 1\n")
+    for name, created in (("static", "generated_app/backend/static"),
+                          ("frontend/static", "generated_app/backend/frontend/static"),
+                          ("../frontend", "generated_app/frontend")):
+        sig = error_signature(f"RuntimeError: Directory '{name}' does not exist")
+        ops, _ = _builtin_ops(sig)
+        assert ops.make_dirs == [name]
+        assert _apply_ops(ws, ops, ENTRYPOINT)
+        assert (ws / created).is_dir()
+    # Same signature for every path, so learned outcomes are shared
+    assert error_signature("RuntimeError: Directory 'a/b' does not exist").key == sig.key
+
+
+def test_directories_outside_the_workspace_are_refused(tmp_path):
+    ws = _workspace(tmp_path / "ws", "x = 1\n")
+    assert _builtin_ops(error_signature("RuntimeError: Directory '/etc/x' does not exist")) is None
+    assert not _apply_ops(ws, FixOps(make_dirs=["../../../escape"]), ENTRYPOINT)
+    assert not (tmp_path / "escape").exists()
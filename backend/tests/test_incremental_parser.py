@@ -0,0 +1,60 @@
+import json
+
+from app.core.utils import IncrementalFilesParser
+
+RESPONSE = json.dumps({
+    "plan": "two files",
+    "files": [
+        {"path": "generated_app/backend/main.py", "content": "def f():\n    return {'a': [1, 2]}\n"},
+        {"path": "generated_app/frontend/index.html", "content": "<p>\"}]{\"</p>"},
+    ],
+    "manifest": [],
+})
+
+
+def feed_all(chunks):
+    parser = IncrementalFilesParser()
+    found = []
+    for chunk in chunks:
+        found.extend(parser.feed(chunk))
+    return parser, found
+
+
+def test_whole_response_yields_every_file():
+    parser, found = feed_all([RESPONSE])
+    assert [f["path"] for f in found] == ["generated_app/backend/main.py", "generated_app/frontend/index.html"]
+    assert found[1]["content"] == '<p>"}]{"</p>'
+    assert parser.closed
+
+
+def test_one_character_chunks_match_whole_response():
+    _, whole = feed_all([RESPONSE])
+    _, split = feed_all(list(RESPONSE))
+    assert split == whole
+
+
+def test_file_is_emitted_as_soon_as_its_object_closes():
+    parser = IncrementalFilesParser()
+    first_end = RESPONSE.index("}, {") + 1  # the "}" inside main.py's content doesn't count
+    assert [f["path"] for f in parser.feed(RESPONSE[:first_end])] == ["generated_app/backend/main.py"]
+    assert [f["path"] for f in parser.feed(RESPONSE[first_end:])] == ["generated_app/frontend/index.html"]
+
+
+def test_no_files_array_yields_nothing():
+    _, found = feed_all(['{"plan": "x", "manifest": []}'])
+    assert found == []
+
+
+def test_files_key_inside_a_string_or_nested_object_is_not_the_array():
+    response = json.dumps({
+        "plan": 'Respond with {"files": [{"path": "decoy.py", "content": "x"}]}',
+        "meta": {"files": [{"path": "nested.py", "content": "y"}]},
+        "files": [{"path": "real.py", "content": "z"}],
+    })
+    _, found = feed_all(list(response))
+    assert [f["path"] for f in found] == ["real.py"]
+
+
+def test_prose_before_the_json_is_skipped():
+    _, found = feed_all(['Here is the "app" you asked for:\n```json\n', RESPONSE, "\n```"])
+    assert len(found) == 2
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from app.services.llm.base import LLMClient, request_key
+from app.services.llm.cache import CachedLLMClient, DiskLRUCache
+
+
+class ScriptedLLM(LLMClient):
+    """Returns the scripted replies in order and counts upstream calls."""
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    async def chat(self, model, system=None, user=None, **kwargs):
+        self.calls += 1
+        return self.replies[min(self.calls, len(self.replies)) - 1]
+
+
+def test_request_key_ignores_control_kwargs():
+    base = request_key("m", "s", "u", temperature=0.2)
+    assert request_key("m", "s", "u", temperature=0.2, cache=False, priority=0, timeout=5) == base
+    assert request_key("m", "s", "u", temperature=0.5) != base
+    assert request_key("m", "s", "other", temperature=0.2) != base
+
+
+def test_disk_cache_round_trip_and_lru_eviction(tmp_path):
+    store = DiskLRUCache(tmp_path, max_bytes=400, ttl_seconds=0)
+    store.put("aa1", "x" * 100)
+    store.put("bb2", "y" * 100)
+    assert store.get("aa1") == "x" * 100  # aa1 is now the most recent
+    store.put("cc3", "z" * 100)
+    assert store.get("bb2") is None
+    assert store.get("aa1") is not None and store.get("cc3") is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_disk_cache_index_survives_restart(tmp_path):
+    DiskLRUCache(tmp_path, max_bytes=10_000, ttl_seconds=0).put("aa1", "kept")
+    assert DiskLRUCache(tmp_path, max_bytes=10_000, ttl_seconds=0).get("aa1") == "kept"
+
+
+def test_disk_cache_expires_entries(tmp_path, monkeypatch):
+    store = DiskLRUCache(tmp_path, max_bytes=10_000, ttl_seconds=60)
+    store.put("aa1", "old")
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert store.get("aa1") is None
+    assert store.stats()["expired"] == 1
+
+
+def test_cached_client_serves_repeats_from_cache(tmp_path):
+    inner = ScriptedLLM("answer")
+    client = CachedLLMClient(inner, DiskLRUCache(tmp_path, 10_000, 0))
+    assert asyncio.run(client.chat("m", "s", "u")) == "answer"
+    assert asyncio.run(client.chat("m", "s", "u")) == "answer"
+    assert inner.calls == 1
+    asyncio.run(client.chat("m", "s", "u", cache=False))
+    assert inner.calls == 2
+
+
+def test_cached_client_never_replays_invalid_responses(tmp_path):
+    # A retry with the same prompt must reach the model again, not get the bad reply back
+    inner = ScriptedLLM("not json", '{"ok": true}')
+    client = CachedLLMClient(inner, DiskLRUCache(tmp_path, 10_000, 0))
+    valid = lambda raw: raw.startswith("{")
+    assert asyncio.run(client.chat("m", "s", "u", validate=valid)) == "not json"
+    assert asyncio.run(client.chat("m", "s", "u", validate=valid)) == '{"ok": true}'
+    assert asyncio.run(client.chat("m", "s", "u", validate=valid)) == '{"ok": true}'
+    assert inner.calls == 2
+
+
+def test_cached_client_discards_stored_entries_that_fail_validation(tmp_path):
+    inner = ScriptedLLM("stale", "fresh!")
+    client = CachedLLMClient(inner, DiskLRUCache(tmp_path, 10_000, 0))
+    asyncio.run(client.chat("m", "s", "u"))
+    assert asyncio.run(client.chat("m", "s", "u", validate=lambda raw: raw.endswith("!"))) == "fresh!"
+    assert inner.calls == 2
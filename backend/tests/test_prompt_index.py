@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("sqlmodel")
+
+from app.services.prompt_index import _bands, minhash, similarity, tokens  # noqa: E402
+
+
+def test_tokens_drop_stopwords_and_plurals():
+    assert tokens("Build me a todo app with tags") == {"todo", "tag"}
+    assert tokens("") == set()
+
+
+def test_enhanced_tokens_include_bigrams():
+    assert tokens("Todo list with due dates", "enhanced") == {"todo", "list", "due", "date", "todo list", "list due", "due date"}
+
+
+def test_minhash_estimates_jaccard_similarity():
+    a = minhash({f"w{i}" for i in range(100)})
+    b = minhash({f"w{i}" for i in range(50, 150)})  # true Jaccard 1/3
+    assert similarity(a, a) == 1.0
+    assert abs(similarity(a, b) - 1 / 3) < 0.15
+    assert similarity(a, minhash({"unrelated", "words"})) < 0.1
+    assert minhash(set()) is None
+
+
+def test_similar_prompts_share_an_lsh_band():
+    a = minhash(tokens("todo list with tags, due dates and reminders"))
+    b = minhash(tokens("a todo list with tags and due dates"))
+    c = minhash(tokens("weather dashboard showing forecast charts"))
+    assert set(_bands(a)) & set(_bands(b))
+    assert not set(_bands(a)) & set(_bands(c))
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    from sqlmodel import SQLModel, create_engine
+    from app.services import prompt_index
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'index.db'}")
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(prompt_index, "engine", engine)
+    return prompt_index.PromptIndex()
+
+
+def test_add_skips_near_identical_entries_for_the_same_spec(index):
+    spec = {"app_name": "todo", "pages": ["home"]}
+    prompt = "todo list with tags, due dates and reminders"
+    enhanced = "A todo list app where tasks have tags, due dates and email reminders."
+    assert index.add(1, prompt, enhanced, spec)
+    assert not index.add(2, prompt, enhanced, dict(spec))
+    assert not index.add(3, prompt + ".", enhanced, spec)
+    # A different spec for the same prompt is worth keeping
+    assert index.add(4, prompt, enhanced, {"app_name": "todo", "pages": ["home", "settings"]})
+    assert index.add(5, "weather dashboard with forecast charts", "A weather dashboard.", spec)
+    assert index.query(prompt, "prompt", 0.9).run_id == 4
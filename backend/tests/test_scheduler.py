@@ -0,0 +1,64 @@
+import asyncio
+
+from app.services.llm.scheduler import LLMScheduler
+
+
+async def _grant_order(requests, limit=1):
+    """Queue (name, priority, run_id) requests behind a held slot; return the order they run in."""
+    scheduler = LLMScheduler(default_limit=limit)
+    order = []
+    gate = asyncio.Event()
+
+    async def holder():
+        async with scheduler.slot("m"):
+            await gate.wait()
+
+    async def request(name, priority, run_id):
+        async with scheduler.slot("m", priority=priority, run_id=run_id):
+            order.append(name)
+
+    first = asyncio.ensure_future(holder())
+    await asyncio.sleep(0)
+    tasks = []
+    for name, priority, run_id in requests:
+        tasks.append(asyncio.ensure_future(request(name, priority, run_id)))
+        await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    return order
+
+
+def test_lower_priority_value_runs_first():
+    order = asyncio.run(_grant_order([("codegen", 3, 1), ("spec", 2, 2), ("repair", 0, 3)]))
+    assert order == ["repair", "spec", "codegen"]
+
+
+def test_runs_take_turns_within_a_priority():
+    requests = [("a1", 2, 1), ("a2", 2, 1), ("a3", 2, 1), ("b1", 2, 2), ("b2", 2, 2)]
+    order = asyncio.run(_grant_order(requests))
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_limit_caps_concurrency_and_cancelled_waiters_are_skipped():
+    async def main():
+        scheduler = LLMScheduler(default_limit=2)
+        active = peak = 0
+
+        async def work():
+            nonlocal active, peak
+            async with scheduler.slot("m"):
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        tasks = [asyncio.ensure_future(work()) for _ in range(6)]
+        await asyncio.sleep(0)
+        tasks[4].cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return peak, sum(isinstance(r, asyncio.CancelledError) for r in results), scheduler.stats()["m"]
+
+    peak, cancelled, stats = asyncio.run(main())
+    assert peak == 2
+    assert cancelled == 1
+    assert stats["active"] == 0 and stats["queued"] == 0
@@ -0,0 +1,77 @@
+import asyncio
+
+from app.services.llm.base import LLMClient
+from app.services.llm.singleflight import SingleFlightLLMClient
+
+
+class SlowLLM(LLMClient):
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+        self.release = None
+
+    async def chat(self, model, system=None, user=None, **kwargs):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"{model}:{user}"
+
+    async def stream_chat(self, model, system=None, user=None, **kwargs):
+        self.calls += 1
+        for part in ("a", "b", "c"):
+            await self.release.wait()
+            yield part
+
+
+def test_identical_concurrent_requests_share_one_call():
+    async def main():
+        inner = SlowLLM()
+        inner.release = asyncio.Event()
+        client = SingleFlightLLMClient(inner)
+        tasks = [asyncio.ensure_future(client.chat("m", "s", "u")) for _ in range(3)]
+        other = asyncio.ensure_future(client.chat("m", "s", "v"))
+        await asyncio.sleep(0)
+        inner.release.set()
+        return await asyncio.gather(*tasks, other), inner.calls
+
+    results, calls = asyncio.run(main())
+    assert results == ["m:u", "m:u", "m:u", "m:v"]
+    assert calls == 2
+
+
+def test_upstream_call_is_cancelled_when_every_waiter_gives_up():
+    async def main():
+        inner = SlowLLM()
+        inner.release = asyncio.Event()
+        client = SingleFlightLLMClient(inner)
+        tasks = [asyncio.ensure_future(client.chat("m", "s", "u")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        return inner.cancelled
+
+    assert asyncio.run(main()) == 1
+
+
+def test_streams_are_fanned_out_to_every_subscriber():
+    async def main():
+        inner = SlowLLM()
+        inner.release = asyncio.Event()
+        client = SingleFlightLLMClient(inner)
+
+        async def collect():
+            return "".join([chunk async for chunk in client.stream_chat("m", "s", "u")])
+
+        tasks = [asyncio.ensure_future(collect()) for _ in range(2)]
+        await asyncio.sleep(0)
+        inner.release.set()
+        return await asyncio.gather(*tasks), inner.calls
+
+    results, calls = asyncio.run(main())
+    assert results == ["abc", "abc"]
+    assert calls == 1
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("sqlmodel")
+
+from app.services.llm.providers.ollama_client import _StopMarkerFilter  # noqa: E402
+
+
+def run(chunks, markers=("<|im_end|>", "User:")):
+    f = _StopMarkerFilter(list(markers))
+    out = []
+    for chunk in chunks:
+        out.append(f.feed(chunk))
+        if f.stopped:
+            break
+    out.append(f.flush())
+    return "".join(out), f.stopped
+
+
+def test_text_without_markers_passes_through():
+    assert run(["hello ", "world"]) == ("hello world", False)
+
+
+def test_stream_is_cut_at_the_marker():
+    assert run(["answer<|im_end|>junk", "more"]) == ("answer", True)
+
+
+def test_marker_split_across_chunks_is_held_back_and_cut():
+    f = _StopMarkerFilter(["<|im_end|>"])
+    assert f.feed("done<|im") == "done"
+    assert f.feed("_end|>tail") == ""
+    assert f.stopped
+
+
+def test_partial_marker_prefix_is_released_when_it_turns_out_to_be_text():
+    assert run(["Use", "d to it"], markers=("User:",)) == ("Used to it", False)
+    assert run(["a <", "b"], markers=("<|im_end|>",)) == ("a <b", False)
@@ -0,0 +1,46 @@
+import asyncio
+
+from app.services.sandbox import syntax_check
+from app.services.sandbox.syntax_check import check_files, compile_error
+
+
+def test_compile_error_reports_file_and_line():
+    assert compile_error("ok.py", b"x = 1\n") is None
+    error = compile_error("bad.py", b"x = 1\ndef f(:\n")
+    assert error.startswith('  File "bad.py", line 2')
+    assert "SyntaxError" in error
+
+
+def test_check_files_returns_only_broken_files(tmp_path):
+    good, bad, missing = tmp_path / "good.py", tmp_path / "bad.py", tmp_path / "missing.py"
+    good.write_text("x = 1\n")
+    bad.write_text("def f(:\n")
+    errors = asyncio.run(check_files([good, bad, missing]))
+    assert list(errors) == [bad, missing]
+    assert "SyntaxError" in errors[bad]
+    assert errors[missing].startswith("OSError")
+
+
+def test_unchanged_files_are_served_from_the_cache(tmp_path, monkeypatch):
+    path = tmp_path / "bad.py"
+    path.write_text("def f(:\n")
+    first = asyncio.run(check_files([path]))
+    monkeypatch.setattr(syntax_check, "_compile_batch", lambda items: 1 / 0)
+    assert asyncio.run(check_files([path])) == first
+    # A change in content misses the cache
+    path.write_text("def g(:\n")
+    monkeypatch.undo()
+    assert "SyntaxError" in asyncio.run(check_files([path]))[path]
+
+
+def test_large_batches_use_the_process_pool(tmp_path):
+    paths = []
+    for i in range(syntax_check.PARALLEL_MIN_FILES):
+        p = tmp_path / f"m{i}.py"
+        p.write_text(f"x = {i}\n" if i % 2 else f"x = ({i}\n")
+        paths.append(p)
+    try:
+        errors = asyncio.run(check_files(paths))
+    finally:
+        syntax_check.shutdown()
+    assert sorted(errors) == sorted(paths[0::2])
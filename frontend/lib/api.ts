@@ -92,9 +92,10 @@ async function pollLogs(runId: number, onLog: (log: string) => void) {
 
             // Check terminal states
             const s = run.status?.toLowerCase();
-            if (s === 'completed' || s === 'success' || s === 'failed') {
+            if (s === 'completed' || s === 'success' || s === 'stopped' || s === 'failed' || s === 'cancelled') {
                 finished = true;
                 if (s === 'failed') throw new Error("Generation process failed on backend.");
+                if (s === 'cancelled') throw new Error("Generation was cancelled.");
             }
         } catch (err) {
             console.error("[API] Polling error:", err);